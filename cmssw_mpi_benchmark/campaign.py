@@ -0,0 +1,346 @@
+import hashlib
+import itertools
+import json
+import os
+import sys
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    import tomli as tomllib
+
+from search import get_search_options
+from topology import (allocate_cpus, check_nic_locality, get_host_topology, get_memory_nodes, get_topology_file,
+                      select_nic)
+
+
+# Declarative benchmark campaigns.
+#
+# A campaign spec (TOML, see campaigns/default.toml) describes:
+#   [campaign]   options of the whole campaign (repetitions, print-only mode, parallelism, ...)
+#   [campaign.adaptive]  optional stopping rule for the repetitions (see stats.StoppingRule)
+#   [defaults]   Config fields common to all setups (e.g. mpi_impl, ts grid)
+#   [hosts.X]    hostname, cpu_offset (or placement, see topology.py) and UCX device of each machine
+#   [[setup]]    one block per setup (Milan standalone, Milan-Genoa, ...)
+#
+# Each enabled setup is expanded into the cartesian product of its "sweep" lists, its
+# "variants" and the ts grid, and then repeated for every runID. The result is a plan:
+# a list of plain dicts with the fields of doit.Config, cached on disk by spec hash.
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SPEC = os.path.join(HARNESS_DIR, "campaigns", "default.toml")
+
+CAMPAIGN_DEFAULTS = {
+    "print_cmd_no_run": True,
+    "run_first_ts_pair_only": False,
+    "first_run_id": 0,
+    "last_run_id": 1,
+    "max_parallel_runs": 1,
+    "socket_exclusive_size": 0,
+    "log_dir": "logs",
+    "journal": "journal.jsonl",
+    "results_db": "results.db",
+    "max_retries": 1,
+    "startup_timeout": 1200,
+    "stall_timeout": 300,
+    "progress_every": 30,
+    "max_events": 1300,
+    "time_budget": 0,
+    "steady_state_tolerance": 0,
+    "steady_state_min_duration": 20,
+    "samples_per_run": 0,
+    "telemetry_interval": 1.0,
+    "order": "source",
+    "campaign_time_budget": 0,
+    "default_run_duration": 600,
+    "config_cache": False,
+    "stage_dir": "",
+    "stage_max_gb": 0,
+    "input_cache": "as-is",
+    "input_manifest": "",
+}
+
+# Config fields that can be set from a spec
+CONFIG_FIELDS = [
+    "mpi_impl", "environment", "ts", "label",
+    "host_local", "host_remote", "is_same_machine",
+    "ucx_tls", "ucx_options", "ucx_net_devices_local", "ucx_net_devices_remote",
+    "config_local", "config_remote", "cpus_local", "cpus_remote",
+    "cuda_visible_devices_local", "cuda_visible_devices_remote",
+    "mem_policy_local", "mem_policy_remote", "mem_nodes_local", "mem_nodes_remote",
+]
+
+# Spec-only keys, consumed while expanding a setup
+SETUP_KEYS = ["local", "remote", "sweep", "variants", "enabled", "search",
+              "cpu_offset_local", "cpu_offset_remote", "label_suffix",
+              "placement_local", "placement_remote", "policy_local", "policy_remote",
+              "topology_local", "topology_remote"]
+
+
+def load_spec(spec_path: str):
+    with open(spec_path, "rb") as f:
+        raw = f.read()
+    return tomllib.loads(raw.decode()), raw
+
+
+# Modules the expansion of a spec depends on: CPU sets, NICs and memory nodes come from topology.py
+EXPANSION_MODULES = ["campaign.py", "topology.py", "search.py"]
+
+
+# The plan depends on the spec, on how it is expanded and on the topologies of its hosts
+# (port states included), so all of them are hashed. A topology not discovered yet hashes as
+# missing: the plan is expanded again once it is cached.
+def spec_hash(raw: bytes, spec: dict):
+    digest = hashlib.sha256(raw)
+    for name in EXPANSION_MODULES:
+        with open(os.path.join(HARNESS_DIR, name), "rb") as f:
+            digest.update(f.read())
+    for name, host in sorted(spec.get("hosts", {}).items()):
+        path = get_topology_file(name, host)
+        digest.update(name.encode())
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        else:
+            digest.update(b"missing")
+    return digest.hexdigest()[:16]
+
+
+def get_campaign_options(spec: dict):
+    options = dict(CAMPAIGN_DEFAULTS)
+    options.update(spec.get("campaign", {}))
+    if not os.path.isabs(options["log_dir"]):
+        options["log_dir"] = os.path.join(HARNESS_DIR, options["log_dir"])
+    return options
+
+
+def resolve_path(path: str):
+    if path == "" or os.path.isabs(path):
+        return path
+    return os.path.join(HARNESS_DIR, path)
+
+
+def apply_host(entry: dict, hosts: dict, role: str):
+    # role is "local" or "remote"
+    if role not in entry:
+        return
+    name = entry[role]
+    if name not in hosts:
+        print("Setup %s uses unknown host %s" % (entry.get("label", "?"), name))
+        sys.exit(1)
+    host = hosts[name]
+    entry.setdefault("host_" + role, host.get("hostname", ""))
+    entry.setdefault("cpu_offset_" + role, host.get("cpu_offset", 0))
+    # CPU sets from a placement policy (see topology.py) instead of cpu_offset
+    if "placement" in host:
+        entry.setdefault("placement_" + role, host["placement"])
+    if "policy_" + role in entry:
+        entry["placement_" + role] = dict(entry.get("placement_" + role, {}), policy=entry["policy_" + role])
+    if "placement_" + role in entry:
+        entry.setdefault("topology_" + role, get_host_topology(name, host))
+    # the NIC is only used to reach another machine
+    uses_network = entry.get("config_remote", "") != "" and not entry.get("is_same_machine", False)
+    if uses_network and "ucx_net_devices" in host:
+        entry.setdefault("ucx_net_devices_" + role, host["ucx_net_devices"])
+    if entry.get("ucx_net_devices_" + role, "").startswith("auto"):
+        entry.setdefault("topology_" + role, get_host_topology(name, host))
+    if "mem_policy" in host:
+        entry.setdefault("mem_policy_" + role, host["mem_policy"])
+    if entry.get("mem_policy_" + role, "") in ["membind", "preferred"] and "mem_nodes_" + role not in entry:
+        entry.setdefault("topology_" + role, get_host_topology(name, host))
+
+
+def allocate_rank_cpus(entry: dict, role: str, ts, exclude):
+    placement = dict(entry["placement_" + role])
+    count = placement.pop("count", ts[0])
+    try:
+        return allocate_cpus(entry["topology_" + role], count, placement, exclude)
+    except ValueError as e:
+        print("Setup %s, %s rank: %s" % (entry["label"], role, e))
+        sys.exit(1)
+
+
+# Resolves "auto" UCX devices and warns about devices far from the CPUs of the rank, when
+# the topology of its host is known (see topology.py)
+def apply_nic_locality(planned: dict, entry: dict, role: str):
+    topology = entry.get("topology_" + role)
+    device = planned.get("ucx_net_devices_" + role, "")
+    if topology is None or device == "":
+        return
+    cpus = planned["cpus_" + role]
+    if device in ["auto", "auto-remote"]:
+        try:
+            planned["ucx_net_devices_" + role] = select_nic(topology, cpus, farthest=device == "auto-remote")
+        except ValueError as e:
+            print("Setup %s, %s rank: %s" % (entry["label"], role, e))
+            sys.exit(1)
+        if device == "auto-remote":
+            return
+    for warning in check_nic_locality(topology, cpus, planned["ucx_net_devices_" + role]):
+        print("Warning: setup %s, %s rank, [t,s] = [%d,%d]: %s" % (planned["label"], role, *planned["ts"], warning))
+
+
+# Why the ranks of an entry cannot run a [threads, streams] pair on their CPUs (one thread
+# per CPU), or None if they can or the topology of their host is not known
+def get_fit_error(entry: dict, ts):
+    cpus = {}
+    for role in ["local", "remote"] if entry.get("config_remote", "") != "" else ["local"]:
+        topology = entry.get("topology_" + role)
+        # both ranks on the same machine never share a core
+        exclude = cpus["local"] if role == "remote" and entry.get("is_same_machine", False) else []
+        if "cpus_" + role in entry:
+            cpus[role] = entry["cpus_" + role]
+        elif "placement_" + role in entry:
+            placement = dict(entry["placement_" + role])
+            try:
+                cpus[role] = allocate_cpus(topology, placement.pop("count", ts[0]), placement, exclude)
+            except ValueError as e:
+                return "%s rank: %s" % (role, e)
+        else:
+            offset = entry.get("cpu_offset_" + role, 0)
+            cpus[role] = list(range(offset, offset + ts[0]))
+            if topology is not None and cpus[role][-1] > max(cpu["id"] for cpu in topology["cpus"]):
+                return "%s rank: CPUs %d-%d, %s has %d CPUs" % (role, offset, cpus[role][-1], topology["hostname"],
+                                                                len(topology["cpus"]))
+            if set(cpus[role]) & set(exclude):
+                return "%s rank: CPUs %d-%d overlap those of the local rank" % (role, offset, cpus[role][-1])
+        if len(cpus[role]) < ts[0]:
+            return "%s rank: %d threads on %d CPUs" % (role, ts[0], len(cpus[role]))
+    return None
+
+
+# Builds the plan entry of a setup for a given [threads, streams] pair
+def make_entry(entry: dict, ts):
+    planned = dict(entry)
+    planned["ts"] = list(ts)
+    if "cpus_local" not in entry:
+        if "placement_local" in entry:
+            planned["cpus_local"] = allocate_rank_cpus(entry, "local", ts, [])
+        else:
+            offset = entry.get("cpu_offset_local", 0)
+            planned["cpus_local"] = list(range(offset, offset + ts[0]))
+    if "cpus_remote" not in entry and entry.get("config_remote", "") != "":
+        if "placement_remote" in entry:
+            # both ranks on the same machine never share a core
+            exclude = planned["cpus_local"] if entry.get("is_same_machine", False) else []
+            planned["cpus_remote"] = allocate_rank_cpus(entry, "remote", ts, exclude)
+        else:
+            offset = entry.get("cpu_offset_remote", 0)
+            planned["cpus_remote"] = list(range(offset, offset + ts[0]))
+    planned["label"] = (entry["label"] + entry.get("label_suffix", "")).format(**planned)
+    for role in ["local", "remote"] if planned.get("config_remote", "") != "" else ["local"]:
+        apply_nic_locality(planned, entry, role)
+        policy = planned.get("mem_policy_" + role, "")
+        if policy not in ["", "localalloc"] and "mem_nodes_" + role not in planned:
+            if policy == "interleave" or "topology_" + role in entry:
+                planned["mem_nodes_" + role] = get_memory_nodes(entry.get("topology_" + role), planned["cpus_" + role], policy)
+    planned["config_local"] = resolve_path(planned.get("config_local", ""))
+    planned["config_remote"] = resolve_path(planned.get("config_remote", ""))
+
+    for key in list(planned):
+        if key in SETUP_KEYS:
+            del planned[key]
+        elif key not in CONFIG_FIELDS:
+            print("Unknown key %s in setup %s" % (key, entry["label"]))
+            sys.exit(1)
+    return planned
+
+
+# Expands the sweep lists and variants of a setup, without the ts grid
+def expand_setup_variants(setup: dict, defaults: dict, hosts: dict):
+    setup = dict(setup)
+    sweep = dict(defaults.get("sweep", {}))
+    sweep.update(setup.pop("sweep", {}))
+    variants = setup.pop("variants", [{}])
+
+    entries = []
+    for values in itertools.product(*sweep.values()):
+        for variant in variants:
+            entry = {k: v for k, v in defaults.items() if k != "sweep"}
+            entry.update(setup)
+            entry.update(zip(sweep.keys(), values))
+            entry.update(variant)
+            apply_host(entry, hosts, "local")
+            apply_host(entry, hosts, "remote")
+            entries.append(entry)
+    return entries
+
+
+def expand_setup(setup: dict, defaults: dict, hosts: dict, run_first_ts_pair_only: bool):
+    entries = []
+    for entry in expand_setup_variants(setup, defaults, hosts):
+        for ts in entry["ts"]:
+            entries.append(make_entry(entry, ts))
+            if run_first_ts_pair_only: break
+    return entries
+
+
+def expand_spec(spec: dict):
+    options = get_campaign_options(spec)
+    defaults = spec.get("defaults", {})
+    hosts = spec.get("hosts", {})
+
+    entries = []
+    for setup in spec.get("setup", []):
+        if setup.get("enabled", True):
+            entries += expand_setup(setup, defaults, hosts, options["run_first_ts_pair_only"])
+
+    # with adaptive repetitions, plan up to max_runs; the executor stops earlier if possible
+    last_run_id = options["last_run_id"]
+    if "adaptive" in options:
+        last_run_id = options["first_run_id"] + options["adaptive"]["max_runs"]
+
+    plan = []
+    seen = set()
+    for run_id in range(options["first_run_id"], last_run_id):  # [first,last)
+        for entry in entries:
+            key = (entry.get("mpi_impl", ""), entry["label"], tuple(entry["ts"]), run_id)
+            if key in seen:
+                print("Duplicated run %s in the plan. Use {field} placeholders or label_suffix "
+                      "to give swept setups different labels." % (key,))
+                sys.exit(1)
+            seen.add(key)
+            plan.append(dict(entry, runID=run_id))
+    return plan
+
+
+# Entries of the enabled setups (one per sweep point and variant) and their search options,
+# for doit.py --search
+def expand_search_entries(spec_path: str):
+    spec, _ = load_spec(spec_path)
+    defaults = spec.get("defaults", {})
+    hosts = spec.get("hosts", {})
+    entries = []
+    for setup in spec.get("setup", []):
+        if setup.get("enabled", True):
+            search_options = get_search_options(defaults, setup)
+            for entry in expand_setup_variants(setup, defaults, hosts):
+                # the candidates that do not fit on the CPUs of the hosts are dropped (see get_fit_error)
+                # (unless the host has no hostname and no saved topology, e.g. NGT hosts)
+                for role in ["local", "remote"] if entry.get("config_remote", "") != "" else ["local"]:
+                    if role not in entry or "cpus_" + role in entry:
+                        continue
+                    host = hosts[entry[role]]
+                    if host.get("hostname", "") != "" or os.path.isfile(get_topology_file(entry[role], host)):
+                        entry.setdefault("topology_" + role, get_host_topology(entry[role], host))
+                entries.append((entry, search_options))
+    return entries
+
+
+# Expands a spec into a plan, reusing the compiled plan if the spec did not change
+def load_plan(spec_path: str):
+    spec, raw = load_spec(spec_path)
+    options = get_campaign_options(spec)
+    options["spec_hash"] = spec_hash(raw, spec)
+
+    cache_dir = os.path.join(options["log_dir"], "plan_cache")
+    cache_file = os.path.join(cache_dir, options["spec_hash"] + ".json")
+    if os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            return options, json.load(f)
+
+    plan = expand_spec(spec)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file, "w") as f:
+        json.dump(plan, f)
+    return options, plan
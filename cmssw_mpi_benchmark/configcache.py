@@ -0,0 +1,145 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import runpy
+import subprocess
+import sys
+import time
+
+
+# Cache of the expanded configs, so that cmsRun does not process the python configuration of
+# the whole HLT menu (hlt_v6_cff, customizeHLTforCMSSW, GlobalTag, insert_modules_before in
+# hlt_local.py, ...) at every launch.
+#
+# A config is "compiled" once: it is run in a separate python process, and the resulting
+# cms.Process is pickled to config_cache/<config>_<hash>.pkl. The hash covers the python files
+# of the config directory, the CMSSW release and area, and the paths the configs probe at
+# configuration time (PROBED_PATHS); the other modules the config imported from outside the
+# release (e.g. the menu from CMSSW_BASE) are listed with their hashes in the .json next to
+# the pickle, and the config is compiled again if any of them changed.
+#
+# The per-run parameters (EXPERIMENT_THREADS, _STREAMS, _MAX_EVENTS, _NAME, _OUTPUT_DIR) are
+# set to placeholders while compiling, and configs/cached_cfg.py, given to cmsRun with the
+# pickle, replaces them from the environment of the run. So one artifact serves every ts.
+#
+# Enabled with config_cache = true in the campaign. The cache is in the harness directory,
+# which the remote ranks read anyway (for their config); it is never cleaned automatically.
+#
+# Usage:
+#   python3 configcache.py compile CONFIG OUTPUT    (used by the harness, in the CMSSW environment)
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(HARNESS_DIR, "config_cache")
+LOADER = os.path.join(HARNESS_DIR, "configs", "cached_cfg.py")
+
+RELEASE_VARIABLES = ["CMSSW_VERSION", "CMSSW_BASE", "CMSSW_RELEASE_BASE", "SCRAM_ARCH"]
+# hlt.py chooses its input files depending on this path
+PROBED_PATHS = ["/cmsnfsgpu_data/gpu_data/"]
+# see configs/cached_cfg.py
+PLACEHOLDERS = {
+    "EXPERIMENT_THREADS": "1001",
+    "EXPERIMENT_STREAMS": "1002",
+    "EXPERIMENT_MAX_EVENTS": "1003",
+    "EXPERIMENT_NAME": "@EXPERIMENT_NAME@",
+    "EXPERIMENT_OUTPUT_DIR": "@EXPERIMENT_OUTPUT_DIR@",
+}
+
+
+def hash_file(path: str):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_config_hash(config_path: str):
+    digest = hashlib.sha256()
+    digest.update(os.path.basename(config_path).encode())
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+    for name in sorted(os.listdir(config_dir)):
+        if name.endswith(".py"):
+            digest.update(name.encode() + hash_file(os.path.join(config_dir, name)).encode())
+    for variable in RELEASE_VARIABLES:
+        digest.update(("%s=%s" % (variable, os.environ.get(variable, ""))).encode())
+    for path in PROBED_PATHS:
+        digest.update(("%s:%d" % (path, os.path.exists(path))).encode())
+    return digest.hexdigest()[:16]
+
+
+def get_cached_config(config_path: str):
+    name = os.path.splitext(os.path.basename(config_path))[0]
+    return os.path.join(CACHE_DIR, "%s_%s.pkl" % (name, get_config_hash(config_path)))
+
+
+def is_valid(pickle_path: str):
+    metadata_path = pickle_path[:-len(".pkl")] + ".json"
+    if not os.path.isfile(pickle_path) or not os.path.isfile(metadata_path):
+        return False
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    for path, digest in metadata["dependencies"].items():
+        if not os.path.isfile(path) or hash_file(path) != digest:
+            return False
+    return True
+
+
+# Compiles the config if its artifact is missing or outdated, and returns the artifact
+def compile_config(config_path: str):
+    pickle_path = get_cached_config(config_path)
+    if is_valid(pickle_path):
+        return pickle_path
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    print("Compiling %s to %s" % (config_path, pickle_path))
+    env = dict(os.environ, **PLACEHOLDERS)
+    start = time.time()
+    # the python of the CMSSW environment, which the harness may not be running with
+    result = subprocess.run(["python3", os.path.abspath(__file__), "compile", os.path.abspath(config_path),
+                             pickle_path], cwd=os.path.dirname(os.path.abspath(config_path)), env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("Could not compile %s:\n%s" % (config_path, result.stderr[-2000:]))
+    print("Compiled in %.1f s" % (time.time() - start))
+    return pickle_path
+
+
+# Runs in its own process (see compile_config)
+def compile_main(config_path: str, pickle_path: str):
+    sys.path.insert(0, os.path.dirname(config_path))
+    process = runpy.run_path(config_path, run_name="__main__")["process"]
+
+    # modules imported from outside the release: the config depends on them
+    release = os.environ.get("CMSSW_RELEASE_BASE", "")
+    dependencies = {}
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path is None or not path.endswith(".py") or (release != "" and path.startswith(release)):
+            continue
+        # python itself and the externals of the release
+        if path.startswith((sys.prefix, sys.base_prefix, "/cvmfs/")) or path == os.path.abspath(__file__):
+            continue
+        dependencies[os.path.abspath(path)] = hash_file(path)
+
+    tmp_path = pickle_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(process, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(pickle_path[:-len(".pkl")] + ".json", "w") as f:
+        json.dump({"config": config_path, "time": time.time(), "placeholders": PLACEHOLDERS,
+                   "release": {v: os.environ.get(v, "") for v in RELEASE_VARIABLES},
+                   "dependencies": dependencies}, f, indent=1)
+    os.rename(tmp_path, pickle_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile a cmsRun config into a pickled process")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compile_parser = subparsers.add_parser("compile")
+    compile_parser.add_argument("config")
+    compile_parser.add_argument("output")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        compile_main(os.path.abspath(args.config), os.path.abspath(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import FWCore.ParameterSet.Config as cms
+
+import os
+import pickle
+import sys
+
+# Loads a config compiled by configcache.py: cmsRun cached_cfg.py <config>_<hash>.pkl
+# The placeholders set while compiling are replaced by the parameters of this run.
+pickle_path = next(arg for arg in reversed(sys.argv) if arg.endswith(".pkl"))
+with open(pickle_path, "rb") as f:
+    process = pickle.load(f)
+
+if process.options.numberOfThreads.value() == 1001:
+    process.options.numberOfThreads = int(os.environ.get("EXPERIMENT_THREADS", 32))
+if process.options.numberOfStreams.value() == 1002:
+    process.options.numberOfStreams = int(os.environ.get("EXPERIMENT_STREAMS", 24))
+if process.maxEvents.input.value() == 1003:
+    process.maxEvents.input = int(os.environ.get("EXPERIMENT_MAX_EVENTS", 1300))
+
+# FastTimer output
+if hasattr(process, "FastTimerService"):
+    json_file_name = process.FastTimerService.jsonFileName.value()
+    json_file_name = json_file_name.replace("@EXPERIMENT_NAME@", os.environ.get("EXPERIMENT_NAME", "unnamed"))
+    json_file_name = json_file_name.replace("@EXPERIMENT_OUTPUT_DIR@", os.environ.get("EXPERIMENT_OUTPUT_DIR", "."))
+    process.FastTimerService.jsonFileName = cms.untracked.string(json_file_name)
+
+# local copy of the input, if staged by the harness (see staging.py)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from experiment_input import relocate_input
+relocate_input(process)
+
+# the DAQ working directory is created by hlt.py, on the machine that runs it
+if hasattr(process, "EvFDaqDirector"):
+    os.makedirs('%s/run%d' % (process.EvFDaqDirector.baseDir.value(), process.EvFDaqDirector.runNumber.value()), exist_ok=True)
+
+# end of the python configuration, for the startup breakdown of the harness (see logtail.py)
+print("EXPERIMENT_PHASE configured", flush=True)
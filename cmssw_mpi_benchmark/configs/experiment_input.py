@@ -0,0 +1,20 @@
+import os
+
+
+# Restricts the FED raw input of a process to the files listed in EXPERIMENT_INPUT_LIST (see
+# manifest.py), and points it to a local copy of buBaseDir (see staging.py) when the harness
+# gives one in EXPERIMENT_INPUT_DIR
+def relocate_input(process):
+    input_list = os.environ.get("EXPERIMENT_INPUT_LIST", "")
+    if input_list != "":
+        with open(input_list) as f:
+            process.source.fileNames = [line.strip() for line in f if line.strip() != ""]
+        print("Reading %d input files from %s" % (len(process.source.fileNames), input_list))
+    input_dir = os.environ.get("EXPERIMENT_INPUT_DIR", "")
+    if input_dir == "" or not hasattr(process, "EvFDaqDirector"):
+        return
+    bu_base_dir = process.EvFDaqDirector.buBaseDir.value()
+    process.source.fileNames = [os.path.join(input_dir, os.path.relpath(f, bu_base_dir))
+                                for f in process.source.fileNames.value()]
+    process.EvFDaqDirector.buBaseDir = input_dir
+    print("Reading the input from %s" % input_dir)
@@ -17,6 +17,10 @@ else:
     print("Loading run396102_cff_ngt.py")
     process.load('run396102_cff_ngt')
 
+# local copy of the input, if staged by the harness
+from experiment_input import relocate_input
+relocate_input(process)
+
 del process.HLTAnalyzerEndpath
 
 # override the GlobalTag
@@ -38,7 +42,7 @@ os.makedirs('%s/run%d' % (process.EvFDaqDirector.baseDir.value(), process.EvFDaq
 process.options.numberOfThreads = 32
 process.options.numberOfStreams = 24
 process.options.numberOfConcurrentLuminosityBlocks = 1
-process.maxEvents.input = 1300
+process.maxEvents.input = int(os.environ.get("EXPERIMENT_MAX_EVENTS", 1300))
 
 # force the '2e34' prescale column
 process.PrescaleService.lvl1DefaultLabel = '2p0E34'
@@ -360,3 +360,6 @@ process.ThroughputService = cms.Service('ThroughputService',
 #     limit = cms.untracked.int32(10000000),
 #     reportEvery = cms.untracked.int32(1)
 # )
+
+# end of the python configuration, for the startup breakdown of the harness (see logtail.py)
+print("EXPERIMENT_PHASE configured", flush=True)
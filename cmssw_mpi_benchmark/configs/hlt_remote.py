@@ -317,3 +317,6 @@ process.schedule = cms.Schedule(
 )
 
 # process.Tracer = cms.Service("Tracer")
+
+# end of the python configuration, for the startup breakdown of the harness (see logtail.py)
+print("EXPERIMENT_PHASE configured", flush=True)
@@ -1,4 +1,5 @@
 import FWCore.ParameterSet.Config as cms
+import os
 
 # run over HLTPhysics data from run 383363
 from hlt import process
@@ -52,3 +53,6 @@ process.ThroughputService = cms.Service('ThroughputService',
 
 
 #process.Tracer = cms.Service("Tracer")
+
+# end of the python configuration, for the startup breakdown of the harness (see logtail.py)
+print("EXPERIMENT_PHASE configured", flush=True)
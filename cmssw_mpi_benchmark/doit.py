@@ -1,29 +1,29 @@
-
-
-
-import re
+import argparse
+import copy
+import json
 import os
 import subprocess
 import sys
-
-
-
-# switch on/off each test
-# options common to all tests are set directly in main()
-RUN_MILAN_STANDALONE_CPUONLY =  True
-RUN_MILAN_STANDALONE =          True
-RUN_MILAN_MILAN_CPUONLY =       True
-RUN_MILAN_MILAN =               True
-RUN_MILAN_GENOA_CPUONLY =       True
-RUN_MILAN_GENOA =               True
-
-RUN_NGT_STANDALONE_CPUONLY =    False
-RUN_NGT_STANDALONE =            False
-RUN_NGT_NGT_XSOCKET_CPUONLY =   False
-RUN_NGT_NGT_XSOCKET =           False
-RUN_NGT_NGT_CPUONLY =           False
-RUN_NGT_NGT =                   False
-
+import threading
+import time
+
+import campaign
+import configcache
+import estimate
+import manifest
+import pagecache
+from executor import CampaignExecutor
+from journal import Journal, filter_plan_for_resume, group_key, run_key
+from logparse import get_throughput_from_log
+from logtail import STARTUP_PHASES, LogTailer
+from results import ResultsStore
+from search import get_candidates, successive_halving
+from stats import StoppingRule, bootstrap_ci
+from staging import StagingCache, get_run_input
+from steady_state import estimate_steady_state, split_into_samples
+from telemetry import TelemetrySampler, format_summary
+from timing import get_timing_files, store_timing
+from topology import is_this_machine
 
 
 
@@ -40,16 +40,66 @@ class GlobalConfig:
     # Run just the first t,s pair of the list and move to the next setup
     run_first_ts_pair_only = False
 
+    # Maximum number of benchmarks running at the same time. Only runs whose
+    # CPUs, GPUs and NICs do not overlap are executed concurrently (see executor.py)
+    max_parallel_runs = 1
+
+    # If > 0, concurrent runs must not share a CPU socket. Each socket is assumed
+    # to be a contiguous block of this many logical CPU ids
+    socket_exclusive_size = 0
+
+    # Abort a run if no event is processed within startup_timeout seconds of the launch,
+    # or stall_timeout seconds after the last one. Print the live throughput every
+    # progress_every seconds (0 to disable). See logtail.py
+    startup_timeout = 1200
+    stall_timeout = 300
+    progress_every = 30
+
+    # Events processed by each run (process.maxEvents.input, -1 for the whole input)
+    max_events = 1300
+
+    # Time-boxed runs: stop a run cleanly after time_budget seconds (0 to disable), or
+    # as soon as its steady-state throughput is known to steady_state_tolerance (relative
+    # CI half-width, 0 to disable) over a plateau of at least steady_state_min_duration seconds
+    time_budget = 0
+    steady_state_tolerance = 0
+    steady_state_min_duration = 20
+
+    # If > 0, split the steady state of each run into up to this many independent
+    # throughput samples (see steady_state.split_into_samples)
+    samples_per_run = 0
+
+    # Sample /proc every this many seconds while a benchmark runs (0 to disable), see telemetry.py
+    telemetry_interval = 1.0
+
+    # Local copy of the FED raw input (stage_dir of the campaign, see staging.py), "" to
+    # read it from where the input cff says
+    input_dir = ""
+
+    # Files of the input the runs read (see manifest.py), "" for all the files of the input cff
+    input_list = ""
+
+    # Page cache state of the input files before each run: "as-is", "warm" or "cold", see pagecache.py
+    input_cache = "as-is"
+
+    # Run cmsRun on the configs expanded once and cached, see configcache.py
+    config_cache = False
+
+    # identifies the campaign in the results database (see results.py)
+    campaign_id = ""
+
     log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
 
 
+MEM_POLICIES = ["", "localalloc", "membind", "interleave", "preferred"]
+
+
 # Config describing each test (set for e.g. Milan, Milan-Milan, Milan-Genoa, NGT, etc.)
 class Config(GlobalConfig):
 
     environment = ""
-    ts = [0, 0]
 
     host_local = ""
     host_remote = ""
@@ -57,17 +107,29 @@ class Config(GlobalConfig):
     ucx_tls = "all"
     ucx_net_devices_local = ""
     ucx_net_devices_remote = ""
-    
+
     config_local = ""
     config_remote = ""
 
-    cpus_local = []
-    cpus_remote = []
+    # numactl memory policy of each rank: "" (first touch), "localalloc", "membind",
+    # "interleave" or "preferred", on the NUMA nodes mem_nodes (e.g. "0", "0,1", "all")
+    mem_policy_local = ""
+    mem_policy_remote = ""
+    mem_nodes_local = ""
+    mem_nodes_remote = ""
     cuda_visible_devices_local = "all"
     cuda_visible_devices_remote = "all"
 
     label = ""
 
+    # mutable fields are set per instance, so that changing one in place does not change them all
+    def __init__(self):
+        self.ts = [0, 0]
+        # extra UCX_* variables, e.g. {"UCX_RNDV_THRESH": "inf"}
+        self.ucx_options = {}
+        self.cpus_local = []
+        self.cpus_remote = []
+
     def validate(self):
         if self.environment not in ["HLT", "NGT", "NGT-MPI"]:
             print("Unknown environment configuration:", self.environment)
@@ -95,26 +157,43 @@ class Config(GlobalConfig):
         else:
             print("Either [config_local and config_remote] or just [config_local] must be set.")
             sys.exit(1)
+        for role in ["local", "remote"]:
+            policy, nodes = getattr(self, "mem_policy_" + role), getattr(self, "mem_nodes_" + role)
+            if policy not in MEM_POLICIES:
+                print("Unknown mem_policy_%s %s. Supported are %s" % (role, policy, ", ".join(MEM_POLICIES[1:])))
+                sys.exit(1)
+            if policy in ["membind", "interleave", "preferred"] and nodes == "":
+                print("mem_policy_%s = %s needs mem_nodes_%s (or a host topology)." % (role, policy, role))
+                sys.exit(1)
+            if policy == "preferred" and not nodes.isdigit():
+                print("mem_policy_%s = preferred takes a single NUMA node, not %s." % (role, nodes))
+                sys.exit(1)
     
 
-def get_throughput_from_log(log_file_path: str):
-    with open(log_file_path, 'r') as f:
-        line = next((l for l in f if 'throughput' in l), None)
-        if line is None:
-            raise ValueError("No line containing 'throughput' found in the log file")
-            sys.exit(1)
-        
-        match = re.search(r'(\d+\.\d+)', line)
-        if match is None:
-            raise ValueError("No number found in throughput line")
-        
-        value = round(float(match.group(1)))
-        return value
+# FastTimerService summaries of the runs, named after their run key (see timing.py)
+def get_timing_dir(config: Config):
+    return os.path.join(config.log_dir, "timing")
 
 
-def run_benchmark(config: Config):
+# cmsRun and its config, or the config compiled by configcache.py
+def get_cmsrun_config(config: Config, path: str):
+    if config.config_cache:
+        return configcache.LOADER + " " + configcache.get_cached_config(path)
+    return path
 
-    config.validate()
+
+# CPU pinning and memory policy of a rank
+def build_numactl(config: Config, role: str):
+    cmd = "numactl --physcpubind=" + ",".join(map(str, getattr(config, "cpus_" + role)))
+    policy = getattr(config, "mem_policy_" + role)
+    if policy == "localalloc":
+        cmd += " --localalloc"
+    elif policy != "":
+        cmd += " --%s=%s" % (policy, getattr(config, "mem_nodes_" + role))
+    return cmd
+
+
+def build_command(config: Config):
 
     isStandalone = (config.config_local != "" and config.config_remote == "")
     isNGT = config.environment in ["NGT", "NGT-MPI"]
@@ -126,9 +205,14 @@ def run_benchmark(config: Config):
         cmd += [
             "env EXPERIMENT_THREADS=" + str(config.ts[0]),
             "env EXPERIMENT_STREAMS=" + str(config.ts[1]),
+            "env EXPERIMENT_MAX_EVENTS=" + str(config.max_events),
+            "" if config.input_dir == "" else "env EXPERIMENT_INPUT_DIR=" + config.input_dir,
+            "" if config.input_list == "" else "env EXPERIMENT_INPUT_LIST=" + config.input_list,
+            "env EXPERIMENT_NAME=" + run_key(config),
+            "env EXPERIMENT_OUTPUT_DIR=" + get_timing_dir(config),
             "" if config.cuda_visible_devices_local == "all" else "env CUDA_VISIBLE_DEVICES=" + config.cuda_visible_devices_local,
-            "numactl --physcpubind=" + ",".join(map(str, config.cpus_local)),
-            "cmsRun " + config.config_local
+            build_numactl(config, "local"),
+            "cmsRun " + get_cmsrun_config(config, config.config_local)
         ]
 
     elif config.mpi_impl == "OpenMPI":
@@ -137,380 +221,464 @@ def run_benchmark(config: Config):
             "env LD_PRELOAD=/usr/lib64/libnvidia-ml.so.1" if isNGT else "",
             "mpirun" if isNGT else "cmsenv_mpirun",
             "" if isNGT else "--mca oob_tcp_if_exclude enp4s0f4u1u2c2",
+            "--tag-output", # rank of each line, for the startup breakdown (see logtail.py)
             *(["--mca pml ob1 --mca btl vader,self"] if config.is_same_machine else [
                 "--mca pml ucx",
                 "-x UCX_TLS=" + config.ucx_tls,
                 "-x UCX_PROTO_INFO=y", # to se e.g. which TLS are used
                 "-x UCX_USE_MT_MUTEX=y",
-                "-x UCX_RNDV_SCHEME=put_ppln"
+                "-x UCX_RNDV_SCHEME=put_ppln",
+                *["-x %s=%s" % (k, v) for k, v in config.ucx_options.items()]
             ]),
             "--hostfile /etc/mpi/hostfile" if (isNGT and not config.is_same_machine) else "",
             "--prtemca plm_ssh_agent " + os.path.join(os.path.dirname(os.path.abspath(__file__)), "env_ompi_kubexec.sh") if isNGT else "",
             f"-x EXPERIMENT_THREADS={config.ts[0]}",
             f"-x EXPERIMENT_STREAMS={config.ts[1]}",
+            f"-x EXPERIMENT_MAX_EVENTS={config.max_events}",
+            "" if config.input_dir == "" else "-x EXPERIMENT_INPUT_DIR=" + config.input_dir,
+            "" if config.input_list == "" else "-x EXPERIMENT_INPUT_LIST=" + config.input_list,
+            f"-x EXPERIMENT_NAME={run_key(config)}",
+            f"-x EXPERIMENT_OUTPUT_DIR={get_timing_dir(config)}",
             "--map-by node",
             "-np 1",
             "" if isNGT else "--host " + config.host_local,
             "" if config.cuda_visible_devices_local == "all" else "-x CUDA_VISIBLE_DEVICES=" + config.cuda_visible_devices_local,
             "" if config.ucx_net_devices_local == "" else "-x UCX_NET_DEVICES=" + config.ucx_net_devices_local,
-            "--bind-to none numactl --physcpubind=" + ",".join(map(str, config.cpus_local)),
-            "cmsRun " + config.config_local,
+            "--bind-to none " + build_numactl(config, "local"),
+            "cmsRun " + get_cmsrun_config(config, config.config_local),
             ":",
             "-np 1",
             "" if isNGT else "--host " + config.host_remote,
             "" if config.cuda_visible_devices_remote == "all" else "-x CUDA_VISIBLE_DEVICES=" + config.cuda_visible_devices_remote,
             "" if config.ucx_net_devices_remote == "" else "-x UCX_NET_DEVICES=" + config.ucx_net_devices_remote,
-            "--bind-to none numactl --physcpubind=" + ",".join(map(str, config.cpus_remote)),
-            "cmsRun " + config.config_remote
+            "--bind-to none " + build_numactl(config, "remote"),
+            "cmsRun " + get_cmsrun_config(config, config.config_remote)
         ]
     elif config.mpi_impl == "MPICH":
         cmd = [
             "env LD_PRELOAD=/usr/lib64/libnvidia-ml.so.1" if isNGT else "",
             "mpirun" if isNGT else "cmsenv_mpirun",
             "--launcher-exec " + os.path.abspath("env_mpich_kubexec.sh") if isNGT else "",
+            "-prepend-rank", # rank of each line, for the startup breakdown (see logtail.py)
             "-genv UCX_TLS=" + config.ucx_tls,
             "-genv UCX_LOG_LEVEL=info", # to se e.g. which TLS are used
             "-genv UCX_RNDV_SCHEME=put_ppln",
+            *["-genv %s=%s" % (k, v) for k, v in config.ucx_options.items()],
             "" if isNGT else "-hosts " + config.host_local + "," + config.host_remote,
             "--bind-to none",
             f"-genv EXPERIMENT_THREADS {config.ts[0]}",
             f"-genv EXPERIMENT_STREAMS {config.ts[1]}",
+            f"-genv EXPERIMENT_MAX_EVENTS {config.max_events}",
+            "" if config.input_dir == "" else "-genv EXPERIMENT_INPUT_DIR " + config.input_dir,
+            "" if config.input_list == "" else "-genv EXPERIMENT_INPUT_LIST " + config.input_list,
+            f"-genv EXPERIMENT_NAME {run_key(config)}",
+            f"-genv EXPERIMENT_OUTPUT_DIR {get_timing_dir(config)}",
             "" if config.is_same_machine else "-ppn 1", # one process per node (needed in case each node has multiple sockets)
             "-np 1",
             "" if config.cuda_visible_devices_local == "all" else "-env CUDA_VISIBLE_DEVICES=" + config.cuda_visible_devices_local,
             "" if config.ucx_net_devices_local == "" else "-env UCX_NET_DEVICES "+ config.ucx_net_devices_local,
-            "numactl --physcpubind=" + ",".join(map(str, config.cpus_local)),
-            "cmsRun " + config.config_local,
+            build_numactl(config, "local"),
+            "cmsRun " + get_cmsrun_config(config, config.config_local),
             ":",
             "-np 1",
             "" if config.cuda_visible_devices_remote == "all" else "-env CUDA_VISIBLE_DEVICES=" + config.cuda_visible_devices_remote,
             "" if config.ucx_net_devices_remote == "" else "-env UCX_NET_DEVICES "+ config.ucx_net_devices_remote,
-            "numactl --physcpubind=" + ",".join(map(str, config.cpus_remote)),
-            "cmsRun " + config.config_remote
+            build_numactl(config, "remote"),
+            "cmsRun " + get_cmsrun_config(config, config.config_remote)
         ]
     else:
         print("here be dragons")
         sys.exit(1)
-        
-
-
-    tmp_log_file = os.path.join(config.log_dir, "tmp.log")
-
-    print("Run %d. [t,s] = [%d,%d]" % (config.runID, config.ts[0], config.ts[1]))
-    print("cpus_local:", config.cpus_local)
-    if not isStandalone: print("cpus_remote:", config.cpus_remote)
-    print("Command:")
-    print(" ".join(cmd))
-    if not config.print_cmd_no_run:
-        log_file_path = os.path.join(config.log_dir,
-                                     f"{config.mpi_impl}_{config.label}_t{config.ts[0]}_s{config.ts[1]}_r{config.runID}.log")
-        print("Logging to:", tmp_log_file)
-        print("logs will be saved to:", log_file_path)
-        with open(tmp_log_file, "w") as log_file:
-            log_file.write("Command:\n")
-            log_file.write(" ".join(cmd) + "\n")
-            log_file.write("-"*80 + "\n")
-            log_file.flush()
-
-            # run and get output
-            process = subprocess.Popen(" ".join(cmd), shell=True, stdout=log_file, stderr=subprocess.STDOUT)
-            r = process.wait()
-            if process.returncode != 0:
-                print("Command failed with return code", r)
-                sys.exit(1)
 
-        throughput_this_run = get_throughput_from_log(tmp_log_file)
-        # append throughput to log filename and rename
+    return cmd
 
-        os.rename(tmp_log_file, log_file_path)
-        print("Throughput this run:", throughput_this_run, "events/s")
-        print()
 
+def get_log_file_path(config: Config):
+    return os.path.join(config.log_dir, run_key(config) + ".log")
 
-def main():
 
+# results database, only opened when actually running (see main)
+results_store = None
 
-    # Comment / uncomment tests depending on what/where to run
-    # Individual test-related config (hosts, t_s pairs, config paths, etc.) is set below
-    # Config unrelated to specific tests is set (when needed) above, in run_benchmark()
-    
-    # Before running tests, enable "print_cmd_no_run" to check that the commands are correct!
-    # And maybe then do a first run with "run_first_ts_pair_only" to verify that all tests will run fine.
-
-
-    GlobalConfig.mpi_impl = "OpenMPI" # "OpenMPI" or "MPICH"
-    GlobalConfig.print_cmd_no_run = False
-    GlobalConfig.run_first_ts_pair_only = False
-    GlobalConfig.log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
-
-
-    firstRunID = 0
-    lastRunID = 4
-    for i_run in range(firstRunID, lastRunID): # [first,last)
-
-        GlobalConfig.runID = i_run
-
-        if RUN_MILAN_STANDALONE_CPUONLY == True:
-            # Milan standalone (CPU only)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "HLT"
-            config.host_local = "gputest-milan-02"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_test.py")
-            config.label = "milan_standalone_cpuonly"
-            config.cuda_visible_devices_local = ""
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-        if RUN_MILAN_STANDALONE == True:
-            # Milan standalone
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "HLT"
-            config.host_local = "gputest-milan-02"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_test.py")
-            config.label = "milan_standalone"
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-
-        if RUN_MILAN_MILAN_CPUONLY == True:
-            # Milan-Milan (CPU only)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "HLT"
-            config.host_local = "gputest-milan-02"
-            config.host_remote = "gputest-milan-02"
-            config.is_same_machine = True
-            config.cuda_visible_devices_local = ""
-            config.cuda_visible_devices_remote = ""
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.label = "milan_milan_2sockets_cpuonly"
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(0, 0 + ts[0])
-                config.cpus_remote = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-        if RUN_MILAN_MILAN == True:
-            # Milan-Milan
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "HLT"
-            config.host_local = "gputest-milan-02"
-            config.host_remote = "gputest-milan-02"
-            config.is_same_machine = True
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.label = "milan_milan_2sockets"
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(0, 0 + ts[0])
-                config.cpus_remote = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-
-        if RUN_MILAN_GENOA_CPUONLY == True:
-            # Milan-Genoa (cpu only)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "HLT"
-            config.host_local = "gputest-milan-02"
-            config.host_remote = "gputest-genoa-02"
-            config.ucx_net_devices_local = "mlx5_2:1"
-            config.ucx_net_devices_remote = "mlx5_0:1"
-            config.cuda_visible_devices_local = ""
-            config.cuda_visible_devices_remote = ""
-            config.ucx_tls = "rc_mlx5,rc_x,ud_x,sm,self,cuda_copy,cuda_ipc,gdr_copy"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.label = "milan_genoa_ib100G_cpuonly"
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-            
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-                config.cpus_remote = range(48, 48 + ts[0])
-                
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-     
-        if RUN_MILAN_GENOA == True:
-            # Milan-Genoa
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "HLT"
-            config.host_local = "gputest-milan-02"
-            config.host_remote = "gputest-genoa-02"
-            config.ucx_net_devices_local = "mlx5_2:1"
-            config.ucx_net_devices_remote = "mlx5_0:1"
-            config.ucx_tls = "rc_mlx5,rc_x,ud_x,sm,self,cuda_copy,cuda_ipc,gdr_copy"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.label = "milan_genoa_ib100G"
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-            
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-                config.cpus_remote = range(48, 48 + ts[0])
-                
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-        
-
-        if RUN_NGT_STANDALONE == True:
-            # NGT standalone
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "NGT"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_test.py")
-            config.label = "ngt_standalone"
-            config.cuda_visible_devices_local = "2"
-
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-        
-        if RUN_NGT_STANDALONE_CPUONLY == True:
-            # NGT standalone (CPU only)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "NGT"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_test.py")
-            config.label = "ngt_standalone_cpuonly"
-            config.cuda_visible_devices_local = ""
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-        if RUN_NGT_NGT_XSOCKET == True:
-            # NGT-NGT (single machine)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "NGT"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.is_same_machine = True
-            config.cuda_visible_devices_local = ""
-            config.cuda_visible_devices_remote = "2"
-            config.label = "ngt_ngt_2sockets"
-
-            ts_pairs = [[29, 24], [24, 18], [16, 12], [8, 6]]
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(1, 1 + ts[0])
-                config.cpus_remote = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-
-        if RUN_NGT_NGT_XSOCKET_CPUONLY == True:
-            # NGT-NGT (single machine, CPU only)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "NGT"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.is_same_machine = True
-            config.cuda_visible_devices_local = ""
-            config.cuda_visible_devices_remote = ""
-            config.label = "ngt_ngt_2sockets_cpuonly"
-
-            ts_pairs = [[29, 24], [24, 18], [16, 12], [8, 6]]
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(1, 1 + ts[0])
-                config.cpus_remote = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-
-        if RUN_NGT_NGT_CPUONLY == True:
-            # NGT-NGT (two machines, CPU only)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "NGT-MPI"
-            config.ucx_net_devices_local = "mlx5_2:1"
-            config.ucx_net_devices_remote = "mlx5_2:1"
-            config.cuda_visible_devices_local = ""
-            config.cuda_visible_devices_remote = ""
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.ucx_tls = "rc_mlx5,rc_x,ud_x,sm,self,cuda_copy,cuda_ipc,gdr_copy"
-            config.label = "ngt_ngt_ib400G_cpuonly"
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-                config.cpus_remote = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
-
-        if RUN_NGT_NGT == True:
-            # NGT-NGT (two machines)
-            # ------------------------------------------------------------
-            config = Config()
-            config.environment = "NGT-MPI"
-            config.ucx_net_devices_local = "mlx5_2:1"
-            config.ucx_net_devices_remote = "mlx5_2:1"
-            config.cuda_visible_devices_local = "2"
-            config.cuda_visible_devices_remote = "2"
-            config.config_local = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_local.py")
-            config.config_remote = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs/hlt_remote.py")
-            config.ucx_tls = "rc_mlx5,rc_x,ud_x,sm,self,cuda_copy,cuda_ipc,gdr_copy"
-            config.label = "ngt_ngt_ib400G"
-
-            ts_pairs = [[32, 24], [24, 18], [16, 12], [8, 6]]
-            for ts in ts_pairs:
-                config.ts = ts
-                config.cpus_local = range(32, 32 + ts[0])
-                config.cpus_remote = range(32, 32 + ts[0])
-
-                run_benchmark(config)
-                if config.run_first_ts_pair_only: break
+# output of the runs executed concurrently (see print_run)
+print_lock = threading.Lock()
+
+
+# time series of the events processed, written while the run is followed (see logtail.py)
+def get_progress_file_path(log_file_path: str):
+    return log_file_path[:-len(".log")] + ".progress.csv"
+
+
+def get_telemetry_file_path(log_file_path: str):
+    return log_file_path[:-len(".log")] + ".telemetry.npz"
+
+
+# Whether the local rank of a run is known to run on this machine: standalone runs and MPI
+# runs without a hostfile are started here or on host_local, while the hosts of the MPI
+# hostfile (NGT-MPI) are not known
+def is_local_rank_here(config: Config):
+    if config.config_remote == "":
+        return True
+    if config.environment in ["NGT", "NGT-MPI"]:
+        return config.is_same_machine
+    return is_this_machine(config.host_local)
+
+
+# ranks of a run that can be observed from this machine: (name, config, pinned CPUs)
+def get_local_ranks(config: Config):
+    if config.config_remote == "":
+        return [("whole", get_cmsrun_config(config, config.config_local), config.cpus_local)]
+    ranks = [("local", get_cmsrun_config(config, config.config_local), config.cpus_local)]
+    if config.is_same_machine:
+        ranks.append(("remote", get_cmsrun_config(config, config.config_remote), config.cpus_remote))
+    return ranks
+
+
+# Sets the page cache state of the input of a run whose local rank is known to run on this
+# machine. Otherwise nothing is done nor measured: the page cache of this machine says
+# nothing about the node reading the input.
+def prepare_input_cache(config: Config):
+    if not is_local_rank_here(config):
+        return None
+    files = pagecache.get_input_files(config.input_dir, config.input_list)
+    state = pagecache.prepare(config.input_cache, files)
+    if state["resident"] is not None:
+        print_run(config, ["Input cache %s: %.0f%% of the input in the page cache (was %.0f%%)" %
+                           (state["policy"], 100 * state["resident"], 100 * (state["resident_before"] or 0))])
+    return state
+
+
+# Prints lines about a run at once. With concurrent runs (max_parallel_runs > 1) the lines
+# are prefixed with the run key, so that the output of the runs can be told apart.
+def print_run(config: Config, lines: list):
+    prefix = "[%s] " % run_key(config) if config.max_parallel_runs > 1 else ""
+    with print_lock:
+        print("\n".join(prefix + line if line != "" else "" for line in lines), flush=True)
+
+
+# Runs a single benchmark and returns a dict with its results (None if only printing the command):
+#   throughput               the number printed by cmsRun
+#   steady_state             steady-state throughput, see steady_state.py (None if the run is too short)
+#   steady_state_ci          its CI
+#   samples                  throughputs of the independent samples of the run (None if not split)
+#   timing                   FastTimerService summary of each rank, see timing.py
+#   telemetry                CPU / context switch / softirq summary per rank and core (None if disabled)
+#   input_cache              page cache state of the input before the run (None if the local rank is not
+#                            known to run on this machine)
+# Raises RuntimeError if the command fails, so that concurrent runs can be handled by the caller.
+def run_benchmark(config: Config):
 
+    config.validate()
+
+    isStandalone = (config.config_local != "" and config.config_remote == "")
+    cmd = build_command(config)
+
+    log_file_path = get_log_file_path(config)
+    # each run logs to its own temporary file, so that runs can be executed concurrently
+    tmp_log_file = os.path.join(config.log_dir, "tmp_" + os.path.basename(log_file_path))
+
+    report = ["Run %d. [t,s] = [%d,%d]" % (config.runID, config.ts[0], config.ts[1]),
+              "cpus_local: %s" % config.cpus_local]
+    if not isStandalone: report.append("cpus_remote: %s" % config.cpus_remote)
+    report += ["Command:", " ".join(cmd)]
+    if config.print_cmd_no_run:
+        print_run(config, report)
+        return None
+
+    report += ["Logging to: " + tmp_log_file, "logs will be saved to: " + log_file_path]
+    print_run(config, report)
+    with open(tmp_log_file, "w") as log_file:
+        log_file.write("Command:\n")
+        log_file.write(" ".join(cmd) + "\n")
+        log_file.write("-"*80 + "\n")
+        log_file.flush()
+
+        input_cache = prepare_input_cache(config)
+        start_time = time.time()
+        # run and follow the output while it runs; in its own session, to be able to kill it
+        process = subprocess.Popen("exec " + " ".join(cmd), shell=True, stdout=log_file, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        sampler = None
+        if config.telemetry_interval > 0:
+            sampler = TelemetrySampler(process.pid, get_local_ranks(config), config.telemetry_interval)
+            sampler.start()
+        tailer = LogTailer(tmp_log_file, label=run_key(config), ranks=["whole"] if isStandalone else ["local", "remote"],
+                           stall_timeout=config.stall_timeout,
+                           startup_timeout=config.startup_timeout,
+                           progress_every=config.progress_every,
+                           time_budget=config.time_budget,
+                           steady_state_tolerance=config.steady_state_tolerance,
+                           steady_state_min_duration=config.steady_state_min_duration)
+        r = tailer.follow(process)
+        if sampler is not None:
+            sampler.stop()
+        if tailer.abort_reason is not None or r != 0:
+            tailer.save(get_progress_file_path(tmp_log_file))
+            if sampler is not None:
+                sampler.save(get_telemetry_file_path(tmp_log_file))
+        if tailer.abort_reason is not None:
+            raise RuntimeError("Run aborted, %s (log: %s)" % (tailer.abort_reason, tmp_log_file))
+        if process.returncode != 0:
+            raise RuntimeError("Command failed with return code %d (log: %s)" % (r, tmp_log_file))
+        tailer.save(get_progress_file_path(log_file_path))
+        if sampler is not None:
+            sampler.save(get_telemetry_file_path(log_file_path))
+    end_time = time.time()
+    duration = end_time - start_time
+    phases = tailer.get_phases(end_time)
+
+    throughput_this_run = get_throughput_from_log(tmp_log_file)
+    steady_state = estimate_steady_state(tailer.times, tailer.events)
+    samples = None
+    if config.samples_per_run > 0:
+        samples = split_into_samples(tailer.times, tailer.events, config.samples_per_run)
+    # append throughput to log filename and rename
+
+    os.rename(tmp_log_file, log_file_path)
+    report = ["Throughput this run: %s events/s" % throughput_this_run]
+    if steady_state is not None:
+        report.append("Steady-state throughput: %.1f events/s, CI [%.1f, %.1f] (%.0f s to %.0f s after the first event)" %
+                      (steady_state["throughput"], *steady_state["ci"], steady_state["start"], steady_state["end"]))
+    if samples is not None:
+        report.append("Split into %d samples of %.0f s (autocorrelation time %.1f s): %s events/s" %
+                      (len(samples["samples"]), samples["sample_duration"], samples["autocorrelation_time"],
+                       ", ".join("%.1f" % x for x in samples["samples"])))
+    elif config.samples_per_run > 0:
+        report.append("Run too short or too correlated to be split into samples")
+    for rank, rank_phases in phases.items():
+        if "startup" in rank_phases:
+            report.append("%s rank: startup %.1f s (%s), event loop %.1f s" %
+                          (rank, rank_phases["startup"],
+                           ", ".join("%s %.1f s" % (p, rank_phases[p]) for p in STARTUP_PHASES if p in rank_phases),
+                           rank_phases.get("event_loop", 0)))
+    telemetry = sampler.get_summary() if sampler is not None else None
+    if telemetry is not None:
+        report += format_summary(telemetry)
+    output = {
+        "throughput": throughput_this_run,
+        "steady_state": steady_state["throughput"] if steady_state is not None else None,
+        "steady_state_ci": steady_state["ci"] if steady_state is not None else None,
+        "samples": samples["samples"] if samples is not None else None,
+        "timing": get_timing_files(get_timing_dir(config), run_key(config)),
+        "telemetry": telemetry,
+        "phases": phases,
+        "input_cache": input_cache,
+    }
+    expected = ["whole"] if isStandalone else ["local", "remote"]
+    missing = [rank for rank in expected if rank not in output["timing"]]
+    if len(missing) > 0:
+        report.append("No FastTimerService summary for the %s rank(s) in %s" % (", ".join(missing), get_timing_dir(config)))
+    print_run(config, report + [""])
+    if results_store is not None:
+        results_store.add_run(config.campaign_id, run_key(config), config, " ".join(cmd), start_time, duration,
+                              output, log_file_path)
+        store_timing(results_store, config.campaign_id, run_key(config), output["timing"])
+        results_store.add_phases(config.campaign_id, run_key(config), phases)
+    return output
+
+
+def print_summary(journal: Journal, stopping_rule):
+    confidence = stopping_rule.confidence if stopping_rule is not None else 0.95
+    throughputs = journal.get_throughputs()
+    steady_states = journal.get_throughputs("steady_state")
+    samples = journal.get_throughputs("samples")
+    print("Summary (mean throughput and steady-state throughput, %d%% bootstrap CI):" % round(confidence * 100))
+    for group, values in throughputs.items():
+        mean, low, high = bootstrap_ci(values, confidence)
+        line = "  %-50s %3d runs  %8.1f events/s  [%.1f, %.1f]" % (group, len(values), mean, low, high)
+        if group in steady_states:
+            mean, low, high = bootstrap_ci(steady_states[group], confidence)
+            line += "   steady state %8.1f events/s  [%.1f, %.1f]" % (mean, low, high)
+        if group in samples:
+            values = [x for run_samples in samples[group] for x in run_samples]
+            mean, low, high = bootstrap_ci(values, confidence)
+            line += "   %d samples %8.1f events/s  [%.1f, %.1f]" % (len(values), mean, low, high)
+        print(line)
+
+
+# Searches the best [threads, streams] pair of a setup entry (see search.py)
+def run_search(entry: dict, search_options: dict, executor: CampaignExecutor, journal: Journal):
+    search_options = dict(search_options)
+    candidates = []
+    for ts in get_candidates(search_options):
+        error = campaign.get_fit_error(entry, ts)
+        if error is None:
+            candidates.append(ts)
+        else:
+            print("Setup %s: skipping [t,s] = [%d,%d], %s" % (entry["label"], ts[0], ts[1], error))
+    if len(candidates) == 0:
+        print("Setup %s: no [threads, streams] candidate fits on the CPUs of its hosts" % entry["label"])
+        sys.exit(1)
+    search_options["max_threads"] = max(ts[0] for ts in candidates)
+    # throughputs of each group, including those measured before a --resume
+    measured = journal.get_throughputs()
+
+    def evaluate(candidates, runs):
+        plan = []
+        for ts in candidates:
+            planned = campaign.make_entry(entry, ts)
+            n_done = len(measured.get(group_key(make_config(planned)), []))
+            plan += [make_config(dict(planned, runID=run_id)) for run_id in range(n_done, runs)]
+        for result in executor.run(plan):
+            if result.throughput is not None:
+                measured.setdefault(group_key(result.config), []).append(result.throughput)
+        return {tuple(ts): measured.get(group_key(make_config(campaign.make_entry(entry, ts))), [])
+                for ts in candidates}
+
+    best, history = successive_halving(candidates, evaluate,
+                                       eta=search_options["eta"], objective=search_options["objective"])
+    label = campaign.make_entry(entry, best)["label"]
+    print("Best [t,s] for %s: [%d,%d]" % (label, best[0], best[1]))
+    print()
+
+    with open(os.path.join(GlobalConfig.log_dir, "search_%s.json" % label), "w") as f:
+        json.dump({"best": best, "options": search_options, "rounds": history}, f, indent=2)
+    return best
+
+
+# Stages the input to the local stage_dir before the campaign, for the runs whose local rank
+# is known to run on this machine (see staging.py, is_local_rank_here)
+def stage_input(plan: list, options: dict):
+    local = [config for config in plan if is_local_rank_here(config)]
+    if len(local) < len(plan):
+        print("%d runs have their local rank on another (or an unknown) machine and read the input from NFS" %
+              (len(plan) - len(local)))
+    if len(local) == 0:
+        return
+    stage_dir = os.path.abspath(options["stage_dir"])
+    if not GlobalConfig.print_cmd_no_run:
+        try:
+            bu_base_dir, files = get_run_input(GlobalConfig.input_list)
+            StagingCache(stage_dir, options["stage_max_gb"] * 1e9).stage(bu_base_dir, files)
+        except (OSError, ValueError) as e:
+            print("Staging the input failed:", e)
+            sys.exit(1)
+    for config in local:
+        config.input_dir = stage_dir
+
+
+# Builds a Config from an entry of a campaign plan (see campaign.py)
+def make_config(entry: dict):
+    config = Config()
+    for key, value in entry.items():
+        # the entries of a setup share its lists and dicts
+        setattr(config, key, copy.deepcopy(value))
+    return config
+
+
+def main():
+    global results_store
+
+    # Tests to run (hosts, t_s pairs, config paths, etc.) are described in a campaign spec,
+    # campaigns/default.toml unless another one is given.
+    # Config unrelated to specific tests is set (when needed) above, in build_command()
+
+    parser = argparse.ArgumentParser(description="Run a CMSSW MPI benchmark campaign")
+    parser.add_argument("spec", nargs="?", default=campaign.DEFAULT_SPEC, help="campaign spec (TOML)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip the runs already done according to the journal and retry the failed ones")
+    parser.add_argument("--force-resume", action="store_true",
+                        help="resume even if the spec changed since the campaign was started")
+    parser.add_argument("--search", action="store_true",
+                        help="search the best [threads, streams] pair of each setup instead of running its ts grid")
+    parser.add_argument("--estimate", action="store_true",
+                        help="print the estimated duration of every run from past runs, and exit")
+    args = parser.parse_args()
+
+    options, entries = campaign.load_plan(args.spec)
+
+    GlobalConfig.print_cmd_no_run = options["print_cmd_no_run"]
+    GlobalConfig.run_first_ts_pair_only = options["run_first_ts_pair_only"]
+    GlobalConfig.log_dir = options["log_dir"]
+    GlobalConfig.max_parallel_runs = options["max_parallel_runs"]
+    GlobalConfig.socket_exclusive_size = options["socket_exclusive_size"]
+    GlobalConfig.startup_timeout = options["startup_timeout"]
+    GlobalConfig.stall_timeout = options["stall_timeout"]
+    GlobalConfig.progress_every = options["progress_every"]
+    GlobalConfig.max_events = options["max_events"]
+    GlobalConfig.time_budget = options["time_budget"]
+    GlobalConfig.steady_state_tolerance = options["steady_state_tolerance"]
+    GlobalConfig.steady_state_min_duration = options["steady_state_min_duration"]
+    GlobalConfig.samples_per_run = options["samples_per_run"]
+    GlobalConfig.telemetry_interval = options["telemetry_interval"]
+    GlobalConfig.config_cache = options["config_cache"]
+    GlobalConfig.input_cache = options["input_cache"]
+    if options["input_cache"] not in pagecache.INPUT_CACHE_POLICIES:
+        print("Unknown input_cache %s. Supported are %s" % (options["input_cache"],
+                                                           ", ".join(pagecache.INPUT_CACHE_POLICIES)))
+        sys.exit(1)
+    if options["input_cache"] == "cold" and options["max_parallel_runs"] > 1:
+        print("Warning: with input_cache = cold, a run evicts the input of the runs running at the same time")
+    os.makedirs(GlobalConfig.log_dir, exist_ok=True)
+    os.makedirs(get_timing_dir(GlobalConfig), exist_ok=True)
+
+    plan = [make_config(entry) for entry in entries]
+    if options["input_cache"] != "as-is":
+        n_unknown = sum(1 for config in plan if not is_local_rank_here(config))
+        if n_unknown > 0:
+            print("Warning: input_cache = %s is not applied to the %d runs whose local rank is not known to run "
+                  "on this machine, their input_state is unknown" % (options["input_cache"], n_unknown))
+    if args.estimate:
+        estimate.schedule(plan, options, verbose=True)
+        return
+
+    # the journal is only written when actually running
+    journal = None
+    if not GlobalConfig.print_cmd_no_run:
+        journal = Journal(os.path.join(GlobalConfig.log_dir, options["journal"]))
+        if args.resume or args.force_resume:
+            try:
+                plan = filter_plan_for_resume(plan, journal, options["max_retries"], options["spec_hash"],
+                                              force=args.force_resume)
+            except ValueError as e:
+                print("Cannot resume:", e)
+                sys.exit(1)
+        else:
+            journal.start_campaign(options["spec_hash"])
+        GlobalConfig.campaign_id = journal.get_campaign_id() or options["spec_hash"][:12]
+        results_store = ResultsStore(os.path.join(GlobalConfig.log_dir, options["results_db"]))
+
+    # the search decides itself how many times each candidate is run
+    stopping_rule = None
+    if "adaptive" in options and not args.search:
+        stopping_rule = StoppingRule(**options["adaptive"])
+
+    executor = CampaignExecutor(run_benchmark,
+                                max_parallel_runs=GlobalConfig.max_parallel_runs,
+                                socket_exclusive_size=GlobalConfig.socket_exclusive_size,
+                                max_retries=options["max_retries"],
+                                journal=journal,
+                                stopping_rule=stopping_rule)
+    if args.search:
+        if GlobalConfig.print_cmd_no_run:
+            print("--search needs the results of the runs, disable print_cmd_no_run")
+            sys.exit(1)
+        for entry, search_options in campaign.expand_search_entries(args.spec):
+            run_search(entry, search_options, executor, journal)
+        return
+
+    plan = estimate.schedule(plan, options)
+    if options["input_manifest"] != "" and not GlobalConfig.print_cmd_no_run:
+        try:
+            GlobalConfig.input_list = manifest.write_input_list(campaign.resolve_path(options["input_manifest"]),
+                                                                GlobalConfig.max_events)
+        except (OSError, ValueError) as e:
+            print("Selecting the input files failed:", e)
+            sys.exit(1)
+    if options["stage_dir"] != "":
+        stage_input(plan, options)
+    if GlobalConfig.config_cache and not GlobalConfig.print_cmd_no_run:
+        for path in sorted({path for config in plan for path in [config.config_local, config.config_remote] if path != ""}):
+            try:
+                configcache.compile_config(path)
+            except RuntimeError as e:
+                print(e)
+                sys.exit(1)
+    results = executor.run(plan)
+    if not GlobalConfig.print_cmd_no_run:
+        print_summary(journal, stopping_rule)
+    if any(r.error is not None for r in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+import contextlib
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from executor import get_resources, resources_conflict
+from journal import Journal, group_key, run_key
+
+
+# Wall time of the runs of a campaign, predicted from the durations of past runs.
+#
+# The history is read from the results database (all the campaigns of log_dir, see
+# results.py), or from the "done" records of the journal if there is no database yet. The
+# duration of a run is predicted from, in order:
+#   group    the runs of the same mpi_impl, label and ts (median)
+#   setup    the runs of the same mpi_impl and label at other ts: fit of a + b / threads
+#            (startup + event loop) with at least two thread counts, else the closest one
+#   kind     the runs of the same environment, standalone or MPI (median)
+#   default  default_run_duration (campaign option)
+#
+# The campaign time is then simulated the way executor.CampaignExecutor runs the plan
+# (max_parallel_runs, resource conflicts), without failures or early stops, so it is an
+# upper bound with an adaptive stopping rule.
+#
+# With order = "longest-first" the runs of every repetition round (runID) are started
+# longest first, so a slow configuration does not end the campaign late and parallel runs
+# pack better. With campaign_time_budget (seconds), repetitions are dropped until the
+# estimate fits: the repetition worth the least per second goes first, its worth being the
+# reduction of the relative CI width of its configuration, cv * (1/sqrt(k-1) - 1/sqrt(k))
+# for the k-th run (cv from the history). The first run of a configuration is never dropped.
+#
+# "doit.py --estimate" prints the estimate of every run of a campaign without running it.
+
+KINDS = ["group", "setup", "kind", "default"]
+
+
+def is_standalone(config_remote: str):
+    return config_remote == ""
+
+
+def load_history_from_db(path: str):
+    # (mpi_impl, label, threads, streams, environment, standalone, duration, throughput)
+    with contextlib.closing(sqlite3.connect(path, timeout=60)) as db:
+        rows = db.execute("SELECT mpi_impl, label, threads, streams, environment, config, duration, throughput "
+                          "FROM runs WHERE duration IS NOT NULL").fetchall()
+    return [(*row[:5], is_standalone(json.loads(row[5] or "{}").get("config_remote", "")), *row[6:])
+            for row in rows]
+
+
+def load_history_from_journal(journal: Journal):
+    started = {}
+    history = []
+    for record in journal.read():
+        if record["event"] == "started":
+            started[record["key"]] = record
+        elif record["event"] == "done" and record["key"] in started:
+            run = started[record["key"]]
+            # the environment and the kind of setup are not in the journal
+            history.append((run["mpi_impl"], run["label"], run["ts"][0], run["ts"][1], "", None,
+                            record["duration"], record.get("throughput")))
+    return history
+
+
+def load_history(log_dir: str, results_db: str, journal: str):
+    db = os.path.join(log_dir, results_db)
+    if os.path.isfile(db):
+        return load_history_from_db(db)
+    journal = os.path.join(log_dir, journal)
+    if os.path.isfile(journal):
+        return load_history_from_journal(Journal(journal))
+    return []
+
+
+class DurationModel:
+
+    def __init__(self, history: list, default_duration=600):
+        self.default_duration = default_duration
+        self.groups = {}
+        self.setups = {}
+        self.kinds = {}
+        self.throughputs = {}
+        for mpi_impl, label, threads, streams, environment, standalone, duration, throughput in history:
+            self.groups.setdefault((mpi_impl, label, threads, streams), []).append(duration)
+            self.setups.setdefault((mpi_impl, label), []).append((threads, duration))
+            self.kinds.setdefault((environment, standalone), []).append(duration)
+            if throughput is not None:
+                self.throughputs.setdefault((mpi_impl, label, threads, streams), []).append(throughput)
+        self.cvs = {g: np.std(x, ddof=1) / np.mean(x) for g, x in self.throughputs.items() if len(x) >= 2}
+
+    def predict_setup(self, points: list, threads: int):
+        threads_seen = sorted({t for t, _ in points})
+        if len(threads_seen) >= 2:
+            x = np.array([1 / t for t, _ in points])
+            y = np.array([d for _, d in points])
+            b, a = np.polyfit(x, y, 1)
+            prediction = a + b / threads
+            if prediction > 0:
+                return prediction
+        closest = min(threads_seen, key=lambda t: abs(t - threads))
+        return float(np.median([d for t, d in points if t == closest]))
+
+    # (duration in seconds, which history it comes from)
+    def predict(self, config):
+        group = (config.mpi_impl, config.label, config.ts[0], config.ts[1])
+        if group in self.groups:
+            return float(np.median(self.groups[group])), "group"
+        if (config.mpi_impl, config.label) in self.setups:
+            return self.predict_setup(self.setups[(config.mpi_impl, config.label)], config.ts[0]), "setup"
+        kind = (config.environment, is_standalone(config.config_remote))
+        if kind in self.kinds:
+            return float(np.median(self.kinds[kind])), "kind"
+        return float(self.default_duration), "default"
+
+    # relative std of the throughput of a configuration, the median one if not measured
+    def get_cv(self, config):
+        group = (config.mpi_impl, config.label, config.ts[0], config.ts[1])
+        if group in self.cvs:
+            return self.cvs[group]
+        return float(np.median(list(self.cvs.values()))) if self.cvs else 1.0
+
+
+# Simulates CampaignExecutor.run: returns the total time and the end time of every run
+def simulate(plan: list, durations: list, max_parallel_runs=1, socket_exclusive_size=0):
+    resources = [get_resources(config, socket_exclusive_size) for config in plan]
+    pending = list(range(len(plan)))
+    running = []  # heap of (end time, plan index)
+    ends = [0.0] * len(plan)
+    now = 0.0
+    while pending or running:
+        reserved = [resources[i] for _, i in running]
+        for i in list(pending):
+            if len(running) >= max(1, max_parallel_runs):
+                break
+            if any(resources_conflict(resources[i], r) for r in reserved):
+                reserved.append(resources[i])
+                continue
+            pending.remove(i)
+            heapq.heappush(running, (now + durations[i], i))
+            reserved.append(resources[i])
+        now, i = heapq.heappop(running)
+        ends[i] = now
+    return now, ends
+
+
+def order_longest_first(plan: list, durations: list):
+    order = sorted(range(len(plan)), key=lambda i: (plan[i].runID, -durations[i]))
+    return [plan[i] for i in order], [durations[i] for i in order]
+
+
+def fit_time_budget(plan: list, durations: list, model: DurationModel, budget: float,
+                    max_parallel_runs=1, socket_exclusive_size=0):
+    # repetition number of every run within its configuration, in runID order
+    repetitions = {}
+    k = [0] * len(plan)
+    for i in sorted(range(len(plan)), key=lambda i: plan[i].runID):
+        group = group_key(plan[i])
+        repetitions[group] = repetitions.get(group, 0) + 1
+        k[i] = repetitions[group]
+    # the worth of a run does not change when others are dropped: the last repetitions of
+    # a configuration are always worth less than the first ones
+    worth = [np.inf if k[i] == 1 else model.get_cv(plan[i]) * (1 / np.sqrt(k[i] - 1) - 1 / np.sqrt(k[i]))
+             for i in range(len(plan))]
+    candidates = sorted((i for i in range(len(plan)) if k[i] > 1), key=lambda i: worth[i] / durations[i])
+
+    kept = set(range(len(plan)))
+    total, _ = simulate(plan, durations, max_parallel_runs, socket_exclusive_size)
+    for i in candidates:
+        if total <= budget:
+            break
+        kept.remove(i)
+        if max_parallel_runs <= 1:
+            total -= durations[i]
+            continue
+        total, _ = simulate([plan[j] for j in sorted(kept)], [durations[j] for j in sorted(kept)],
+                            max_parallel_runs, socket_exclusive_size)
+    dropped = len(plan) - len(kept)
+    return [plan[j] for j in sorted(kept)], [durations[j] for j in sorted(kept)], dropped, total
+
+
+def format_duration(seconds: float):
+    return "%dh%02dm" % (seconds // 3600, seconds % 3600 // 60)
+
+
+# Estimates the plan, reorders it and fits it into the time budget as the campaign options
+# say, and prints the estimate. Returns the plan to run.
+def schedule(plan: list, options: dict, verbose=False):
+    history = load_history(options["log_dir"], options["results_db"], options["journal"])
+    model = DurationModel(history, options["default_run_duration"])
+    durations = [model.predict(config)[0] for config in plan]
+
+    if options["order"] == "longest-first":
+        plan, durations = order_longest_first(plan, durations)
+    elif options["order"] != "source":
+        print("Unknown order %s. Supported are source and longest-first" % options["order"])
+        sys.exit(1)
+
+    if options["campaign_time_budget"] > 0:
+        plan, durations, dropped, total = fit_time_budget(plan, durations, model, options["campaign_time_budget"],
+                                                          options["max_parallel_runs"], options["socket_exclusive_size"])
+        if dropped > 0:
+            print("Dropped %d repetitions to fit the campaign time budget of %s" %
+                  (dropped, format_duration(options["campaign_time_budget"])))
+        if total > options["campaign_time_budget"]:
+            print("Warning: the campaign needs %s even with a single run per configuration, more than the "
+                  "budget of %s" % (format_duration(total), format_duration(options["campaign_time_budget"])))
+
+    total, ends = simulate(plan, durations, options["max_parallel_runs"], options["socket_exclusive_size"])
+    counts = {kind: 0 for kind in KINDS}
+    for config in plan:
+        counts[model.predict(config)[1]] += 1
+    print("Estimated campaign time: %s for %d runs, ending around %s (estimates from: %s)" %
+          (format_duration(total), len(plan), time.strftime("%a %H:%M", time.localtime(time.time() + total)),
+           ", ".join("%s %d" % kv for kv in counts.items() if kv[1] > 0)))
+    if verbose:
+        for config, duration, end in zip(plan, durations, ends):
+            print("  %-80s %8.0f s  ends at %s  (%s)" % (run_key(config), duration,
+                                                          format_duration(end), model.predict(config)[1]))
+    return plan
+
@@ -0,0 +1,187 @@
+import concurrent.futures
+import time
+
+from journal import group_key, run_key
+
+
+# Resource-conflict model used to decide which benchmarks can run at the same time.
+#
+# Every Config is translated into a set of (host, kind, id) tuples:
+#   - ("cpu", n) for each pinned logical CPU, or ("socket", n) with socket exclusivity
+#   - ("gpu", n) for each visible GPU, ("gpu", "*") if CUDA_VISIBLE_DEVICES is not restricted
+#   - ("nic", dev) for each UCX device used across nodes, ("nic", "*") if not restricted
+#   - ("launcher", "server.uri") for MPI runs: all of them read the PMIx server URI from
+#     the same file in the working directory, so two MPI jobs are never started together
+# Two configs conflict if they share a tuple, or if one of them uses a "*" id on a
+# (host, kind) that the other one also uses.
+
+WILDCARD = "*"
+
+
+class RunResult:
+    def __init__(self, config, output=None, error=None, skipped=False):
+        self.config = config
+        # dict returned by the run function, None if the command was only printed
+        self.output = output
+        self.throughput = output["throughput"] if output is not None else None
+        self.error = error
+        # not run because the stopping rule was already satisfied
+        self.skipped = skipped
+
+
+def get_hosts(config):
+    host_local = config.host_local if config.host_local != "" else "localhost"
+    if config.config_remote == "":
+        return host_local, None
+    if config.is_same_machine:
+        return host_local, host_local
+    # NGT-MPI runs get their hosts from the MPI hostfile
+    host_remote = config.host_remote if config.host_remote != "" else "remote"
+    return host_local, host_remote
+
+
+def get_rank_resources(host, cpus, cuda_visible_devices, ucx_net_devices, uses_network, socket_exclusive_size):
+    resources = set()
+    for cpu in cpus:
+        if socket_exclusive_size > 0:
+            resources.add((host, "socket", cpu // socket_exclusive_size))
+        else:
+            resources.add((host, "cpu", cpu))
+
+    if cuda_visible_devices == "all":
+        resources.add((host, "gpu", WILDCARD))
+    elif cuda_visible_devices != "":
+        resources.update((host, "gpu", gpu) for gpu in cuda_visible_devices.split(","))
+
+    if uses_network:
+        if ucx_net_devices == "":
+            resources.add((host, "nic", WILDCARD))
+        else:
+            resources.update((host, "nic", dev) for dev in ucx_net_devices.split(","))
+    return resources
+
+
+def get_resources(config, socket_exclusive_size=0):
+    host_local, host_remote = get_hosts(config)
+    uses_network = host_remote is not None and not config.is_same_machine
+
+    resources = get_rank_resources(host_local, config.cpus_local, config.cuda_visible_devices_local,
+                                   config.ucx_net_devices_local, uses_network, socket_exclusive_size)
+    if host_remote is not None:
+        resources |= get_rank_resources(host_remote, config.cpus_remote, config.cuda_visible_devices_remote,
+                                         config.ucx_net_devices_remote, uses_network, socket_exclusive_size)
+        resources.add(("localhost", "launcher", "server.uri"))
+    return resources
+
+
+def resources_conflict(a: set, b: set):
+    if not a.isdisjoint(b):
+        return True
+    for first, second in ((a, b), (b, a)):
+        wildcards = {(host, kind) for host, kind, ident in first if ident == WILDCARD}
+        if any((host, kind) in wildcards for host, kind, _ in second):
+            return True
+    return False
+
+
+# the errors raised on purpose by run_benchmark are messages, the others need their type
+def describe_error(error: Exception):
+    if isinstance(error, (RuntimeError, ValueError)):
+        return str(error)
+    return "%s: %s" % (type(error).__name__, error)
+
+
+# Runs a list of expanded Config objects, packing those with disjoint resources onto the
+# machines at the same time. Runs are started in plan order; a run that is blocked keeps
+# its resources reserved, so later (smaller) runs cannot starve it.
+# Failed runs are retried up to max_retries times (counting failures already in the
+# journal, if any) before giving up on them; the rest of the campaign goes on. Any exception
+# of a run is a failure (e.g. an OSError writing its log, a database error), only
+# KeyboardInterrupt stops the campaign. A run that completed but could not be journaled is
+# not a failure: it is kept, with output["journal_error"].
+# With a stopping rule (see stats.py), the remaining repetitions of a configuration are
+# skipped once the throughputs measured so far are precise enough.
+class CampaignExecutor:
+
+    def __init__(self, run_fn, max_parallel_runs=1, socket_exclusive_size=0, max_retries=0, journal=None,
+                 stopping_rule=None):
+        self.run_fn = run_fn
+        self.max_parallel_runs = max(1, max_parallel_runs)
+        self.socket_exclusive_size = socket_exclusive_size
+        self.max_retries = max_retries
+        self.journal = journal
+        self.stopping_rule = stopping_rule
+
+    def run_one(self, config):
+        if self.journal is not None:
+            self.journal.run_started(config)
+        start = time.time()
+        try:
+            output = self.run_fn(config)
+        except Exception as e:
+            if self.journal is not None:
+                self.journal.run_failed(config, time.time() - start, describe_error(e))
+            raise
+        if self.journal is not None and output is not None:
+            # the run succeeded: a journal that cannot be written (e.g. full disk) must not
+            # turn it into a failure that is retried
+            try:
+                self.journal.run_done(config, time.time() - start, output)
+            except Exception as e:
+                output["journal_error"] = describe_error(e)
+                print("Run %s completed but could not be journaled: %s. A --resume will run it again" %
+                      (run_key(config), output["journal_error"]))
+        return output
+
+    def run(self, plan: list):
+        for config in plan:
+            config.validate()
+
+        resources = [get_resources(config, self.socket_exclusive_size) for config in plan]
+        results = [None] * len(plan)
+        pending = list(range(len(plan)))
+        running = {}  # future -> plan index
+
+        status = self.journal.get_status() if self.journal is not None else {}
+        failures = [status.get(run_key(config), (None, 0))[1] for config in plan]
+        throughputs = self.journal.get_throughputs() if self.journal is not None else {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_parallel_runs) as pool:
+            while pending or running:
+                reserved = [resources[i] for i in running.values()]
+                for i in list(pending):
+                    if len(running) >= self.max_parallel_runs:
+                        break
+                    if (self.stopping_rule is not None and
+                            self.stopping_rule.is_converged(throughputs.get(group_key(plan[i]), []))):
+                        pending.remove(i)
+                        results[i] = RunResult(plan[i], skipped=True)
+                        continue
+                    if any(resources_conflict(resources[i], r) for r in reserved):
+                        # keep the resources reserved for this run
+                        reserved.append(resources[i])
+                        continue
+                    pending.remove(i)
+                    running[pool.submit(self.run_one, plan[i])] = i
+                    reserved.append(resources[i])
+
+                if not running:
+                    continue
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    try:
+                        results[i] = RunResult(plan[i], output=future.result())
+                        if results[i].throughput is not None:
+                            throughputs.setdefault(group_key(plan[i]), []).append(results[i].throughput)
+                    except Exception as e:
+                        failures[i] += 1
+                        if failures[i] <= self.max_retries:
+                            print("Run %s failed: %s. Retrying (%d/%d)" % (run_key(plan[i]), describe_error(e),
+                                                                          failures[i], self.max_retries))
+                            pending.insert(0, i)
+                        else:
+                            print("Run %s failed: %s. Giving up" % (run_key(plan[i]), describe_error(e)))
+                            results[i] = RunResult(plan[i], error=e)
+
+        return results
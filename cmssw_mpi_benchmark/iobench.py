@@ -0,0 +1,360 @@
+import argparse
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from manifest import EVENT_HEADERS, FILE_MAGIC, scan_file
+import pagecache
+
+
+# I/O ceiling of the FED raw input, to compare with the HLT throughput.
+#
+# "generate" writes synthetic FRD files laid out like the real input
+# (run<R>/run<R>_ls<LS>_index<I>.raw under the output directory, with a RAW_0002 file header
+# and version 6 event headers, see manifest.py), with event sizes drawn from a distribution:
+#   fixed:KB            every event of KB kilobytes
+#   uniform:MIN,MAX     uniform between MIN and MAX kilobytes
+#   normal:MEAN,STD     normal, in kilobytes (at least 1 KB)
+#   lognormal:MEAN,S    log-normal of mean MEAN kilobytes and shape S (default lognormal:1200,0.3)
+# The payloads are random bytes, so that compressing filesystems do not skew the results.
+#
+# "run" reads all the files with each reader and reports the bandwidth and the events/s,
+# walking the event headers of the data it read:
+#   buffered   read() into a buffer of --chunk-mb
+#   mmap       mmap of each file, touching every page
+#   odirect    O_DIRECT reads into an aligned buffer of --chunk-mb (bypasses the page cache;
+#              not supported by tmpfs)
+#   chunked    the model of FedRawDataInputSource: --num-buffers buffers of eventChunkSize
+#              (--chunk-mb) filled by --read-threads threads in reads of eventChunkBlock
+#              (--block-mb), while one thread walks the events of the chunks in order
+# Before every reader the page cache state of the files is set with --cache (cold by
+# default, see pagecache.py), and its resident fraction is reported.
+#
+# The defaults of the chunked reader are the settings of configs/run396102_cff.py
+# (eventChunkSize = 200, eventChunkBlock = 200, numBuffers = 4).
+#
+# Usage:
+#   python3 iobench.py generate OUTPUT_DIR [--files N] [--events-per-file N] [--lumis N] [--sizes DIST]
+#   python3 iobench.py run DIR|LIST [--readers buffered,mmap,odirect,chunked] [--cache cold|warm|as-is]
+#                      [--chunk-mb 200] [--block-mb 200] [--num-buffers 4] [--read-threads 4] [--output JSON]
+
+READERS = ["buffered", "mmap", "odirect", "chunked"]
+FILE_HEADER = struct.Struct("<8sHHIIIQ")
+EVENT_HEADER = EVENT_HEADERS[6][0]
+VERSION_FORMAT = struct.Struct("<H")
+RAW_DATA_TYPE = 20
+PAGE_SIZE = mmap.PAGESIZE
+# random payloads are cut from this block
+RANDOM_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def parse_sizes(spec: str):
+    kind, _, args = spec.partition(":")
+    values = [float(x) for x in args.split(",") if x != ""]
+    expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+    if kind not in expected or len(values) != expected[kind]:
+        raise ValueError("Unknown event size distribution %s. Supported are fixed:KB, uniform:MIN,MAX, "
+                         "normal:MEAN,STD and lognormal:MEAN,SHAPE" % spec)
+    return kind, values
+
+
+# event sizes in bytes
+def draw_sizes(rng, spec: str, n: int):
+    kind, values = parse_sizes(spec)
+    if kind == "fixed":
+        sizes = np.full(n, values[0])
+    elif kind == "uniform":
+        sizes = rng.uniform(values[0], values[1], n)
+    elif kind == "normal":
+        sizes = rng.normal(values[0], values[1], n)
+    else:
+        # mean of a log-normal: exp(mu + shape^2 / 2)
+        sizes = rng.lognormal(np.log(values[0]) - values[1] ** 2 / 2, values[1], n)
+    # the payloads are made of 64-bit words
+    return (np.maximum(sizes, 1) * 1024).astype(np.int64) // 8 * 8
+
+
+def generate(output_dir: str, files: int, events_per_file: int, lumis: int, sizes: str, run=1, seed=0):
+    rng = np.random.default_rng(seed)
+    block = rng.integers(0, 256, RANDOM_BLOCK_SIZE, dtype=np.uint8).tobytes()
+    run_dir = os.path.join(output_dir, "run%d" % run)
+    os.makedirs(run_dir, exist_ok=True)
+    paths = []
+    total = 0
+    event = 0
+    indices = {}
+    for i in range(files):
+        lumi = 1 + i * lumis // files
+        index = indices[lumi] = indices.get(lumi, -1) + 1
+        path = os.path.join(run_dir, "run%d_ls%04d_index%06d.raw" % (run, lumi, index))
+        event_sizes = draw_sizes(rng, sizes, events_per_file)
+        file_size = FILE_HEADER.size + int(event_sizes.sum()) + EVENT_HEADER.size * events_per_file
+        with open(path, "wb") as f:
+            f.write(FILE_HEADER.pack(FILE_MAGIC + b"0002", FILE_HEADER.size, RAW_DATA_TYPE, events_per_file,
+                                     run, lumi, file_size))
+            for size in event_sizes:
+                size = int(min(size, RANDOM_BLOCK_SIZE))
+                start = int(rng.integers(0, RANDOM_BLOCK_SIZE - size + 1))
+                f.write(EVENT_HEADER.pack(6, 0, run, lumi, event, size, 0))
+                f.write(block[start:start + size])
+                event += 1
+        paths.append(path)
+        total += os.path.getsize(path)
+    with open(os.path.join(output_dir, "files.txt"), "w") as f:
+        f.write("\n".join(paths) + "\n")
+    return paths, total
+
+
+# Counts the events of a file from its data, fed in order in pieces of any size
+class EventCounter:
+
+    def __init__(self):
+        self.events = 0
+        self.next_event = None  # offset of the next event header
+        self.carry = b""        # start of a header cut by the end of the previous piece
+        self.carry_offset = 0
+
+    def feed(self, offset: int, data):
+        if self.carry:
+            buffer, base = self.carry + bytes(data), self.carry_offset
+        else:
+            buffer, base = data, offset
+        if self.next_event is None:
+            if len(buffer) < FILE_HEADER.size:
+                self.carry, self.carry_offset = bytes(buffer), base
+                return
+            header = bytes(buffer[:FILE_HEADER.size])
+            self.next_event = FILE_HEADER.unpack(header)[1] if header.startswith(FILE_MAGIC) else 0
+        while self.next_event - base + VERSION_FORMAT.size <= len(buffer):
+            position = self.next_event - base
+            version = VERSION_FORMAT.unpack_from(buffer, position)[0]
+            if version not in EVENT_HEADERS:
+                raise ValueError("unknown FRD event version %d at offset %d" % (version, self.next_event))
+            header, names = EVENT_HEADERS[version]
+            if position + header.size > len(buffer):
+                break
+            fields = dict(zip(names, header.unpack_from(buffer, position)))
+            self.next_event += header.size + fields["event_size"] + fields.get("padding_size", 0)
+            self.events += 1
+        end = offset + len(data)
+        self.carry = bytes(buffer[self.next_event - base:]) if self.next_event < end else b""
+        self.carry_offset = self.next_event
+
+
+def read_buffered(paths: list, chunk_size: int, **_):
+    counters = []
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    for path in paths:
+        counter = EventCounter()
+        offset = 0
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                n = f.readinto(buffer)
+                if n == 0:
+                    break
+                counter.feed(offset, view[:n])
+                offset += n
+        counters.append(counter)
+    return counters
+
+
+def read_mmap(paths: list, **_):
+    counters = []
+    for path in paths:
+        counter = EventCounter()
+        if os.path.getsize(path) > 0:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                pages = np.frombuffer(m, dtype=np.uint8)
+                pages[::PAGE_SIZE].sum()
+                del pages
+                counter.feed(0, m)
+        counters.append(counter)
+    return counters
+
+
+def read_odirect(paths: list, chunk_size: int, **_):
+    counters = []
+    # anonymous maps are page aligned, as O_DIRECT needs
+    buffer = mmap.mmap(-1, chunk_size)
+    view = memoryview(buffer)
+    for path in paths:
+        counter = EventCounter()
+        offset = 0
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+        try:
+            while True:
+                n = os.preadv(fd, [buffer], offset)
+                if n == 0:
+                    break
+                counter.feed(offset, view[:n])
+                offset += n
+        finally:
+            os.close(fd)
+        counters.append(counter)
+    return counters
+
+
+# FedRawDataInputSource: read_threads threads fill num_buffers chunks, in reads of block_size,
+# from at most max_buffered_files files ahead of the one being processed, while this thread
+# walks the events of the chunks in order
+def read_chunked(paths: list, chunk_size: int, block_size: int, num_buffers: int, read_threads: int,
+                 max_buffered_files: int, **_):
+    tasks = [(i, offset, min(chunk_size, os.path.getsize(path) - offset))
+             for i, path in enumerate(paths) for offset in range(0, os.path.getsize(path), chunk_size)]
+    free = queue.Queue()
+    for _ in range(num_buffers):
+        free.put(bytearray(chunk_size))
+    task_iterator = iter(enumerate(tasks))
+    lock = threading.Lock()
+    progress = threading.Condition()
+    ready = {}
+    state = {"file": 0}
+
+    def reader():
+        while True:
+            # a buffer is taken before the task, so the oldest pending chunk always has one
+            with lock:
+                buffer = free.get()
+                task = next(task_iterator, None)
+            if task is None:
+                free.put(buffer)
+                return
+            index, (file_index, offset, length) = task
+            with progress:
+                progress.wait_for(lambda: file_index < state["file"] + max_buffered_files)
+            try:
+                view = memoryview(buffer)
+                n = 0
+                fd = os.open(paths[file_index], os.O_RDONLY)
+                try:
+                    while n < length:
+                        r = os.preadv(fd, [view[n:min(length, n + block_size)]], offset + n)
+                        if r == 0:
+                            break
+                        n += r
+                finally:
+                    os.close(fd)
+                result = (buffer, n)
+            except OSError as e:
+                result = e
+            with progress:
+                ready[index] = result
+                progress.notify_all()
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(read_threads)]
+    for thread in threads:
+        thread.start()
+    counters = [EventCounter() for _ in paths]
+    for index, (file_index, offset, _) in enumerate(tasks):
+        with progress:
+            state["file"] = file_index
+            progress.notify_all()
+            progress.wait_for(lambda: index in ready)
+            result = ready.pop(index)
+        if isinstance(result, OSError):
+            raise result
+        buffer, n = result
+        counters[file_index].feed(offset, memoryview(buffer)[:n])
+        free.put(buffer)
+    for thread in threads:
+        thread.join()
+    return counters
+
+
+READER_FUNCTIONS = {"buffered": read_buffered, "mmap": read_mmap, "odirect": read_odirect, "chunked": read_chunked}
+
+
+def get_files(path: str):
+    if os.path.isfile(path):
+        with open(path) as f:
+            return [line.strip() for line in f if line.strip() != ""]
+    if os.path.isfile(os.path.join(path, "files.txt")):
+        return get_files(os.path.join(path, "files.txt"))
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith(".raw"))
+
+
+def run(paths: list, readers: list, cache: str, options: dict):
+    expected = [scan_file(path)["events"] for path in paths]
+    size = sum(os.path.getsize(path) for path in paths)
+    results = []
+    for name in readers:
+        state = pagecache.prepare(cache, paths)
+        start = time.time()
+        try:
+            counters = READER_FUNCTIONS[name](paths, **options)
+        except OSError as e:
+            print("%-9s failed: %s" % (name, e))
+            continue
+        seconds = time.time() - start
+        events = sum(counter.events for counter in counters)
+        if [counter.events for counter in counters] != expected:
+            raise ValueError("%s reader found %d events instead of %d" % (name, events, sum(expected)))
+        result = {"reader": name, "seconds": seconds, "bytes": size, "events": events,
+                  "gb_per_s": size / 1e9 / seconds, "events_per_s": events / seconds,
+                  "cache": state["policy"], "resident": state["resident"]}
+        results.append(result)
+        print("%-9s %8.2f GB/s %10.0f events/s  (%.1f s, %.0f%% of the input in the page cache before)" %
+              (name, result["gb_per_s"], result["events_per_s"], seconds, 100 * (state["resident"] or 0)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic FRD files and read throughput of the FED raw input")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gen = subparsers.add_parser("generate", help="write synthetic FRD files")
+    gen.add_argument("output_dir")
+    gen.add_argument("--files", type=int, default=16)
+    gen.add_argument("--events-per-file", type=int, default=100)
+    gen.add_argument("--lumis", type=int, default=4, help="lumisections the files are spread over")
+    gen.add_argument("--sizes", default="lognormal:1200,0.3", help="event size distribution, in KB")
+    gen.add_argument("--seed", type=int, default=0)
+    bench = subparsers.add_parser("run", help="measure the read throughput of the files")
+    bench.add_argument("input", help="directory of .raw files (its files.txt if any) or list of files")
+    bench.add_argument("--readers", default=",".join(READERS))
+    bench.add_argument("--cache", default="cold", choices=pagecache.INPUT_CACHE_POLICIES)
+    bench.add_argument("--chunk-mb", type=int, default=200, help="buffer size, eventChunkSize of the chunked reader")
+    bench.add_argument("--block-mb", type=int, default=200, help="eventChunkBlock of the chunked reader")
+    bench.add_argument("--num-buffers", type=int, default=4, help="numBuffers of the chunked reader")
+    bench.add_argument("--read-threads", type=int, default=4, help="reading threads of the chunked reader")
+    bench.add_argument("--max-buffered-files", type=int, default=4, help="maxBufferedFiles of the chunked reader")
+    bench.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "generate":
+            parse_sizes(args.sizes)
+            paths, total = generate(args.output_dir, args.files, args.events_per_file, args.lumis, args.sizes,
+                                    seed=args.seed)
+            print("Wrote %d files, %d events, %.2f GB to %s" % (len(paths), len(paths) * args.events_per_file,
+                                                               total / 1e9, args.output_dir))
+        elif args.command == "run":
+            readers = args.readers.split(",")
+            if any(r not in READERS for r in readers):
+                print("Unknown reader. Supported are", ", ".join(READERS))
+                sys.exit(1)
+            paths = get_files(args.input)
+            if len(paths) == 0:
+                print("No .raw files in", args.input)
+                sys.exit(1)
+            options = {"chunk_size": args.chunk_mb << 20, "block_size": args.block_mb << 20,
+                       "num_buffers": args.num_buffers, "read_threads": args.read_threads,
+                       "max_buffered_files": args.max_buffered_files}
+            results = run(paths, readers, args.cache, options)
+            if args.output:
+                with open(args.output, "w") as f:
+                    json.dump({"files": len(paths), "options": options, "results": results}, f, indent=2)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+
+
+# Append-only JSONL journal of a campaign.
+#
+# Every line is a record with an "event" field:
+#   campaign_start   written when a campaign is started from scratch (not when resuming)
+#   started          a run was launched
+#   done             a run finished, with its duration, throughput and other results
+#   failed           a run failed, with its duration and the error
+# Records are flushed and fsync'ed one by one, so the journal survives crashes and
+# node reboots. Only the records after the last campaign_start belong to the current
+# campaign. A campaign is only resumed with the spec it was started with (its spec_hash),
+# unless forced.
+
+
+# all the repetitions of a configuration share the same group key
+def group_key(config):
+    return f"{config.mpi_impl}_{config.label}_t{config.ts[0]}_s{config.ts[1]}"
+
+
+def run_key(config):
+    return f"{group_key(config)}_r{config.runID}"
+
+
+class Journal:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def append(self, record: dict):
+        record = dict(record, time=time.time())
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def start_campaign(self, spec_hash: str):
+        self.append({"event": "campaign_start", "spec_hash": spec_hash})
+
+    def read(self):
+        # records of the current campaign
+        records = []
+        if not os.path.isfile(self.path):
+            return records
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line cut by a crash
+                    continue
+                if record["event"] == "campaign_start":
+                    records = []
+                records.append(record)
+        return records
+
+    # identifies the current campaign (also across --resume), None if not started
+    def get_campaign_id(self):
+        records = self.read()
+        if len(records) == 0 or records[0]["event"] != "campaign_start":
+            return None
+        return "%s-%d" % (records[0]["spec_hash"][:12], records[0]["time"])
+
+    # spec_hash of the current campaign, None if not started
+    def get_spec_hash(self):
+        records = self.read()
+        if len(records) == 0 or records[0]["event"] != "campaign_start":
+            return None
+        return records[0].get("spec_hash")
+
+    def get_status(self):
+        # key -> (last status, number of failed attempts)
+        status = {}
+        for record in self.read():
+            if record["event"] == "campaign_start":
+                continue
+            last, failures = status.get(record["key"], (None, 0))
+            if record["event"] == "failed":
+                failures += 1
+            status[record["key"]] = (record["event"], failures)
+        return status
+
+    def get_throughputs(self, field="throughput"):
+        # group key -> throughputs (or another result field) of the runs done
+        throughputs = {}
+        for record in self.read():
+            if record["event"] == "done" and record.get(field) is not None:
+                throughputs.setdefault(record["group"], []).append(record[field])
+        return throughputs
+
+    def run_started(self, config):
+        self.append({"event": "started", "key": run_key(config), "label": config.label,
+                     "mpi_impl": config.mpi_impl, "ts": list(config.ts), "runID": config.runID})
+
+    # output: dict returned by doit.run_benchmark, with at least the throughput
+    def run_done(self, config, duration: float, output: dict):
+        self.append(dict(output, event="done", key=run_key(config), group=group_key(config), duration=duration))
+
+    def run_failed(self, config, duration: float, error):
+        self.append({"event": "failed", "key": run_key(config), "duration": duration, "error": str(error)})
+
+
+# Removes from the plan the runs that are already done, and those that failed
+# more than max_retries times. Raises ValueError if the campaign was started with another
+# spec than spec_hash, unless force.
+def filter_plan_for_resume(plan: list, journal: Journal, max_retries: int, spec_hash=None, force=False):
+    started_with = journal.get_spec_hash()
+    if spec_hash is not None and started_with is not None and started_with != spec_hash:
+        if not force:
+            raise ValueError("the campaign in %s was started with another spec (hash %s, now %s): its results "
+                             "would be mixed with runs of the new spec. Start it again, or use --force-resume"
+                             % (journal.path, started_with[:12], spec_hash[:12]))
+        print("Warning: resuming a campaign started with another spec (hash %s, now %s)" %
+              (started_with[:12], spec_hash[:12]))
+    status = journal.get_status()
+    remaining = []
+    n_done = n_given_up = 0
+    for config in plan:
+        last, failures = status.get(run_key(config), (None, 0))
+        if last == "done":
+            n_done += 1
+        elif failures > max_retries:
+            n_given_up += 1
+        else:
+            remaining.append(config)
+    print("Resuming campaign: %d runs done, %d given up after %d retries, %d to run"
+          % (n_done, n_given_up, max_retries, len(remaining)))
+    return remaining
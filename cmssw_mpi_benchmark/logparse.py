@@ -0,0 +1,19 @@
+import re
+
+
+# Parsing of the cmsRun logs, shared by doit.py and results.py (import-logs) without
+# importing the whole harness.
+
+
+def get_throughput_from_log(log_file_path: str):
+    with open(log_file_path, 'r') as f:
+        line = next((l for l in f if 'throughput' in l), None)
+        if line is None:
+            raise ValueError("No line containing 'throughput' found in the log file")
+
+        match = re.search(r'(\d+\.\d+)', line)
+        if match is None:
+            raise ValueError("No number found in throughput line")
+
+        value = round(float(match.group(1)))
+        return value
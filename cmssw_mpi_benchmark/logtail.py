@@ -0,0 +1,312 @@
+import os
+import re
+import signal
+import subprocess
+import time
+
+import numpy as np
+
+from steady_state import estimate_steady_state
+from telemetry import find_cmsrun_processes
+
+
+# Incremental tailer of the log of a running benchmark.
+#
+# hlt.py enables the ThroughputService event summary (printEventSummary, one message every
+# eventResolution = 10 events). The tailer reads the log while cmsRun runs, and builds a
+# time series of (seconds since launch, events processed): the time is taken when the
+# message shows up in the log, the number of events from the message itself if it has one
+# ("... 120 events ..."), otherwise by counting messages * event_resolution.
+#
+# In MPI jobs both ranks print their event summary (the local one redefines ThroughputService
+# with printEventSummary = True in hlt_local.py, the remote one clones the service of hlt.py),
+# each with its own count. The tailer keeps one series per rank, and times / events are the
+# series of the local rank, which completes an event once the remote rank sent its products
+# back, or of the first rank with event messages if the local one has none. Untagged lines
+# (the output of the launcher) are not counted.
+#
+# The job is killed early (the whole process group: mpirun forwards the signal to the
+# ranks) when the log shows a fatal error, or when no progress is made for too long.
+#
+# Time-boxed runs are instead stopped cleanly, once time_budget seconds have passed or once
+# the steady-state throughput (see steady_state.py) is stable to steady_state_tolerance:
+# SIGUSR2 asks cmsRun to stop reading new events and end the job normally, so it still
+# prints its throughput. It is only sent to the cmsRun ranks of the session running on this
+# machine (as found by telemetry.py), not to the whole process group: the launchers
+# (cmsenv_mpirun, mpirun, Hydra's mpiexec, wrapper shells) do not all handle SIGUSR2 and
+# would die of it. The local rank stops its source and the MPIController ends the stream of
+# the remote MPISource. If no rank runs on this machine, the job is killed instead.
+#
+# Startup breakdown: the tailer also notes when each rank reaches the transitions of the job,
+# in seconds since launch:
+#   configured    the python config is processed (EXPERIMENT_PHASE marker printed by the
+#                 configs, after customizeHLTforCMSSW and the GlobalTag)
+#   begin_job     only with the Tracer service enabled in the config
+#   first_event   first FwkReport record or ThroughputService event summary
+#   last_event    last of them
+#   end_job       end-of-job throughput or timing report
+# MPI jobs are launched with their output tagged by rank (--tag-output, -prepend-rank), in
+# the order local, remote. The phases between the transitions found are
+#   configuration, construction (modules, services, ES producers), initialization (conditions,
+#   begin run, MPI wire-up through server.uri), event_loop, end_job and teardown (until exit)
+# named after the transition that ends them; "startup" is everything before the first event.
+
+EVENT_RESOLUTION = 10
+
+THROUGHPUT_SERVICE_RE = re.compile(r"ThroughputService")
+MSG_HEADER_RE = re.compile(r"^%MSG-\w\s+(\S+?):")
+EVENTS_RE = re.compile(r"(\d+)\s+events?\b")
+# "[1,0]<stdout>:" (OpenMPI --tag-output) or "[0] " (MPICH -prepend-rank)
+RANK_PREFIX_RE = re.compile(r"^\[(?:\d+,)?(\d+)\](?:<std(?:out|err)>:)? ?")
+
+TRANSITION_PATTERNS = [
+    ("configured", re.compile(r"EXPERIMENT_PHASE configured")),
+    ("begin_job", re.compile(r"starting: begin job")),
+    ("first_event", re.compile(r"Begin processing the 1st record")),
+    ("end_job", re.compile(r"Average throughput|TimeReport>|FastReport")),
+]
+LAST_EVENT_RE = re.compile(r"Begin processing the \d+\w* record")
+TRANSITIONS = ["launch", "configured", "begin_job", "first_event", "last_event", "end_job", "exit"]
+PHASE_NAMES = {"configured": "configuration", "begin_job": "construction", "first_event": "initialization",
+               "last_event": "event_loop", "end_job": "end_job", "exit": "teardown"}
+STARTUP_PHASES = ["configuration", "construction", "initialization"]
+
+FATAL_PATTERNS = [
+    re.compile(r"----- Begin Fatal Exception"),
+    re.compile(r"An exception of category"),
+    re.compile(r"Segmentation fault|segmentation violation"),
+    re.compile(r"terminate called"),
+    re.compile(r"MPI_ABORT|MPI_ERR_|MPI error|mpirun (noticed|has exited|detected)", re.IGNORECASE),
+    re.compile(r"UCX\s+ERROR"),
+]
+
+
+class LogTailer:
+
+    def __init__(self, log_file_path: str, label="", ranks=("whole",), stall_timeout=300, startup_timeout=1200, progress_every=30,
+                 time_budget=0, steady_state_tolerance=0, steady_state_min_duration=20, steady_state_check_every=5):
+        self.log_file_path = log_file_path
+        self.label = label
+        self.ranks = list(ranks)
+        self.stall_timeout = stall_timeout
+        self.startup_timeout = startup_timeout
+        self.progress_every = progress_every
+        self.time_budget = time_budget
+        self.steady_state_tolerance = steady_state_tolerance
+        self.steady_state_min_duration = steady_state_min_duration
+        self.steady_state_check_every = steady_state_check_every
+
+        self.start_time = time.time()
+        self.offset = 0
+        self.partial = ""
+        self.in_throughput_msg = False
+
+        # rank -> time series: seconds since launch, events processed
+        self.series = {rank: ([], []) for rank in self.ranks}
+        # the rank whose series is used, then the others
+        self.series_ranks = sorted(self.ranks, key=lambda rank: rank != "local")
+        self.abort_reason = None
+        self.stop_reason = None
+        self.last_progress_print = self.start_time
+        self.last_steady_state_check = self.start_time
+        # rank -> transition -> seconds since launch
+        self.transitions = {rank: {} for rank in self.ranks}
+
+    def get_series_rank(self):
+        return next((rank for rank in self.series_ranks if self.series[rank][0]), self.series_ranks[0])
+
+    @property
+    def times(self):
+        return self.series[self.get_series_rank()][0]
+
+    @property
+    def events(self):
+        return self.series[self.get_series_rank()][1]
+
+    def get_rank(self, line: str):
+        # rank of a line and the line without its tag; None for the output of the launcher
+        if len(self.ranks) == 1:
+            return self.ranks[0], line
+        match = RANK_PREFIX_RE.match(line)
+        if match is None or int(match.group(1)) >= len(self.ranks):
+            return None, line
+        return self.ranks[int(match.group(1))], line[match.end():]
+
+    def note_transitions(self, rank: str, line: str, now: float):
+        transitions = self.transitions[rank]
+        for name, pattern in TRANSITION_PATTERNS:
+            if name not in transitions and pattern.search(line):
+                transitions[name] = now - self.start_time
+        if LAST_EVENT_RE.search(line):
+            transitions["last_event"] = now - self.start_time
+
+    def parse_line(self, line: str, now: float):
+        for pattern in FATAL_PATTERNS:
+            if pattern.search(line):
+                self.abort_reason = "fatal error in log: " + line.strip()
+                return
+
+        rank, line = self.get_rank(line)
+        if rank is not None:
+            self.note_transitions(rank, line, now)
+
+        header = MSG_HEADER_RE.match(line)
+        if header is not None:
+            self.in_throughput_msg = header.group(1) == "ThroughputService"
+            return
+        if line.startswith("%MSG"):
+            self.in_throughput_msg = False
+            return
+        if not (self.in_throughput_msg or THROUGHPUT_SERVICE_RE.search(line)):
+            return
+        # the final "Average throughput" message is not part of the event summary
+        if "throughput" in line or rank is None:
+            return
+
+        times, events = self.series[rank]
+        match = EVENTS_RE.search(line)
+        if match is not None:
+            n_events = int(match.group(1))
+        else:
+            n_events = (events[-1] if events else 0) + EVENT_RESOLUTION
+        times.append(now - self.start_time)
+        events.append(n_events)
+        self.transitions[rank].setdefault("first_event", now - self.start_time)
+        self.transitions[rank]["last_event"] = now - self.start_time
+
+    def poll(self):
+        now = time.time()
+        with open(self.log_file_path, "r", errors="replace") as f:
+            f.seek(self.offset)
+            data = f.read()
+            self.offset = f.tell()
+
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            self.parse_line(line, now)
+            if self.abort_reason is not None:
+                return
+
+        last_progress = self.start_time + self.times[-1] if self.times else self.start_time
+        timeout = self.stall_timeout if self.times else self.startup_timeout
+        if now - last_progress > timeout:
+            self.abort_reason = "no progress for %d s" % (now - last_progress)
+            return
+
+        if self.progress_every > 0 and now - self.last_progress_print >= self.progress_every:
+            self.last_progress_print = now
+            print("  [%s] %s" % (self.label, self.get_progress()))
+
+    # Decides whether a time-boxed run can be stopped
+    def check_stop(self):
+        now = time.time()
+        if self.time_budget > 0 and now - self.start_time >= self.time_budget:
+            self.stop_reason = "time budget of %d s reached" % self.time_budget
+            return
+        if self.steady_state_tolerance <= 0 or now - self.last_steady_state_check < self.steady_state_check_every:
+            return
+        self.last_steady_state_check = now
+        estimate = estimate_steady_state(self.times, self.events)
+        if estimate is None or estimate["drain_windows"] > 0:
+            return
+        half_width = (estimate["ci"][1] - estimate["ci"][0]) / 2
+        if (estimate["end"] - estimate["start"] >= self.steady_state_min_duration and
+                half_width <= self.steady_state_tolerance * estimate["throughput"]):
+            self.stop_reason = "steady state reached, %.1f events/s +- %.1f" % (estimate["throughput"], half_width)
+
+    def get_live_rate(self, window=5):
+        # events/s over the last `window` summaries
+        if len(self.times) < 2:
+            return 0.0
+        first = max(0, len(self.times) - 1 - window)
+        dt = self.times[-1] - self.times[first]
+        return (self.events[-1] - self.events[first]) / dt if dt > 0 else 0.0
+
+    def get_progress(self):
+        n_events = self.events[-1] if self.events else 0
+        return "%d events after %.0f s, %.1f events/s" % (n_events, time.time() - self.start_time, self.get_live_rate())
+
+    # Tails the log until the process ends or has to be aborted. Returns the return code.
+    def follow(self, process: subprocess.Popen, poll_interval=0.25):
+        while process.poll() is None:
+            self.poll()
+            if self.abort_reason is not None:
+                print("  [%s] aborting: %s" % (self.label, self.abort_reason))
+                kill_process_group(process)
+                return process.returncode
+            if self.stop_reason is None:
+                self.check_stop()
+                if self.stop_reason is not None:
+                    print("  [%s] stopping: %s" % (self.label, self.stop_reason))
+                    if not stop_cmsrun_ranks(process):
+                        print("  [%s] no cmsRun rank on this machine to stop, killing the job" % self.label)
+                        kill_process_group(process)
+                        return process.returncode
+            time.sleep(poll_interval)
+        self.poll()
+        return process.returncode
+
+    # rank -> phase -> seconds, from the transitions seen and the end of the job
+    def get_phases(self, end_time: float):
+        # both ranks process the same events: a rank without event messages (e.g. with
+        # printEventSummary = False and no FwkReport) gets the first and last events of the job
+        events = {}
+        for transitions in self.transitions.values():
+            if "first_event" in transitions:
+                events["first_event"] = min(events.get("first_event", np.inf), transitions["first_event"])
+                events["last_event"] = max(events.get("last_event", 0), transitions["last_event"])
+        phases = {}
+        for rank, transitions in self.transitions.items():
+            times = dict(events, launch=0.0, exit=end_time - self.start_time)
+            times.update(transitions)
+            found = [t for t in TRANSITIONS if t in times]
+            # a phase is only known if no transition other than the optional begin_job is missing
+            phases[rank] = {PHASE_NAMES[b]: times[b] - times[a] for a, b in zip(found, found[1:])
+                            if TRANSITIONS.index(b) - TRANSITIONS.index(a) == 1 or
+                            TRANSITIONS[TRANSITIONS.index(a) + 1:TRANSITIONS.index(b)] == ["begin_job"]}
+            if "first_event" in times:
+                phases[rank]["startup"] = times["first_event"]
+        return phases
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            f.write("time,events\n")
+            for t, n in zip(self.times, self.events):
+                f.write("%.3f,%d\n" % (t, n))
+
+
+# Asks the cmsRun ranks of the session to end the job cleanly, returns False if there is none.
+# The process must have been started with start_new_session=True
+def stop_cmsrun_ranks(process: subprocess.Popen):
+    stopped = False
+    for pid in find_cmsrun_processes(process.pid):
+        try:
+            os.kill(pid, signal.SIGUSR2)
+            stopped = True
+        except ProcessLookupError:
+            pass
+    return stopped
+
+
+# The process must have been started with start_new_session=True
+def kill_process_group(process: subprocess.Popen, grace_period=30):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        process.wait()
+
+
+def load_progress(path: str):
+    times, events = [], []
+    with open(path) as f:
+        next(f)
+        for line in f:
+            t, n = line.strip().split(",")
+            times.append(float(t))
+            events.append(int(n))
+    return times, events
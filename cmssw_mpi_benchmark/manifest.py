@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import struct
+import sys
+
+from staging import HARNESS_DIR, get_input_cff, read_input_cff
+
+
+# Manifest of the FED raw input: events, bytes and lumisection of every .raw file, to give
+# the runs only the files they need.
+#
+# The input cff lists ~115 files per lumisection, while maxEvents.input = 1300 only reads a
+# fraction of them. The manifest is built by scanning every file once: the FRD file header
+# (if any) and the header of every event, seeking over the payloads. It is kept in a JSON
+# index and a file is only scanned again when its size or mtime change.
+#
+# With input_manifest set in the campaign, the harness selects the smallest list of files
+# with at least max_events events, taking the files of the lumisections in turn so that the
+# events are spread evenly across them, and gives it to the runs in EXPERIMENT_INPUT_LIST
+# (configs/experiment_input.py replaces fileNames with it). The files keep the order of the
+# cff, so the lumisections are still read in order. Staging (staging.py) and the page cache
+# control (pagecache.py) use the same list, which cuts their volume too.
+#
+# Formats (EventFilter/Utilities FRDFileHeader.h and IOPool/Streamer FRDEventMessage.h):
+#   file header   "RAW_" + version ("0001", "0002"), uint16 header size, uint16 data type,
+#                 uint32 event count, ...; files without it start with the first event
+#   event header  version 1 to 6, from its first 16 bits; the lumisection of a file is the
+#                 one of its first event
+#
+# Usage:
+#   python3 manifest.py build [MANIFEST] [--cff CFF]          scans the input of the configs
+#   python3 manifest.py show [MANIFEST]
+#   python3 manifest.py select MAX_EVENTS [MANIFEST] [--cff CFF]    writes MANIFEST_<MAX_EVENTS>.txt
+
+DEFAULT_MANIFEST = os.path.join(HARNESS_DIR, "input_manifest.json")
+FILE_MAGIC = b"RAW_"
+FILE_HEADER = struct.Struct("<8sHHI")
+# version -> (header, fields); the payload follows the header
+EVENT_HEADERS = {
+    1: (struct.Struct("<IIIII"), ["version", "run", "lumi", "event", "event_size"]),
+    2: (struct.Struct("<IIIIII"), ["version", "run", "lumi", "event", "event_size", "checksum"]),
+    3: (struct.Struct("<IIIIIII"), ["version", "run", "lumi", "event", "event_size", "padding_size", "checksum"]),
+    4: (struct.Struct("<IIIIIII"), ["version", "run", "lumi", "event", "event_size", "padding_size", "checksum"]),
+    5: (struct.Struct("<IIIIIII"), ["version", "run", "lumi", "event", "event_high", "event_size", "checksum"]),
+    6: (struct.Struct("<HHIIIII"), ["version", "flags", "run", "lumi", "event", "event_size", "checksum"]),
+}
+
+
+# fields of the event header at the current position of f and the size of the event
+def read_event_header(f):
+    start = f.read(2)
+    if len(start) < 2:
+        return None, 0
+    version = struct.unpack("<H", start)[0]
+    if version not in EVENT_HEADERS:
+        raise ValueError("unknown FRD event version %d at offset %d" % (version, f.tell() - 2))
+    header, names = EVENT_HEADERS[version]
+    data = start + f.read(header.size - 2)
+    if len(data) < header.size:
+        raise ValueError("truncated FRD event header at offset %d" % (f.tell() - len(data)))
+    fields = dict(zip(names, header.unpack(data)))
+    return fields, header.size + fields["event_size"] + fields.get("padding_size", 0)
+
+
+def scan_file(path: str):
+    stat = os.stat(path)
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime, "events": 0, "lumi": None, "run": None,
+             "event_bytes": 0, "header_events": None}
+    with open(path, "rb") as f:
+        offset = 0
+        start = f.read(FILE_HEADER.size)
+        if start.startswith(FILE_MAGIC) and len(start) == FILE_HEADER.size:
+            _, header_size, _, entry["header_events"] = FILE_HEADER.unpack(start)
+            offset = header_size
+        while offset < stat.st_size:
+            f.seek(offset)
+            fields, size = read_event_header(f)
+            if fields is None:
+                break
+            if offset + size > stat.st_size:
+                raise ValueError("%s: event at offset %d ends after the end of the file" % (path, offset))
+            if entry["lumi"] is None:
+                entry["lumi"], entry["run"] = fields["lumi"], fields["run"]
+            entry["events"] += 1
+            entry["event_bytes"] += size
+            offset += size
+    if entry["header_events"] is not None and entry["header_events"] != entry["events"]:
+        raise ValueError("%s: the file header says %d events, %d found" % (path, entry["header_events"], entry["events"]))
+    return entry
+
+
+def load_manifest(path: str):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(path: str, manifest: dict):
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.rename(path + ".tmp", path)
+
+
+# Scans the files that are new or changed since the manifest was saved
+def update_manifest(path: str, files: list):
+    manifest = load_manifest(path)
+    scanned = 0
+    for source in files:
+        stat = os.stat(source)
+        entry = manifest.get(source)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+        manifest[source] = scan_file(source)
+        scanned += 1
+    if scanned > 0:
+        save_manifest(path, manifest)
+    return manifest, scanned
+
+
+# Smallest list of files (in the order of files) with at least max_events events, taking
+# one file of each lumisection in turn
+def select_files(manifest: dict, files: list, max_events: int):
+    if max_events < 0:
+        return list(files)
+    lumis = {}
+    for source in files:
+        lumis.setdefault(manifest[source]["lumi"], []).append(source)
+    queues = [list(reversed(lumi_files)) for _, lumi_files in sorted(lumis.items())]
+    selected = set()
+    events = 0
+    while events < max_events and any(queues):
+        for queue in queues:
+            if events >= max_events:
+                break
+            if queue:
+                source = queue.pop()
+                selected.add(source)
+                events += manifest[source]["events"]
+    if events < max_events:
+        print("Warning: the input has only %d events, %d requested" % (events, max_events))
+    return [source for source in files if source in selected]
+
+
+# Selects the files of the input cff needed for max_events events and writes their list
+# next to the manifest. Returns the path of the list.
+def write_input_list(manifest_path: str, max_events: int, cff=None):
+    _, files = read_input_cff(cff or get_input_cff())
+    manifest, scanned = update_manifest(manifest_path, files)
+    if scanned > 0:
+        print("Scanned %d input files for the manifest %s" % (scanned, manifest_path))
+    selected = select_files(manifest, files, max_events)
+    list_path = "%s_%d.txt" % (os.path.splitext(manifest_path)[0], max_events)
+    with open(list_path, "w") as f:
+        f.write("\n".join(selected) + "\n")
+    size = sum(manifest[source]["size"] for source in selected)
+    print("Input: %d of %d files (%.1f GB, %d lumisections) for %d events" %
+          (len(selected), len(files), size / 1e9, len({manifest[s]["lumi"] for s in selected}), max_events))
+    return list_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index the FED raw input files and select those a run needs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="scan the input files of the configs on this machine")
+    build.add_argument("manifest", nargs="?", default=DEFAULT_MANIFEST)
+    build.add_argument("--cff", help="input cff (default: the one hlt.py loads on this machine)")
+    show = subparsers.add_parser("show", help="events and bytes per lumisection")
+    show.add_argument("manifest", nargs="?", default=DEFAULT_MANIFEST)
+    select = subparsers.add_parser("select", help="write the list of files needed for MAX_EVENTS events")
+    select.add_argument("max_events", type=int)
+    select.add_argument("manifest", nargs="?", default=DEFAULT_MANIFEST)
+    select.add_argument("--cff", help="input cff (default: the one hlt.py loads on this machine)")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            _, files = read_input_cff(args.cff or get_input_cff())
+            manifest, scanned = update_manifest(args.manifest, files)
+            print("Scanned %d of %d files, %d events" % (scanned, len(files), sum(manifest[f]["events"] for f in files)))
+        elif args.command == "show":
+            lumis = {}
+            for entry in load_manifest(args.manifest).values():
+                lumi = lumis.setdefault((entry["run"], entry["lumi"]), [0, 0, 0])
+                lumi[0] += 1
+                lumi[1] += entry["events"]
+                lumi[2] += entry["size"]
+            for (run, lumi), (n_files, events, size) in sorted(lumis.items(), key=lambda kv: str(kv[0])):
+                print("run %s ls %s: %4d files %7d events %8.1f MB (%.2f MB/event)" %
+                      (run, lumi, n_files, events, size / 1e6, size / 1e6 / max(events, 1)))
+        elif args.command == "select":
+            print(write_input_list(args.manifest, args.max_events, args.cff))
+    except (OSError, ValueError) as e:
+        print("Manifest failed:", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
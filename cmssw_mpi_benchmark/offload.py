@@ -0,0 +1,182 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from results import DEFAULT_DB, ResultsStore, summarize
+from timing import load_module_table, summarize_modules
+
+
+# Offload overhead: compares a standalone setup (hlt_test.py, "whole" rank) with an
+# offloaded one (hlt_local.py + hlt_remote.py, "local" rank) at the same ts, from the
+# per-module timings of the results database (see timing.py).
+#
+# In hlt_local.py every offloaded producer is replaced by an MPIReceiver with the same
+# label, so for each of them:
+#   saved compute   the real time of the producer in the standalone runs
+#   waiting         real - CPU time of the MPIReceiver (blocked on the remote rank)
+#   communication   CPU time of the MPIReceiver, plus the real time of the MPISenders
+#                   and of the MPIController
+#   gating          real time of the PathStateRelease / PathStateCapture modules
+# attributed to a subsystem (ECAL, HBHE, Pixel, common) from the module label. Everything
+# else that changed between the two is "rest".
+#
+# The local rank is assumed CPU-bound: its throughput is inversely proportional to the busy
+# (non-idle) time per event B. The predicted difference X_s * (B_s / B_o - 1) is split
+# exactly among the components, each time delta d contributing -X_s * d / B_o events/s;
+# what the prediction misses of the measured difference is "unexplained".
+#
+# Usage:
+#   python3 offload.py STANDALONE_LABEL OFFLOADED_LABEL [--ts 32,24] [--campaign C] [--json FILE]
+
+SUBSYSTEMS = [("ECAL", ["Ecal"]), ("HBHE", ["Hbhe", "HBHE"]), ("Pixel", ["Pixel"])]
+CATEGORIES = ["saved", "waiting", "communication", "gating", "rest"]
+GATING_TYPES = ["PathStateRelease", "PathStateCapture"]
+COMMUNICATION_TYPES = ["MPISender", "MPIController"]
+
+
+def get_subsystem(label: str):
+    for subsystem, patterns in SUBSYSTEMS:
+        if any(p in label for p in patterns):
+            return subsystem
+    return "common"
+
+
+# ms/event of each module of one (setup, ts, rank): label -> (type, real, cpu)
+def get_module_times(summary: list, types: dict, setup: str, ts: list, rank: str):
+    return {s["module"]: (types.get((setup, rank, s["module"]), ""), s["time_real"], s["time_thread"])
+            for s in summary if s["setup"] == setup and s["ts"] == ts and s["rank"] == rank}
+
+
+def get_busy_time(modules: dict):
+    return sum(real for label, (_, real, _) in modules.items() if label != "idle")
+
+
+def attribute(standalone: dict, local: dict):
+    # (subsystem, category) -> change of the busy time per event (ms), standalone -> offloaded
+    deltas = {}
+
+    def add(label, category, value):
+        key = (get_subsystem(label), category)
+        deltas[key] = deltas.get(key, 0) + value
+
+    for label, (type, real, cpu) in local.items():
+        if label == "idle":
+            continue
+        if type == "MPIReceiver":
+            add(label, "saved", -standalone.get(label, ("", 0, 0))[1])
+            add(label, "waiting", real - cpu)
+            add(label, "communication", cpu)
+        elif type in COMMUNICATION_TYPES:
+            add(label, "communication", real)
+        elif type in GATING_TYPES:
+            add(label, "gating", real)
+        else:
+            add(label, "rest", real - standalone.get(label, ("", 0, 0))[1])
+    # modules of the standalone runs that are gone from the local rank without a receiver
+    for label, (type, real, cpu) in standalone.items():
+        if label != "idle" and label not in local:
+            add(label, "rest", -real)
+    return deltas
+
+
+def analyze(store: ResultsStore, standalone_label: str, offloaded_label: str, campaign=None, ts=None):
+    table = load_module_table(store, campaign)
+    summary = summarize_modules(table)
+    types = {key[:3]: key[3] for key in zip(table["setup"], table["rank"], table["module"], table["type"])}
+
+    throughputs = {}
+    for key, n, mean, std, half_width in summarize(store.select("label, threads, streams", campaign)):
+        throughputs[(key[0], (key[1], key[2]))] = (mean, half_width)
+
+    ts_standalone = {tuple(s["ts"]) for s in summary if s["setup"] == standalone_label and s["rank"] == "whole"}
+    ts_offloaded = {tuple(s["ts"]) for s in summary if s["setup"] == offloaded_label and s["rank"] == "local"}
+    common = sorted(ts_standalone & ts_offloaded, reverse=True)
+    if ts is not None:
+        common = [t for t in common if list(t) == ts]
+
+    analyses = []
+    for t in common:
+        standalone = get_module_times(summary, types, standalone_label, list(t), "whole")
+        local = get_module_times(summary, types, offloaded_label, list(t), "local")
+        remote = get_module_times(summary, types, offloaded_label, list(t), "remote")
+        busy_standalone, busy_local = get_busy_time(standalone), get_busy_time(local)
+        deltas = attribute(standalone, local)
+
+        x_standalone = throughputs.get((standalone_label, t), (np.nan, np.nan))
+        x_offloaded = throughputs.get((offloaded_label, t), (np.nan, np.nan))
+        contributions = {"%s/%s" % key: -x_standalone[0] * d / busy_local for key, d in deltas.items()}
+        predicted = x_standalone[0] * (busy_standalone / busy_local - 1)
+        measured = x_offloaded[0] - x_standalone[0]
+
+        remote_compute = {}
+        for label, (type, real, cpu) in remote.items():
+            if label != "idle" and type not in COMMUNICATION_TYPES + GATING_TYPES + ["MPISource", "MPIReceiver"]:
+                subsystem = get_subsystem(label)
+                remote_compute[subsystem] = remote_compute.get(subsystem, 0) + real
+
+        analyses.append({
+            "ts": list(t),
+            "throughput_standalone": x_standalone,
+            "throughput_offloaded": x_offloaded,
+            "busy_ms_standalone": busy_standalone,
+            "busy_ms_local": busy_local,
+            "deltas_ms": {"%s/%s" % key: d for key, d in deltas.items()},
+            "contributions": contributions,
+            "predicted_difference": predicted,
+            "measured_difference": measured,
+            "unexplained": measured - predicted,
+            "remote_compute_ms": remote_compute,
+        })
+    return analyses
+
+
+def print_analysis(a: dict):
+    print("[t,s] = [%d,%d]: standalone %.1f +- %.1f events/s, offloaded %.1f +- %.1f events/s" %
+          (*a["ts"], *a["throughput_standalone"], *a["throughput_offloaded"]))
+    print("  local busy time %.2f ms/event (standalone %.2f), remote compute %s" %
+          (a["busy_ms_local"], a["busy_ms_standalone"],
+           ", ".join("%s %.2f ms" % kv for kv in sorted(a["remote_compute_ms"].items())) or "n/a"))
+    subsystems = sorted({key.split("/")[0] for key in a["deltas_ms"]})
+    print("  %-10s" % "" + "".join("%25s" % c for c in CATEGORIES))
+    for subsystem in subsystems:
+        line = "  %-10s" % subsystem
+        for category in CATEGORIES:
+            key = subsystem + "/" + category
+            if key in a["deltas_ms"]:
+                line += "  %+7.2f ms %+7.1f ev/s" % (a["deltas_ms"][key], a["contributions"][key])
+            else:
+                line += "%25s" % "-"
+        print(line)
+    print("  predicted %+.1f events/s, measured %+.1f events/s, unexplained %+.1f events/s" %
+          (a["predicted_difference"], a["measured_difference"], a["unexplained"]))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attribute the throughput difference between a standalone and "
+                                                 "an offloaded setup to saved compute, communication and waiting")
+    parser.add_argument("standalone", help="label of the standalone setup, e.g. milan_standalone_cpuonly")
+    parser.add_argument("offloaded", help="label of the offloaded setup, e.g. milan_genoa_ib100G_cpuonly")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--campaign")
+    parser.add_argument("--ts", help="only this ts, e.g. 32,24")
+    parser.add_argument("--json", help="also write the analysis to this file")
+    args = parser.parse_args()
+
+    ts = [int(x) for x in args.ts.split(",")] if args.ts else None
+    analyses = analyze(ResultsStore(args.db), args.standalone, args.offloaded, args.campaign, ts)
+    if len(analyses) == 0:
+        print("No ts with timing summaries for both %s (whole rank) and %s (local rank)" %
+              (args.standalone, args.offloaded))
+        sys.exit(1)
+    for a in analyses:
+        print_analysis(a)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(analyses, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
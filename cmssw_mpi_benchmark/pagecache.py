@@ -0,0 +1,172 @@
+import argparse
+import ctypes
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from staging import get_run_input
+
+
+# Page cache state of the FED raw input before every run.
+#
+# The first run of a campaign reads its input from NFS (or the staging disk) while the next
+# ones find it in the page cache, so the first repetition is systematically different. The
+# input_cache option of the campaign sets the state of the input files before each run:
+#   as-is   nothing is done (default)
+#   warm    the files are read in advance by WARM_THREADS threads (posix_fadvise(WILLNEED)
+#           then read), so that the run reads from memory
+#   cold    the files are evicted with posix_fadvise(DONTNEED); if pages are left (e.g.
+#           mapped by another process) the page cache is dropped, when writable by the user
+# Either way the resident fraction of the input (mincore, weighted by bytes) is measured
+# before the launch and stored with the run (output["input_cache"]), so that cold-start and
+# steady-state throughputs can be told apart: "results.py query --group-by label,ts,input_state".
+#
+# The input is the file set of the input cff, or the files the runs need (input_list, see
+# manifest.py), at input_dir if the input is staged, and is only handled for the runs whose
+# local rank is known to run on this machine (not those launched through the MPI hostfile):
+# for the others nothing is measured and input_state is unknown. With max_parallel_runs > 1,
+# evicting the input of a run also evicts it for the runs sharing it.
+#
+# Usage:
+#   python3 pagecache.py status [--input-dir DIR] [--input-list LIST] [FILES...]
+#   python3 pagecache.py warm [--input-dir DIR] [--input-list LIST] [FILES...]
+#   python3 pagecache.py cold [--input-dir DIR] [--input-list LIST] [FILES...]
+
+INPUT_CACHE_POLICIES = ["as-is", "warm", "cold"]
+WARM_THREADS = 8
+CHUNK_SIZE = 16 * 1024 * 1024
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+DROP_CACHES = "/proc/sys/vm/drop_caches"
+
+PROT_READ = 0x1
+MAP_SHARED = 0x01
+MAP_FAILED = ctypes.c_void_p(-1).value
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.mmap.restype = ctypes.c_void_p
+libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+
+
+# files read by the runs, at input_dir if the input is staged (see configs/experiment_input.py)
+def get_input_files(input_dir="", input_list=""):
+    bu_base_dir, files = get_run_input(input_list)
+    if input_dir == "":
+        return files
+    return [os.path.join(input_dir, os.path.relpath(f, bu_base_dir)) for f in files]
+
+
+# (resident bytes, size) of a file in the page cache
+def get_resident(path: str):
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0, 0
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        address = libc.mmap(None, size, PROT_READ, MAP_SHARED, fd, 0)
+        if address == MAP_FAILED:
+            raise OSError(ctypes.get_errno(), "mmap failed", path)
+        try:
+            pages = (size + PAGE_SIZE - 1) // PAGE_SIZE
+            vector = (ctypes.c_ubyte * pages)()
+            if libc.mincore(address, size, vector) != 0:
+                raise OSError(ctypes.get_errno(), "mincore failed", path)
+            resident = sum(v & 1 for v in bytes(vector))
+        finally:
+            libc.munmap(address, size)
+    finally:
+        os.close(fd)
+    return min(resident * PAGE_SIZE, size), size
+
+
+# fraction of the bytes of the files in the page cache (None if none of them exists)
+def get_resident_fraction(files: list):
+    resident = total = 0
+    for path in files:
+        try:
+            r, s = get_resident(path)
+        except OSError:
+            continue
+        resident += r
+        total += s
+    return resident / total if total > 0 else None
+
+
+def read_file(path: str):
+    buffer = bytearray(CHUNK_SIZE)
+    with open(path, "rb", buffering=0) as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while f.readinto(buffer) > 0:
+            pass
+
+
+def warm(files: list, threads=WARM_THREADS):
+    files = [f for f in files if os.path.isfile(f)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(read_file, files))
+
+
+def evict(files: list):
+    for path in files:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def drop_caches():
+    if not os.access(DROP_CACHES, os.W_OK):
+        return False
+    os.sync()
+    with open(DROP_CACHES, "w") as f:
+        f.write("1\n")
+    return True
+
+
+# Sets the page cache state of the files for policy, returns what to store with the run
+def prepare(policy: str, files: list):
+    if policy not in INPUT_CACHE_POLICIES:
+        raise ValueError("Unknown input_cache %s. Supported are %s" % (policy, ", ".join(INPUT_CACHE_POLICIES)))
+    start = time.time()
+    before = get_resident_fraction(files)
+    if policy == "warm":
+        warm(files)
+    elif policy == "cold":
+        evict(files)
+        if (get_resident_fraction(files) or 0) > 0.01 and drop_caches():
+            policy = "cold-drop-caches"
+    resident = before if policy == "as-is" else get_resident_fraction(files)
+    return {"policy": policy, "resident_before": before, "resident": resident, "files": len(files),
+            "prepare_time": time.time() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or set the page cache state of the FED raw input files")
+    parser.add_argument("command", choices=["status", "warm", "cold"])
+    parser.add_argument("files", nargs="*", help="files (default: the input of the configs on this machine)")
+    parser.add_argument("--input-dir", default="", help="staging directory of the input (see staging.py)")
+    parser.add_argument("--input-list", default="", help="files the runs need (see manifest.py)")
+    args = parser.parse_args()
+
+    files = args.files or get_input_files(args.input_dir, args.input_list)
+    if args.command == "status":
+        fraction = get_resident_fraction(files)
+        if fraction is None:
+            print("None of the %d input files exists" % len(files))
+            sys.exit(1)
+        print("%.1f%% of the %d input files in the page cache" % (100 * fraction, len(files)))
+    else:
+        state = prepare(args.command, files)
+        print("%s: %.1f%% of the %d input files in the page cache (was %.1f%%), in %.1f s" %
+              (state["policy"], 100 * (state["resident"] or 0), state["files"], 100 * (state["resident_before"] or 0),
+               state["prepare_time"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
-for f in logs/*.log; do
-  awk '/Average throughput:/{printf "'$f' %.0f\n",$3}' "$f"
-done
+# Throughputs of all the runs, from the results database (see results.py).
+# Logs of campaigns run before the database existed are imported first.
+cd "$(dirname "$0")"
+python3 results.py import-logs logs > /dev/null
+python3 results.py query "$@"
@@ -0,0 +1,159 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from results import DEFAULT_DB, ResultsStore
+from stats import (bootstrap_relative_difference_ci, cliffs_delta, holm_correction, mann_whitney_u,
+                   min_mann_whitney_p_value)
+
+
+# Regression check of a campaign against a baseline campaign, both from the results
+# database (see results.py; "results.py campaigns" lists them). The baseline is typically
+# a rerun of the frozen configs of a snapshot, e.g. campaigns/baseline_2512.toml.
+#
+# The runs are matched by mpi_impl, label and ts. For every configuration measured in both
+# campaigns, the throughputs are compared with a two-sided Mann-Whitney U test (Holm
+# corrected over all the configurations) and the relative difference of the means, with
+# its bootstrap CI, and Cliff's delta as effect sizes. A configuration is a
+#   regression / improvement  if the adjusted p-value is below alpha, the CI of the
+#                             relative difference excludes 0 and |difference| >= min_effect
+#   unchanged                 otherwise
+#   insufficient              with fewer than MIN_RUNS runs in one of the campaigns
+#   underpowered              if even completely separated samples could not reach an adjusted
+#                             p-value below alpha with these numbers of runs
+#
+# With few runs the test cannot reject anything: the smallest two-sided p-value of n1 and n2
+# runs is 2 / C(n1 + n2, n1), and Holm multiplies it by the number m of configurations. With
+# n runs per configuration in both campaigns and alpha = 0.05, the check needs
+#   m = 1: 4 runs    m = 2 to 6: 5 runs    m = 7 to 23: 6 runs    m = 24 to 85: 7 runs
+# (e.g. campaigns/baseline_2512.toml, 16 configurations: last_run_id = 6). "--runs-needed M"
+# prints it for other values.
+#
+# Usage:
+#   python3 regression.py BASELINE CURRENT [--baseline-db DB] [--metric throughput] [--report FILE]
+#   python3 regression.py --runs-needed M [--alpha A]
+# exits with 1 if any regression is found, 2 if there is none but some configurations are
+# underpowered.
+
+# fewest runs with which a single configuration can be significant at alpha = 0.05
+MIN_RUNS = 4
+
+
+def load_campaign(store: ResultsStore, campaign: str, metric: str):
+    # (mpi_impl, label, threads, streams) -> values of the runs
+    values = {}
+    for *key, value in store.select("mpi_impl, label, threads, streams", campaign, metric=metric):
+        values.setdefault(tuple(key), []).append(value)
+    return values
+
+
+# fewest runs per configuration in both campaigns for m configurations to be testable
+def get_runs_needed(m: int, alpha=0.05):
+    n = MIN_RUNS
+    while m * min_mann_whitney_p_value(n, n) >= alpha:
+        n += 1
+    return n
+
+
+def compare(baseline: dict, current: dict, alpha=0.05, min_effect=0.01, confidence=0.95):
+    comparisons = []
+    for key in sorted(set(baseline) & set(current)):
+        x, y = baseline[key], current[key]
+        comparison = {"mpi_impl": key[0], "label": key[1], "ts": [key[2], key[3]],
+                      "n_baseline": len(x), "n_current": len(y),
+                      "mean_baseline": float(np.mean(x)), "mean_current": float(np.mean(y))}
+        if len(x) < MIN_RUNS or len(y) < MIN_RUNS:
+            comparison["verdict"] = "insufficient"
+            comparisons.append(comparison)
+            continue
+        u, p = mann_whitney_u(x, y)
+        difference, low, high = bootstrap_relative_difference_ci(x, y, confidence)
+        comparison.update({"relative_difference": float(difference), "relative_difference_ci": [float(low), float(high)],
+                           "cliffs_delta": cliffs_delta(x, y), "u": float(u), "p_value": float(p)})
+        comparisons.append(comparison)
+
+    tested = [c for c in comparisons if "p_value" in c]
+    for c, p in zip(tested, holm_correction([c["p_value"] for c in tested])):
+        c["p_adjusted"] = float(p)
+        c["min_p_adjusted"] = min(1.0, len(tested) * min_mann_whitney_p_value(c["n_baseline"], c["n_current"]))
+        low, high = c["relative_difference_ci"]
+        significant = p < alpha and (low > 0 or high < 0) and abs(c["relative_difference"]) >= min_effect
+        if not significant and c["min_p_adjusted"] >= alpha:
+            c["verdict"] = "underpowered"
+        elif not significant:
+            c["verdict"] = "unchanged"
+        else:
+            c["verdict"] = "improvement" if c["relative_difference"] > 0 else "regression"
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a campaign with a baseline campaign")
+    parser.add_argument("baseline", nargs="?", help="campaign id of the baseline")
+    parser.add_argument("current", nargs="?", help="campaign id to check")
+    parser.add_argument("--runs-needed", type=int, metavar="M",
+                        help="print the runs per configuration needed to test M configurations, and exit")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--baseline-db", help="results database of the baseline (default: --db)")
+    parser.add_argument("--metric", default="throughput", choices=["throughput", "steady_state"])
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--min-effect", type=float, default=0.01, help="smallest relative difference reported")
+    parser.add_argument("--report", help="write the JSON report to this file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.runs_needed is not None:
+        print("%d runs per configuration in both campaigns" % get_runs_needed(args.runs_needed, args.alpha))
+        return
+    if args.baseline is None or args.current is None:
+        parser.error("BASELINE and CURRENT are needed")
+
+    baseline = load_campaign(ResultsStore(args.baseline_db or args.db), args.baseline, args.metric)
+    current = load_campaign(ResultsStore(args.db), args.current, args.metric)
+    if len(baseline) == 0 or len(current) == 0:
+        print("No runs found for campaign %s" % (args.baseline if len(baseline) == 0 else args.current))
+        sys.exit(1)
+
+    comparisons = compare(baseline, current, args.alpha, args.min_effect)
+    verdicts = [c["verdict"] for c in comparisons]
+    report = {
+        "baseline": args.baseline,
+        "current": args.current,
+        "metric": args.metric,
+        "alpha": args.alpha,
+        "min_effect": args.min_effect,
+        "summary": {v: verdicts.count(v) for v in ["regression", "improvement", "unchanged", "underpowered",
+                                                    "insufficient"]},
+        "only_in_baseline": [list(k) for k in sorted(set(baseline) - set(current))],
+        "only_in_current": [list(k) for k in sorted(set(current) - set(baseline))],
+        "comparisons": comparisons,
+    }
+
+    for c in comparisons:
+        if c["verdict"] in ["regression", "improvement"]:
+            print("%-11s %s %s [t,s] = [%d,%d]: %.1f -> %.1f (%+.1f%%, CI [%+.1f%%, %+.1f%%], "
+                  "Cliff's delta %+.2f, p = %.3g)" %
+                  (c["verdict"], c["mpi_impl"], c["label"], *c["ts"], c["mean_baseline"], c["mean_current"],
+                   100 * c["relative_difference"], *(100 * x for x in c["relative_difference_ci"]),
+                   c["cliffs_delta"], c["p_adjusted"]), file=sys.stderr)
+    print(", ".join("%d %s" % (n, v) for v, n in report["summary"].items()), file=sys.stderr)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if report["summary"]["regression"] > 0:
+        sys.exit(1)
+    if report["summary"]["underpowered"] > 0:
+        tested = sum(1 for c in comparisons if "p_value" in c)
+        print("%d configurations cannot show a regression at alpha = %g with these runs: %d runs per "
+              "configuration are needed for %d configurations" %
+              (report["summary"]["underpowered"], args.alpha, get_runs_needed(tested, args.alpha), tested),
+              file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
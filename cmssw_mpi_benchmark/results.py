@@ -0,0 +1,330 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+from logparse import get_throughput_from_log
+
+
+# Results database: one row per run, with the full Config, the command line, the relevant
+# environment, timings, throughputs and host information. doit.py fills it while running;
+# logs of older campaigns can be imported with "results.py import-logs".
+#
+# Usage:
+#   python3 results.py query [--campaign C] [--label PATTERN] [--group-by label,ts,mpi_impl] [--metric M]
+#                            (--group-by label,ts,input_state: cold-start and warm-cache runs apart)
+#   python3 results.py import-logs [LOG_DIR]
+#   python3 results.py campaigns
+#   python3 results.py phases [--campaign C] [--label PATTERN]    startup and event loop time per rank
+#   python3 results.py export OUTPUT.parquet     (needs pandas and pyarrow)
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "results.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    campaign TEXT NOT NULL,
+    key TEXT NOT NULL,
+    mpi_impl TEXT,
+    label TEXT,
+    threads INTEGER,
+    streams INTEGER,
+    run_id INTEGER,
+    environment TEXT,
+    host_local TEXT,
+    host_remote TEXT,
+    config TEXT,
+    command TEXT,
+    env TEXT,
+    host_info TEXT,
+    start_time REAL,
+    duration REAL,
+    throughput REAL,
+    steady_state REAL,
+    steady_state_ci_low REAL,
+    steady_state_ci_high REAL,
+    output TEXT,
+    log_file TEXT,
+    UNIQUE (campaign, key)
+);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (label, threads, streams, mpi_impl);
+CREATE INDEX IF NOT EXISTS runs_campaign ON runs (campaign);
+CREATE INDEX IF NOT EXISTS runs_log_file ON runs (log_file);
+CREATE TABLE IF NOT EXISTS modules (
+    campaign TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rank TEXT NOT NULL,
+    type TEXT,
+    label TEXT,
+    events REAL,
+    time_real REAL,
+    time_thread REAL,
+    mem_alloc REAL,
+    mem_free REAL
+);
+CREATE INDEX IF NOT EXISTS modules_run ON modules (campaign, key, rank);
+CREATE INDEX IF NOT EXISTS modules_label ON modules (label);
+CREATE TABLE IF NOT EXISTS phases (
+    campaign TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rank TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS phases_run ON phases (campaign, key);
+"""
+
+# environment variables worth keeping with every run
+ENV_PATTERN = re.compile(r"^(CMSSW_|SCRAM_|UCX_|OMPI_|PRTE_|PMIX_|MPICH_|HYDRA_|CUDA_|EXPERIMENT_)")
+
+# {mpi_impl}_{label}_t{t}_s{s}_r{run}.log, see journal.run_key
+LOG_NAME_RE = re.compile(r"^(?P<mpi_impl>[^_]+)_(?P<label>.+)_t(?P<t>\d+)_s(?P<s>\d+)_r(?P<run>\d+)\.log$")
+
+GROUP_COLUMNS = {"label": "label", "ts": "threads, streams", "mpi_impl": "mpi_impl", "campaign": "campaign",
+                 "host_local": "host_local", "host_remote": "host_remote",
+                 # page cache state of the input before the run, see pagecache.py
+                 "input_cache": "json_extract(output, '$.input_cache.policy')",
+                 "input_state": "CASE WHEN json_extract(output, '$.input_cache.resident') IS NULL THEN NULL "
+                                "WHEN json_extract(output, '$.input_cache.resident') < 0.5 THEN 'cold' ELSE 'warm' END"}
+
+# two-sided 95% Student t quantiles for 1..30 degrees of freedom
+T_95 = np.array([np.nan, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042])
+
+
+def get_host_info():
+    info = {"node": platform.node(), "kernel": platform.release(), "python": platform.python_version()}
+    try:
+        with open("/proc/cpuinfo") as f:
+            info["cpu_model"] = next((l.split(":", 1)[1].strip() for l in f if l.startswith("model name")), "")
+    except OSError:
+        pass
+    info["cpu_count"] = os.cpu_count()
+    return info
+
+
+def config_to_dict(config):
+    fields = {}
+    for name in dir(config):
+        value = getattr(config, name)
+        if name.startswith("_") or callable(value):
+            continue
+        if isinstance(value, range):
+            value = list(value)
+        try:
+            json.dumps(value)
+        except TypeError:
+            value = str(value)
+        fields[name] = value
+    return fields
+
+
+class ResultsStore:
+
+    def __init__(self, path=DEFAULT_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    # connection committed (or rolled back) and closed at the end of the with block
+    @contextlib.contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def add_run(self, campaign: str, key: str, config, command: str, start_time: float, duration: float,
+                output: dict, log_file: str):
+        ci = output.get("steady_state_ci") or [None, None]
+        env = {k: v for k, v in os.environ.items() if ENV_PATTERN.match(k)}
+        row = (campaign, key, config.mpi_impl, config.label, config.ts[0], config.ts[1], config.runID,
+               config.environment, config.host_local, config.host_remote,
+               json.dumps(config_to_dict(config)), command, json.dumps(env), json.dumps(get_host_info()),
+               start_time, duration, output.get("throughput"), output.get("steady_state"), ci[0], ci[1],
+               json.dumps(output), log_file)
+        with self.lock, self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO runs (campaign, key, mpi_impl, label, threads, streams, run_id, "
+                       "environment, host_local, host_remote, config, command, env, host_info, start_time, "
+                       "duration, throughput, steady_state, steady_state_ci_low, steady_state_ci_high, output, "
+                       "log_file) VALUES (%s)" % ",".join("?" * len(row)), row)
+
+    # table: columnar module timing of one rank of a run, see timing.load_fast_timer_json
+    def add_modules(self, campaign: str, key: str, rank: str, table: dict):
+        rows = zip(table["type"], table["label"], *(table[c].tolist() for c in
+                                                    ["events", "time_real", "time_thread", "mem_alloc", "mem_free"]))
+        with self.lock, self.connect() as db:
+            db.execute("DELETE FROM modules WHERE campaign = ? AND key = ? AND rank = ?", (campaign, key, rank))
+            db.executemany("INSERT INTO modules VALUES (?,?,?,?,?,?,?,?,?,?)",
+                           [(campaign, key, rank, *row) for row in rows])
+
+    # phases: rank -> phase -> seconds, see logtail.LogTailer.get_phases
+    def add_phases(self, campaign: str, key: str, phases: dict):
+        with self.lock, self.connect() as db:
+            db.execute("DELETE FROM phases WHERE campaign = ? AND key = ?", (campaign, key))
+            db.executemany("INSERT INTO phases VALUES (?,?,?,?,?)",
+                           [(campaign, key, rank, phase, duration) for rank, rank_phases in phases.items()
+                            for phase, duration in rank_phases.items()])
+
+    def import_logs(self, log_dir: str, campaign="imported"):
+        n_imported = 0
+        with self.connect() as db:
+            for name in sorted(os.listdir(log_dir)):
+                match = LOG_NAME_RE.match(name)
+                if match is None:
+                    continue
+                path = os.path.abspath(os.path.join(log_dir, name))
+                # runs stored while running are not imported again
+                if db.execute("SELECT 1 FROM runs WHERE log_file = ?", (path,)).fetchone() is not None:
+                    continue
+                try:
+                    throughput = get_throughput_from_log(path)
+                except ValueError:
+                    continue
+                with open(path) as f:
+                    f.readline()
+                    command = f.readline().strip()
+                db.execute("INSERT OR IGNORE INTO runs (campaign, key, mpi_impl, label, threads, streams, run_id, "
+                           "command, start_time, throughput, log_file) VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                           (campaign, name[:-len(".log")], match["mpi_impl"], match["label"], int(match["t"]),
+                            int(match["s"]), int(match["run"]), command, os.path.getmtime(path), throughput, path))
+                n_imported += 1
+        return n_imported
+
+    def select(self, columns: str, campaign=None, label=None, metric="throughput"):
+        query = "SELECT %s, %s FROM runs WHERE %s IS NOT NULL" % (columns, metric, metric)
+        params = []
+        if campaign is not None:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        if label is not None:
+            query += " AND label LIKE ?"
+            params.append(label)
+        with self.connect() as db:
+            return db.execute(query, params).fetchall()
+
+
+# Groups the rows (group columns..., value) and returns the groups with n, mean, std and
+# the 95% CI half-width of the mean, all computed at once with bincount
+def summarize(rows):
+    if len(rows) == 0:
+        return []
+    keys = [tuple(row[:-1]) for row in rows]
+    values = np.array([row[-1] for row in rows], dtype=float)
+
+    unique_keys = sorted(set(keys), key=lambda k: tuple((x is None, x) for x in k))
+    index = {k: i for i, k in enumerate(unique_keys)}
+    group = np.array([index[k] for k in keys])
+
+    n = np.bincount(group)
+    mean = np.bincount(group, weights=values) / n
+    sq = np.bincount(group, weights=(values - mean[group]) ** 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt(sq / (n - 1))
+        t = np.where(n - 1 < len(T_95), T_95[np.minimum(n - 1, len(T_95) - 1)], 1.96)
+        half_width = t * std / np.sqrt(n)
+    return [(k, int(n[i]), mean[i], std[i], half_width[i]) for i, k in enumerate(unique_keys)]
+
+
+def export_parquet(store: ResultsStore, output: str):
+    try:
+        import pandas as pd
+    except ImportError:
+        print("Exporting to parquet needs pandas (and pyarrow)")
+        sys.exit(1)
+    with store.connect() as db:
+        df = pd.read_sql_query("SELECT * FROM runs", db)
+    df.to_parquet(output, index=False)
+    print("Exported %d runs to %s" % (len(df), output))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the benchmark results database")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query = subparsers.add_parser("query", help="mean/std/CI of the runs, grouped")
+    query.add_argument("--campaign")
+    query.add_argument("--label", help="SQL LIKE pattern, e.g. milan_genoa%%")
+    query.add_argument("--group-by", default="mpi_impl,label,ts",
+                       help="comma-separated, among %s" % ", ".join(GROUP_COLUMNS))
+    query.add_argument("--metric", default="throughput", choices=["throughput", "steady_state", "duration"])
+    query.add_argument("--csv", action="store_true")
+
+    import_logs = subparsers.add_parser("import-logs", help="import the logs of campaigns run before the database")
+    import_logs.add_argument("log_dir", nargs="?", default=os.path.dirname(DEFAULT_DB))
+    import_logs.add_argument("--campaign", default="imported")
+
+    subparsers.add_parser("campaigns", help="list the campaigns in the database")
+
+    phases = subparsers.add_parser("phases", help="mean time of the phases of every rank (startup, event loop, ...)")
+    phases.add_argument("--campaign")
+    phases.add_argument("--label", help="SQL LIKE pattern, e.g. milan_genoa%%")
+
+    export = subparsers.add_parser("export", help="export all the runs to parquet")
+    export.add_argument("output")
+
+    args = parser.parse_args()
+    store = ResultsStore(args.db)
+
+    if args.command == "import-logs":
+        print("Imported %d logs" % store.import_logs(args.log_dir, args.campaign))
+    elif args.command == "campaigns":
+        with store.connect() as db:
+            rows = db.execute("SELECT campaign, COUNT(*), MIN(start_time), MAX(start_time) FROM runs "
+                              "GROUP BY campaign ORDER BY MIN(start_time)").fetchall()
+        for campaign, n, first, last in rows:
+            print("%-30s %5d runs  %s - %s" % (campaign, n, time.strftime("%Y-%m-%d %H:%M", time.localtime(first or 0)),
+                                                time.strftime("%Y-%m-%d %H:%M", time.localtime(last or 0))))
+    elif args.command == "phases":
+        query = ("SELECT runs.mpi_impl, runs.label, runs.threads, runs.streams, phases.rank, phases.phase, "
+                 "phases.duration FROM phases JOIN runs ON runs.campaign = phases.campaign AND runs.key = phases.key "
+                 "WHERE 1")
+        params = []
+        if args.campaign is not None:
+            query += " AND runs.campaign = ?"
+            params.append(args.campaign)
+        if args.label is not None:
+            query += " AND runs.label LIKE ?"
+            params.append(args.label)
+        with store.connect() as db:
+            summary = summarize(db.execute(query, params).fetchall())
+        order = ["startup", "configuration", "construction", "initialization", "event_loop", "end_job", "teardown"]
+        summary.sort(key=lambda s: (s[0][:5], order.index(s[0][5]) if s[0][5] in order else len(order)))
+        for key, n, mean, std, half_width in summary:
+            print("%-60s %-6s %-15s %4d runs  %8.1f +- %6.1f s" % (" ".join(map(str, key[:4])), key[4], key[5], n,
+                                                                    mean, half_width))
+    elif args.command == "export":
+        export_parquet(store, args.output)
+    elif args.command == "query":
+        group_by = args.group_by.split(",")
+        if any(g not in GROUP_COLUMNS for g in group_by):
+            print("Unknown --group-by column. Supported are:", ", ".join(GROUP_COLUMNS))
+            sys.exit(1)
+        columns = ", ".join(GROUP_COLUMNS[g] for g in group_by)
+        summary = summarize(store.select(columns, args.campaign, args.label, args.metric))
+        if args.csv:
+            header = [name for g in group_by for name in (["threads", "streams"] if g == "ts" else [g])]
+            print(",".join(header + ["n", "mean", "std", "ci95"]))
+            for key, n, mean, std, half_width in summary:
+                print(",".join(map(str, key)) + ",%d,%.3f,%.3f,%.3f" % (n, mean, std, half_width))
+        else:
+            for key, n, mean, std, half_width in summary:
+                print("%-60s %4d runs  %10.2f +- %8.2f  (std %.2f)" % (" ".join(map(str, key)), n, mean, half_width, std))
+
+
+if __name__ == "__main__":
+    main()
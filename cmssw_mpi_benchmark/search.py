@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# Search of the best [threads, streams] pair of a setup, instead of a fixed ts grid.
+#
+# The candidates are all the pairs with threads in [min_threads, max_threads] (in steps of
+# thread_step) and streams equal to threads * ratio for each ratio in stream_ratios, except
+# those whose threads do not fit on the CPUs of the hosts of the setup (cpus, cpu_offset or
+# placement, see campaign.get_fit_error). They are compared with successive
+# halving: every candidate is run once, the best 1/eta of them are kept and run eta times
+# as much, and so on until one is left. Noisy candidates thus get more repetitions only
+# if they are worth it.
+#
+# The search is configured by a "search" table in [defaults] or in a [[setup]], e.g.
+#   search = { max_threads = 32, thread_step = 4, stream_ratios = [0.5, 0.75, 1.0] }
+
+SEARCH_DEFAULTS = {
+    "min_threads": 4,
+    "max_threads": 32,
+    "thread_step": 4,
+    "stream_ratios": [0.5, 0.75, 1.0],
+    "eta": 2,
+    # "per_core": events/s per thread (= pinned core), "total": events/s
+    "objective": "per_core",
+}
+
+
+def get_search_options(defaults: dict, setup: dict):
+    options = dict(SEARCH_DEFAULTS)
+    options.update(defaults.get("search", {}))
+    options.update(setup.get("search", {}))
+    return options
+
+
+def get_candidates(options: dict):
+    candidates = []
+    for threads in range(options["min_threads"], options["max_threads"] + 1, options["thread_step"]):
+        for ratio in options["stream_ratios"]:
+            ts = [threads, max(1, round(threads * ratio))]
+            if ts not in candidates:
+                candidates.append(ts)
+    return candidates
+
+
+def get_score(ts, throughputs: list, objective: str):
+    if len(throughputs) == 0:
+        # all the runs of this candidate failed
+        return -np.inf
+    mean = np.mean(throughputs)
+    return mean / ts[0] if objective == "per_core" else mean
+
+
+# evaluate(candidates, runs) must return, for each candidate ts as a tuple, the list of
+# the throughputs measured so far, with (at least) `runs` entries unless runs failed.
+# Returns the best ts and the history of the rounds.
+def successive_halving(candidates: list, evaluate, eta=2, objective="per_core"):
+    survivors = [tuple(ts) for ts in candidates]
+    runs = 1
+    history = []
+    while True:
+        throughputs = evaluate(survivors, runs)
+        scores = {ts: get_score(ts, throughputs[ts], objective) for ts in survivors}
+        ranked = sorted(survivors, key=lambda ts: scores[ts], reverse=True)
+        history.append({"runs": runs,
+                        "candidates": [{"ts": list(ts), "score": float(scores[ts]),
+                                        "throughputs": throughputs[ts]} for ts in ranked]})
+
+        print("Search round with %d runs per candidate:" % runs)
+        for ts in ranked:
+            print("  [t,s] = [%d,%d]  %8.2f (%d runs)" % (ts[0], ts[1], scores[ts], len(throughputs[ts])))
+
+        if len(ranked) // eta <= 1:
+            return list(ranked[0]), history
+        survivors = ranked[:len(ranked) // eta]
+        runs *= eta
@@ -0,0 +1,238 @@
+import argparse
+import fcntl
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import zlib
+
+
+# Local staging of the FED raw input files.
+#
+# run396102_cff.py (or run396102_cff_ngt.py, see hlt.py) reads its .raw files from NFS, so
+# the latency and the load of the filer end up in the throughput. With stage_dir set in the
+# campaign, the files the runs need are copied before the campaign to a local disk (NVMe,
+# tmpfs), under the same paths relative to buBaseDir, and every run gets
+# EXPERIMENT_INPUT_DIR = stage_dir: configs/experiment_input.py then points fileNames and
+# EvFDaqDirector.buBaseDir to it.
+#
+# stage_dir is a size-bounded cache (stage_max_gb, 0 = unbounded) shared by the campaigns:
+# index.json lists the staged files with the size and mtime of their source, the CRC32 of
+# their content and when they were last used. A file is copied again if its source changed,
+# and the least recently used files not needed by the campaign are evicted to make room.
+# Files are cloned (reflink) when the filesystem allows it, otherwise copied while computing
+# their checksum; "staging.py verify" checks the checksums of all the staged files.
+#
+# Only the local rank reads the input, so the local rank must run on the machine where the
+# harness runs (runs on other hosts, or on the hosts of the MPI hostfile, keep reading from NFS).
+#
+# Usage:
+#   python3 staging.py stage STAGE_DIR [--max-gb N]    stages the input of the configs
+#   python3 staging.py list STAGE_DIR
+#   python3 staging.py verify STAGE_DIR
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_DIR = os.path.join(HARNESS_DIR, "configs")
+INDEX_FILE = "index.json"
+CHUNK_SIZE = 16 * 1024 * 1024
+FICLONE = 0x40049409
+
+RAW_FILE_RE = re.compile(r"'([^']+\.raw)'")
+BU_BASE_DIR_RE = re.compile(r"buBaseDir\s*=\s*'([^']+)'")
+
+
+# the input cff hlt.py loads on this machine
+def get_input_cff():
+    if os.path.exists("/cmsnfsgpu_data/gpu_data/"):
+        return os.path.join(CONFIG_DIR, "run396102_cff.py")
+    return os.path.join(CONFIG_DIR, "run396102_cff_ngt.py")
+
+
+# (buBaseDir, fileNames) of an input cff, read without CMSSW
+def read_input_cff(path: str):
+    with open(path) as f:
+        text = f.read()
+    match = BU_BASE_DIR_RE.search(text)
+    if match is None:
+        raise ValueError("no buBaseDir in %s" % path)
+    return match.group(1), RAW_FILE_RE.findall(text)
+
+
+# (buBaseDir, files) read by the runs: the input cff, or the list of the files they need
+# (see manifest.py)
+def get_run_input(input_list=""):
+    bu_base_dir, files = read_input_cff(get_input_cff())
+    if input_list != "":
+        with open(input_list) as f:
+            files = [line.strip() for line in f if line.strip() != ""]
+    return bu_base_dir, files
+
+
+def checksum_file(path: str):
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+# Clones or copies source to destination, returns the CRC32 of the content
+def copy_file(source: str, destination: str):
+    tmp = destination + ".tmp"
+    with open(source, "rb") as src, open(tmp, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            cloned = True
+        except OSError:
+            cloned = False
+        crc = 0
+        if not cloned:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                dst.write(chunk)
+    if cloned:
+        crc = checksum_file(tmp)
+    os.rename(tmp, destination)
+    return crc
+
+
+class StagingCache:
+
+    def __init__(self, stage_dir: str, max_size=0):
+        self.stage_dir = os.path.abspath(stage_dir)
+        self.max_size = max_size
+        os.makedirs(self.stage_dir, exist_ok=True)
+
+    def lock(self):
+        # several campaigns can share the cache
+        f = open(os.path.join(self.stage_dir, ".lock"), "w")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def read_index(self):
+        path = os.path.join(self.stage_dir, INDEX_FILE)
+        if not os.path.isfile(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def write_index(self, index: dict):
+        path = os.path.join(self.stage_dir, INDEX_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f, indent=1)
+        os.rename(path + ".tmp", path)
+
+    def is_fresh(self, entry: dict, source: str):
+        # the staged copy is still there and its source did not change
+        staged = os.path.join(self.stage_dir, entry["path"])
+        if not os.path.isfile(staged) or os.path.getsize(staged) != entry["size"]:
+            return False
+        stat = os.stat(source)
+        return stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]
+
+    # makes room for needed more bytes, keeping the files in keep
+    def evict(self, index: dict, needed: int, keep: set):
+        used = sum(entry["size"] for entry in index.values())
+        total = needed + sum(index[path]["size"] for path in keep)
+        if self.max_size > 0 and total > self.max_size:
+            raise ValueError("the input needs %.1f GB, more than the staging cache size of %.1f GB" %
+                             (total / 1e9, self.max_size / 1e9))
+        for path, entry in sorted(index.items(), key=lambda kv: kv[1]["last_used"]):
+            over_size = self.max_size > 0 and used + needed > self.max_size
+            if not over_size or path in keep:
+                continue
+            print("Evicting %s from the staging cache" % path)
+            try:
+                os.remove(os.path.join(self.stage_dir, path))
+            except FileNotFoundError:
+                pass
+            used -= entry["size"]
+            del index[path]
+
+    # Stages the files (relative to bu_base_dir) and returns the staging directory, which
+    # replaces bu_base_dir for the runs
+    def stage(self, bu_base_dir: str, files: list):
+        with self.lock():
+            index = self.read_index()
+            relative = [os.path.relpath(f, bu_base_dir) for f in files]
+            missing = [(f, r) for f, r in zip(files, relative) if r not in index or not self.is_fresh(index[r], f)]
+            missing_size = sum(os.path.getsize(f) for f, _ in missing)
+            self.evict(index, missing_size, set(relative) - {r for _, r in missing})
+            free = shutil.disk_usage(self.stage_dir).free
+            if missing_size > free:
+                raise ValueError("the input needs %.1f GB in %s, only %.1f GB are free" %
+                                 (missing_size / 1e9, self.stage_dir, free / 1e9))
+
+            print("Staging %d of %d input files (%.1f GB) to %s" %
+                  (len(missing), len(files), missing_size / 1e9, self.stage_dir))
+            start = time.time()
+            for source, path in missing:
+                destination = os.path.join(self.stage_dir, path)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                crc = copy_file(source, destination)
+                stat = os.stat(source)
+                index[path] = {"path": path, "source": source, "size": stat.st_size, "mtime": stat.st_mtime,
+                               "crc32": crc, "last_used": time.time()}
+                # saved as it goes, so that an interrupted staging is not started over
+                self.write_index(index)
+            if missing:
+                print("Staged in %.0f s (%.0f MB/s)" % (time.time() - start, missing_size / 1e6 / max(time.time() - start, 1e-9)))
+
+            now = time.time()
+            for path in relative:
+                index[path]["last_used"] = now
+            self.write_index(index)
+        return self.stage_dir
+
+    def verify(self):
+        index = self.read_index()
+        bad = []
+        for path, entry in sorted(index.items()):
+            staged = os.path.join(self.stage_dir, path)
+            if not os.path.isfile(staged) or checksum_file(staged) != entry["crc32"]:
+                bad.append(path)
+        return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage the FED raw input files to a local disk")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stage = subparsers.add_parser("stage", help="stage the input of the configs on this machine")
+    stage.add_argument("stage_dir")
+    stage.add_argument("--max-gb", type=float, default=0, help="size of the cache (0 = unbounded)")
+    stage.add_argument("--cff", help="input cff (default: the one hlt.py loads on this machine)")
+    subparsers.add_parser("list", help="list the staged files").add_argument("stage_dir")
+    subparsers.add_parser("verify", help="check the checksums of the staged files").add_argument("stage_dir")
+    args = parser.parse_args()
+
+    if args.command == "stage":
+        bu_base_dir, files = read_input_cff(args.cff or get_input_cff())
+        try:
+            StagingCache(args.stage_dir, args.max_gb * 1e9).stage(bu_base_dir, files)
+        except (OSError, ValueError) as e:
+            print("Staging failed:", e)
+            sys.exit(1)
+    elif args.command == "list":
+        index = StagingCache(args.stage_dir).read_index()
+        for path, entry in sorted(index.items(), key=lambda kv: kv[1]["last_used"]):
+            print("%-70s %8.1f MB  last used %s" % (path, entry["size"] / 1e6,
+                                                   time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"]))))
+        print("%d files, %.1f GB" % (len(index), sum(e["size"] for e in index.values()) / 1e9))
+    elif args.command == "verify":
+        bad = StagingCache(args.stage_dir).verify()
+        for path in bad:
+            print("Checksum mismatch or missing file:", path)
+        if bad:
+            sys.exit(1)
+        print("All staged files are valid")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+
+
+# Statistics on the throughputs of repeated runs of the same configuration
+
+
+def bootstrap_ci(values, confidence=0.95, n_resamples=2000, seed=0):
+    # percentile bootstrap CI of the mean, returns (mean, low, high)
+    values = np.asarray(values, dtype=float)
+    mean = values.mean()
+    if len(values) < 2:
+        return mean, np.nan, np.nan
+    rng = np.random.default_rng(seed)
+    resampled = rng.choice(values, size=(n_resamples, len(values)), replace=True).mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(resampled, [alpha, 1 - alpha])
+    return mean, low, high
+
+
+# Stops repeating a configuration once the CI half-width of its mean throughput is
+# below rel_half_width * mean, and always runs it between min_runs and max_runs times
+class StoppingRule:
+
+    def __init__(self, min_runs=3, max_runs=10, rel_half_width=0.02, confidence=0.95):
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.rel_half_width = rel_half_width
+        self.confidence = confidence
+
+    def is_converged(self, throughputs: list):
+        if len(throughputs) >= self.max_runs:
+            return True
+        if len(throughputs) < self.min_runs:
+            return False
+        mean, low, high = bootstrap_ci(throughputs, self.confidence)
+        return (high - low) / 2 <= self.rel_half_width * mean
+
+
+# Comparison of the throughputs of two sets of runs (baseline x, current y), see regression.py
+
+
+def rank_data(values):
+    # ranks starting at 1, ties get their average rank
+    values = np.asarray(values, dtype=float)
+    order = np.argsort(values, kind="mergesort")
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(1, len(values) + 1)
+    unique, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    sums = np.bincount(inverse, weights=ranks)
+    return (sums / counts)[inverse], counts
+
+
+def mann_whitney_u(x, y, exact_max_size=20):
+    # two-sided Mann-Whitney U test, returns (U of y, p-value). Exact distribution of U
+    # for small samples without ties, normal approximation with tie correction otherwise
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n1, n2 = len(x), len(y)
+    ranks, tie_counts = rank_data(np.concatenate([x, y]))
+    u = ranks[n1:].sum() - n2 * (n2 + 1) / 2
+    mean = n1 * n2 / 2
+
+    if n1 + n2 <= exact_max_size and np.all(tie_counts == 1):
+        # number of ways of reaching every U with i values of x and j values of y
+        counts = np.zeros((n1 + 1, n2 + 1, n1 * n2 + 1))
+        counts[:, 0, 0] = 1
+        counts[0, :, 0] = 1
+        for i in range(1, n1 + 1):
+            for j in range(1, n2 + 1):
+                # the largest value is from y (adds i to U) or from x
+                counts[i, j, i:] += counts[i, j - 1, :n1 * n2 + 1 - i]
+                counts[i, j] += counts[i - 1, j]
+        distribution = counts[n1, n2] / counts[n1, n2].sum()
+        tail = min(u, n1 * n2 - u)
+        p = 2 * distribution[:int(np.floor(tail)) + 1].sum()
+        return u, min(1.0, p)
+
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - (tie_counts ** 3 - tie_counts).sum() / (n * (n - 1)))
+    if variance <= 0:
+        return u, 1.0
+    z = (abs(u - mean) - 0.5) / np.sqrt(variance)
+    return u, min(1.0, math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def cliffs_delta(x, y):
+    # P(y > x) - P(y < x), in [-1, 1]
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    return float(np.sign(y[:, None] - x[None, :]).mean())
+
+
+def bootstrap_relative_difference_ci(x, y, confidence=0.95, n_resamples=2000, seed=0):
+    # mean(y) / mean(x) - 1, with a percentile bootstrap CI resampling both sets
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    difference = y.mean() / x.mean() - 1
+    if len(x) < 2 or len(y) < 2:
+        return difference, np.nan, np.nan
+    rng = np.random.default_rng(seed)
+    x_means = rng.choice(x, size=(n_resamples, len(x)), replace=True).mean(axis=1)
+    y_means = rng.choice(y, size=(n_resamples, len(y)), replace=True).mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(y_means / x_means - 1, [alpha, 1 - alpha])
+    return difference, low, high
+
+
+def min_mann_whitney_p_value(n1: int, n2: int, exact_max_size=20):
+    # smallest two-sided p-value mann_whitney_u can return for samples of n1 and n2 values
+    # (complete separation, no ties)
+    if n1 + n2 <= exact_max_size:
+        return min(1.0, 2 / math.comb(n1 + n2, n1))
+    z = (n1 * n2 / 2 - 0.5) / math.sqrt(n1 * n2 * (n1 + n2 + 1) / 12)
+    return min(1.0, math.erfc(z / math.sqrt(2)))
+
+
+def holm_correction(p_values):
+    # Holm-Bonferroni adjusted p-values
+    p_values = np.asarray(p_values, dtype=float)
+    m = len(p_values)
+    order = np.argsort(p_values)
+    adjusted = np.empty(m)
+    adjusted[order] = np.minimum(1, np.maximum.accumulate(p_values[order] * (m - np.arange(m))))
+    return adjusted
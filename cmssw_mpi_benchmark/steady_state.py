@@ -0,0 +1,129 @@
+import numpy as np
+
+from stats import bootstrap_ci
+
+
+# Steady-state throughput of a run, from the time series of processed events written
+# by logtail.py.
+#
+# The series is resampled into windows of equal duration, giving one rate (events/s) per
+# window. The rates are modelled as three constant segments: warm-up (streams filling),
+# plateau and drain (end of maxEvents); the change points are those minimising the sum of
+# squared errors, plus a BIC-like penalty for every non-empty warm-up / drain segment, so
+# that runs without ramp-up keep all their windows. All the (warm-up end, drain start)
+# pairs are evaluated at once from cumulative sums.
+#
+# The steady-state throughput is events / time over the plateau. Its CI is a bootstrap of
+# the mean of n_batches batch rates, which are much less correlated than single windows.
+
+MIN_WINDOW = 0.25  # seconds, the time resolution of the log tailer
+
+
+def window_rates(times, events, n_windows=50):
+    times = np.asarray(times, dtype=float)
+    events = np.asarray(events, dtype=float)
+    window = max(MIN_WINDOW, (times[-1] - times[0]) / n_windows)
+    edges = np.arange(times[0], times[-1] + window / 2, window)
+    cumulative = np.interp(edges, times, events)
+    return edges, np.diff(cumulative) / window
+
+
+def segment_sse(s1, s2, start, end):
+    # sum of squared errors of rates[start:end] around their mean, from cumulative sums
+    n = end - start
+    total = s1[end] - s1[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sse = (s2[end] - s2[start]) - np.where(n > 0, total * total / np.maximum(n, 1), 0)
+    return sse
+
+
+def find_plateau(rates, min_fraction=0.3):
+    rates = np.asarray(rates, dtype=float)
+    n = len(rates)
+    s1 = np.concatenate([[0], np.cumsum(rates)])
+    s2 = np.concatenate([[0], np.cumsum(rates * rates)])
+
+    a, b = np.meshgrid(np.arange(n + 1), np.arange(n + 1), indexing="ij")
+    valid = (b - a) >= max(2, int(np.ceil(min_fraction * n)))
+    cost = segment_sse(s1, s2, 0, a) + segment_sse(s1, s2, a, b) + segment_sse(s1, s2, b, n)
+
+    # noise variance from the differences of consecutive windows (robust to the steps)
+    sigma = 1.4826 * np.median(np.abs(np.diff(rates) - np.median(np.diff(rates)))) / np.sqrt(2)
+    penalty = 3 * max(sigma * sigma, 1e-12) * np.log(n)
+    cost = cost + penalty * ((a > 0).astype(float) + (b < n).astype(float))
+
+    cost = np.where(valid, cost, np.inf)
+    best = np.unravel_index(np.argmin(cost), cost.shape)
+    return int(best[0]), int(best[1])
+
+
+def estimate_steady_state(times, events, confidence=0.95, n_batches=10, min_windows=10):
+    if len(times) < 2 or times[-1] <= times[0]:
+        return None
+    edges, rates = window_rates(times, events)
+    if len(rates) < min_windows:
+        return None
+
+    start, end = find_plateau(rates)
+    plateau = rates[start:end]
+    n_batches = min(n_batches, len(plateau))
+    batches = [batch.mean() for batch in np.array_split(plateau, n_batches)]
+    _, low, high = bootstrap_ci(batches, confidence)
+
+    cumulative = np.interp(edges, times, events)
+    throughput = (cumulative[end] - cumulative[start]) / (edges[end] - edges[start])
+    return {
+        "throughput": float(throughput),
+        "ci": [float(low), float(high)],
+        "start": float(edges[start] - times[0]),
+        "end": float(edges[end] - times[0]),
+        "warmup_windows": start,
+        "drain_windows": len(rates) - end,
+    }
+
+
+# Multiple measurements from a single long run: the plateau is split into contiguous
+# samples of equal duration, each giving one throughput. The samples are only treated as
+# independent if they are long compared to the integrated autocorrelation time of the
+# window rates: at most len(plateau) / (min_decorrelation * tau) samples are made.
+
+
+def autocorrelation(x):
+    x = np.asarray(x, dtype=float) - np.mean(x)
+    n = len(x)
+    spectrum = np.fft.rfft(x, 2 * n)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    return acf / acf[0] if acf[0] > 0 else np.zeros(n)
+
+
+def integrated_autocorrelation_time(x):
+    # in units of windows, summing the autocorrelation up to its first non-positive value
+    rho = autocorrelation(x)[1:]
+    non_positive = np.flatnonzero(rho <= 0)
+    cut = non_positive[0] if len(non_positive) > 0 else len(rho)
+    return 1 + 2 * rho[:cut].sum()
+
+
+def split_into_samples(times, events, n_samples, n_windows=200, min_decorrelation=2.0):
+    if len(times) < 2 or times[-1] <= times[0]:
+        return None
+    edges, rates = window_rates(times, events, n_windows)
+    start, end = find_plateau(rates)
+    plateau = rates[start:end]
+    if len(plateau) < 4:
+        return None
+
+    tau = integrated_autocorrelation_time(plateau)
+    n_samples = min(n_samples, int(len(plateau) // (min_decorrelation * tau)))
+    if n_samples < 2:
+        return None
+
+    samples = np.array([chunk.mean() for chunk in np.array_split(plateau, n_samples)])
+    window = edges[1] - edges[0]
+    return {
+        "samples": samples.tolist(),
+        "autocorrelation_time": float(tau * window),
+        "sample_duration": float(len(plateau) * window / n_samples),
+        # should be close to 0 for independent samples
+        "samples_lag1": float(autocorrelation(samples)[1]) if n_samples > 2 else None,
+    }
@@ -0,0 +1,273 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+
+# System telemetry of a running benchmark, sampled from /proc by a background thread.
+#
+# Every interval seconds the sampler reads
+#   /proc/stat             jiffies of each pinned CPU (user, nice, system, idle, iowait, irq,
+#                          softirq, steal), and the context switches of the machine
+#   /proc/softirqs         softirqs of each pinned CPU (NET_RX, NET_TX, TIMER, ...)
+#   /proc/<pid>/stat       user and system time, faults and threads of every cmsRun rank
+#   /proc/<pid>/task/*/status  voluntary and non-voluntary context switches of the rank,
+#                          summed over its threads (/proc/<pid>/status only has the main
+#                          thread); VmRSS from /proc/<pid>/status
+# The ranks are the cmsRun processes of the session of the launched command whose command
+# line has their config, so only the ranks running on this machine are seen.
+#
+# Samples go to preallocated numpy ring buffers (the last max_samples are kept), while the
+# summaries are computed from the first and last samples, so they cover the whole run. The
+# sampler measures its own CPU time (sampler_cpu_fraction): at the default 1 s interval it
+# is about 0.1% of a core.
+
+SOFTIRQS_SHOWN = ["NET_RX", "NET_TX", "TIMER", "SCHED", "RCU"]
+CPU_FIELDS = ["user", "nice", "system", "idle", "iowait", "irq", "softirq", "steal"]
+RANK_FIELDS = ["utime", "stime", "minflt", "majflt", "threads", "voluntary_ctxt", "nonvoluntary_ctxt", "rss_kb"]
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class RingBuffer:
+
+    def __init__(self, capacity: int, shape: tuple, dtype=np.int64):
+        self.data = np.zeros((capacity,) + shape, dtype=dtype)
+        self.count = 0
+
+    def append(self, value):
+        self.data[self.count % len(self.data)] = value
+        self.count += 1
+
+    def values(self):
+        # in chronological order
+        if self.count <= len(self.data):
+            return self.data[:self.count]
+        return np.roll(self.data, -(self.count % len(self.data)), axis=0)
+
+
+def read_proc_stat(cpus: list):
+    jiffies = np.zeros((len(cpus), len(CPU_FIELDS)), dtype=np.int64)
+    index = {"cpu%d" % cpu: i for i, cpu in enumerate(cpus)}
+    ctxt = 0
+    with open("/proc/stat") as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] in index:
+                jiffies[index[fields[0]]] = [int(x) for x in fields[1:1 + len(CPU_FIELDS)]]
+            elif fields[0] == "ctxt":
+                ctxt = int(fields[1])
+    return jiffies, ctxt
+
+
+def read_softirqs(cpus: list):
+    counts = np.zeros((len(cpus), len(SOFTIRQS_SHOWN)), dtype=np.int64)
+    with open("/proc/softirqs") as f:
+        header = f.readline().split()
+        # CPUs that are not online are left at 0
+        columns = [(i, header.index("CPU%d" % cpu)) for i, cpu in enumerate(cpus) if "CPU%d" % cpu in header]
+        for line in f:
+            fields = line.split()
+            name = fields[0].rstrip(":")
+            if name in SOFTIRQS_SHOWN:
+                for i, column in columns:
+                    counts[i, SOFTIRQS_SHOWN.index(name)] = int(fields[1 + column])
+    return counts
+
+
+def read_pid_stat(pid: int):
+    with open("/proc/%d/stat" % pid) as f:
+        # the command name may have spaces: the fields start after the last ")"
+        fields = f.read().rsplit(")", 1)[1].split()
+    # fields[0] is the state (field 3 of proc(5))
+    return {"session": int(fields[3]), "minflt": int(fields[7]), "majflt": int(fields[9]),
+            "utime": int(fields[11]), "stime": int(fields[12]), "threads": int(fields[17])}
+
+
+def read_status(path: str, keys: list):
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in keys:
+                values[key] = int(value.split()[0])
+    return values
+
+
+def read_rank(pid: int):
+    stat = read_pid_stat(pid)
+    rss = read_status("/proc/%d/status" % pid, ["VmRSS"]).get("VmRSS", 0)
+    voluntary = nonvoluntary = 0
+    for task in os.listdir("/proc/%d/task" % pid):
+        try:
+            switches = read_status("/proc/%d/task/%s/status" % (pid, task),
+                                   ["voluntary_ctxt_switches", "nonvoluntary_ctxt_switches"])
+        except OSError:
+            # thread ended in the meantime
+            continue
+        voluntary += switches.get("voluntary_ctxt_switches", 0)
+        nonvoluntary += switches.get("nonvoluntary_ctxt_switches", 0)
+    return [stat["utime"], stat["stime"], stat["minflt"], stat["majflt"], stat["threads"], voluntary, nonvoluntary, rss]
+
+
+# cmsRun processes of a session: pid -> command line
+def find_cmsrun_processes(session: int):
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/%s/comm" % entry) as f:
+                if f.read().strip() != "cmsRun":
+                    continue
+            if read_pid_stat(int(entry))["session"] != session:
+                continue
+            with open("/proc/%s/cmdline" % entry) as f:
+                processes[int(entry)] = f.read().replace("\0", " ")
+        except (OSError, IndexError, ValueError):
+            continue
+    return processes
+
+
+class TelemetrySampler:
+
+    # ranks: list of (name, config path, pinned CPUs) of the ranks running on this machine
+    def __init__(self, session: int, ranks: list, interval=1.0, max_samples=3600):
+        self.session = session
+        self.ranks = ranks
+        self.interval = interval
+        self.cpus = sorted({cpu for _, _, cpus in ranks for cpu in cpus})
+
+        self.pids = {}
+        self.times = RingBuffer(max_samples, (), dtype=float)
+        self.cpu_jiffies = RingBuffer(max_samples, (len(self.cpus), len(CPU_FIELDS)))
+        self.softirqs = RingBuffer(max_samples, (len(self.cpus), len(SOFTIRQS_SHOWN)))
+        self.ctxt = RingBuffer(max_samples, ())
+        self.rank_data = {name: RingBuffer(max_samples, (len(RANK_FIELDS),)) for name, _, _ in ranks}
+        # samples kept for the summaries, whatever the size of the buffers
+        self.first = None
+        self.last = None
+        self.rank_first = {}
+        self.rank_last = {}
+
+        self.start_time = time.time()
+        self.sampler_cpu_time = 0.0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def find_ranks(self):
+        for pid, cmdline in find_cmsrun_processes(self.session).items():
+            for name, config, _ in self.ranks:
+                if name not in self.pids and config in cmdline and pid not in self.pids.values():
+                    self.pids[name] = pid
+
+    def sample(self):
+        now = time.time() - self.start_time
+        if len(self.pids) < len(self.ranks):
+            self.find_ranks()
+        jiffies, ctxt = read_proc_stat(self.cpus)
+        softirqs = read_softirqs(self.cpus)
+        self.times.append(now)
+        self.cpu_jiffies.append(jiffies)
+        self.softirqs.append(softirqs)
+        self.ctxt.append(ctxt)
+        sample = (now, jiffies, softirqs, ctxt)
+        if self.first is None:
+            self.first = sample
+        self.last = sample
+
+        for name, pid in self.pids.items():
+            try:
+                values = read_rank(pid)
+            except (OSError, IndexError):
+                # the rank has ended
+                continue
+            self.rank_data[name].append(values)
+            self.rank_first.setdefault(name, (now, values))
+            self.rank_last[name] = (now, values)
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            start = time.thread_time()
+            try:
+                self.sample()
+            except OSError:
+                pass
+            self.sampler_cpu_time += time.thread_time() - start
+            self.stop_event.wait(self.interval)
+
+    def get_summary(self):
+        summary = {"interval": self.interval, "samples": self.times.count,
+                   "sampler_cpu_fraction": self.sampler_cpu_time / max(time.time() - self.start_time, 1e-9),
+                   "cores": {}, "ranks": {}}
+        if self.first is None or self.last is None or self.last[0] <= self.first[0]:
+            return summary
+        dt = self.last[0] - self.first[0]
+        summary["context_switches_per_s"] = (self.last[3] - self.first[3]) / dt
+
+        jiffies = (self.last[1] - self.first[1]).astype(float)
+        total = np.maximum(jiffies.sum(axis=1), 1)
+        idle = jiffies[:, CPU_FIELDS.index("idle")] + jiffies[:, CPU_FIELDS.index("iowait")]
+        softirqs = (self.last[2] - self.first[2]) / dt
+        for i, cpu in enumerate(self.cpus):
+            if jiffies[i].sum() == 0:
+                # not online
+                continue
+            core = {"busy": 1 - idle[i] / total[i]}
+            core.update({field: jiffies[i, j] / total[i] for j, field in enumerate(CPU_FIELDS) if field != "idle"})
+            core.update({name.lower() + "_per_s": softirqs[i, j] for j, name in enumerate(SOFTIRQS_SHOWN)})
+            summary["cores"][cpu] = core
+
+        for name, _, cpus in self.ranks:
+            if name not in self.rank_last or self.rank_last[name][0] <= self.rank_first[name][0]:
+                continue
+            (t0, first), (t1, last) = self.rank_first[name], self.rank_last[name]
+            delta = dict(zip(RANK_FIELDS, np.subtract(last, first)))
+            cores_used = (delta["utime"] + delta["stime"]) / CLOCK_TICKS / (t1 - t0)
+            rank_cores = [summary["cores"][cpu]["busy"] for cpu in cpus if cpu in summary["cores"]]
+            summary["ranks"][name] = {
+                "pid": self.pids[name],
+                "cores_used": cores_used,
+                "utilisation": cores_used / len(cpus),
+                "system_fraction": delta["stime"] / max(delta["utime"] + delta["stime"], 1),
+                "pinned_cores_busy": float(np.mean(rank_cores)) if rank_cores else None,
+                "voluntary_ctxt_per_s": delta["voluntary_ctxt"] / (t1 - t0),
+                "nonvoluntary_ctxt_per_s": delta["nonvoluntary_ctxt"] / (t1 - t0),
+                "major_faults_per_s": delta["majflt"] / (t1 - t0),
+                "threads": int(last[RANK_FIELDS.index("threads")]),
+                "max_rss_mb": float(self.rank_data[name].values()[:, RANK_FIELDS.index("rss_kb")].max()) / 1024,
+            }
+        return summary
+
+    def save(self, path: str):
+        np.savez_compressed(path, times=self.times.values(), cpus=np.array(self.cpus),
+                            cpu_fields=np.array(CPU_FIELDS), cpu_jiffies=self.cpu_jiffies.values(),
+                            softirq_names=np.array(SOFTIRQS_SHOWN), softirqs=self.softirqs.values(),
+                            ctxt=self.ctxt.values(), rank_fields=np.array(RANK_FIELDS),
+                            **{"rank_" + name: buffer.values() for name, buffer in self.rank_data.items()})
+
+
+def format_summary(summary: dict):
+    lines = []
+    for name, rank in summary["ranks"].items():
+        lines.append("%s rank: %.1f cores used (%.0f%% of its CPUs, %.0f%% system), pinned cores %.0f%% busy, "
+                     "%.0f voluntary / %.0f involuntary context switches/s, %.0f MB RSS" %
+                     (name, rank["cores_used"], 100 * rank["utilisation"], 100 * rank["system_fraction"],
+                      100 * (rank["pinned_cores_busy"] or 0), rank["voluntary_ctxt_per_s"],
+                      rank["nonvoluntary_ctxt_per_s"], rank["max_rss_mb"]))
+    if len(summary["cores"]) > 0:
+        busy = np.array([core["busy"] for core in summary["cores"].values()])
+        net_rx = sum(core["net_rx_per_s"] for core in summary["cores"].values())
+        softirq = np.array([core["softirq"] for core in summary["cores"].values()])
+        lines.append("pinned cores: %.0f%% busy on average (min %.0f%%), softirq %.1f%% (max %.1f%%), NET_RX %.0f/s" %
+                     (100 * busy.mean(), 100 * busy.min(), 100 * softirq.mean(), 100 * softirq.max(), net_rx))
+    lines.append("telemetry: %d samples, sampler used %.3f%% of a core" %
+                 (summary["samples"], 100 * summary["sampler_cpu_fraction"]))
+    return lines
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from results import DEFAULT_DB, ResultsStore
+
+
+# Per-module timing of the runs, from the FastTimerService JSON summaries.
+#
+# Every run gets EXPERIMENT_NAME = its run key and EXPERIMENT_OUTPUT_DIR = <log_dir>/timing
+# (see doit.build_command), so the configs write
+#   local_<run key>.json, remote_<run key>.json   (hlt_local.py, hlt_remote.py: MPI runs)
+#   whole_<run key>.json                          (hlt_test.py: standalone runs)
+# The remote rank writes on the remote host: its summary is only collected if log_dir is
+# on a shared filesystem.
+#
+# A summary has one entry per module, plus the "other", "eventsetup" and "idle" pseudo
+# modules, with the real and CPU time (ms) and the memory (kB) summed over all the events.
+# They are loaded as columnar tables (dict of numpy arrays, see as_dataframe for pandas)
+# and stored in the "modules" table of the results database.
+#
+# Usage:
+#   python3 timing.py [--label PATTERN] [--rank local] [--by label|type] [--top N] [--csv]
+# prints, for every setup, ts and rank, the modules (or module types) taking the most real
+# time per event, averaged over the runs.
+
+RANKS = ["local", "remote", "whole"]
+NUMERIC_COLUMNS = ["events", "time_real", "time_thread", "mem_alloc", "mem_free"]
+PSEUDO_MODULES = ["other", "eventsetup", "idle"]
+
+
+def get_timing_files(timing_dir: str, name: str):
+    # rank -> summary of the run, for the summaries that exist
+    files = {}
+    for rank in RANKS:
+        path = os.path.join(timing_dir, "%s_%s.json" % (rank, name))
+        if os.path.isfile(path):
+            files[rank] = path
+    return files
+
+
+def load_fast_timer_json(path: str):
+    with open(path) as f:
+        summary = json.load(f)
+    # the job total, if listed with the modules, would count everything twice
+    modules = [m for m in summary.get("modules", []) if m.get("type") != "Job"]
+    table = {"type": np.array([m["type"] for m in modules], dtype=object),
+             "label": np.array([m["label"] for m in modules], dtype=object)}
+    for column in NUMERIC_COLUMNS:
+        table[column] = np.array([float(m.get(column, 0)) for m in modules])
+    return table
+
+
+def as_dataframe(table: dict):
+    import pandas as pd
+    return pd.DataFrame(table)
+
+
+def store_timing(store: ResultsStore, campaign: str, key: str, files: dict):
+    for rank, path in files.items():
+        table = load_fast_timer_json(path)
+        store.add_modules(campaign, key, rank, table)
+
+
+# Module rows of the runs in the results database, as a columnar table
+def load_module_table(store: ResultsStore, campaign=None, label=None, rank=None):
+    query = ("SELECT runs.label, runs.threads, runs.streams, runs.key, modules.rank, modules.type, modules.label, "
+             "modules.events, modules.time_real, modules.time_thread FROM modules "
+             "JOIN runs ON runs.campaign = modules.campaign AND runs.key = modules.key WHERE 1")
+    params = []
+    for column, value in [("runs.campaign", campaign), ("modules.rank", rank)]:
+        if value is not None:
+            query += " AND %s = ?" % column
+            params.append(value)
+    if label is not None:
+        query += " AND runs.label LIKE ?"
+        params.append(label)
+    with store.connect() as db:
+        rows = db.execute(query, params).fetchall()
+    columns = ["setup", "threads", "streams", "key", "rank", "type", "module", "events", "time_real", "time_thread"]
+    table = {c: np.array([row[i] for row in rows], dtype=object) for i, c in enumerate(columns)}
+    for c in ["threads", "streams", "events", "time_real", "time_thread"]:
+        table[c] = table[c].astype(float)
+    return table
+
+
+# Real and CPU time per event of each module (or module type, by="type") of each
+# (setup, ts, rank), averaged over the runs. The fraction is that of the real time of all
+# the modules of the rank, idle time excluded.
+def summarize_modules(table: dict, by="module"):
+    if len(table["key"]) == 0:
+        return []
+    with np.errstate(invalid="ignore", divide="ignore"):
+        real = np.where(table["events"] > 0, table["time_real"] / table["events"], 0)
+        cpu = np.where(table["events"] > 0, table["time_thread"] / table["events"], 0)
+
+    groups = list(zip(table["setup"], table["threads"], table["streams"], table["rank"]))
+    keys = [g + (name,) for g, name in zip(groups, table[by])]
+    unique_groups = sorted(set(groups))
+    unique_keys = sorted(set(keys))
+    group_index = {g: i for i, g in enumerate(unique_groups)}
+    key_index = {k: i for i, k in enumerate(unique_keys)}
+    g = np.array([group_index[x] for x in groups])
+    k = np.array([key_index[x] for x in keys])
+
+    # sums over the runs (and over the modules of a type), divided by the number of runs
+    runs = np.array([len(set(table["key"][g == i])) for i in range(len(unique_groups))])
+    busy = np.bincount(g, weights=np.where(table["module"] != "idle", real, 0))
+    real_sum = np.bincount(k, weights=real)
+    cpu_sum = np.bincount(k, weights=cpu)
+    key_group = np.array([group_index[key[:4]] for key in unique_keys])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = real_sum / busy[key_group]
+
+    summary = []
+    for i, key in enumerate(unique_keys):
+        n = runs[key_group[i]]
+        summary.append({"setup": key[0], "ts": [int(key[1]), int(key[2])], "rank": key[3], by: key[4],
+                        "time_real": real_sum[i] / n, "time_thread": cpu_sum[i] / n,
+                        "fraction": fraction[i], "runs": int(n)})
+    summary.sort(key=lambda s: (s["setup"], s["ts"], s["rank"], -s["time_real"]))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-module timing of the benchmark runs (FastTimerService)")
+    parser.add_argument("--db", default=DEFAULT_DB)
+    parser.add_argument("--campaign")
+    parser.add_argument("--label", help="SQL LIKE pattern on the setup label")
+    parser.add_argument("--rank", choices=RANKS)
+    parser.add_argument("--by", choices=["module", "type"], default="module")
+    parser.add_argument("--top", type=int, default=15, help="modules shown per setup, ts and rank (0 = all)")
+    parser.add_argument("--include-pseudo", action="store_true", help="also show other/eventsetup/idle")
+    parser.add_argument("--csv", action="store_true")
+    args = parser.parse_args()
+
+    table = load_module_table(ResultsStore(args.db), args.campaign, args.label, args.rank)
+    summary = summarize_modules(table, args.by)
+    if len(summary) == 0:
+        print("No timing summaries found")
+        sys.exit(1)
+    if not args.include_pseudo:
+        summary = [s for s in summary if s[args.by] not in PSEUDO_MODULES]
+
+    if args.csv:
+        print("setup,threads,streams,rank,%s,runs,time_real_ms,time_thread_ms,fraction" % args.by)
+    shown = {}
+    for s in summary:
+        group = (s["setup"], tuple(s["ts"]), s["rank"])
+        shown[group] = shown.get(group, 0) + 1
+        if args.top > 0 and shown[group] > args.top:
+            continue
+        if args.csv:
+            print("%s,%d,%d,%s,%s,%d,%.4f,%.4f,%.4f" % (s["setup"], *s["ts"], s["rank"], s[args.by], s["runs"],
+                                                       s["time_real"], s["time_thread"], s["fraction"]))
+            continue
+        if shown[group] == 1:
+            print("%s [t,s] = [%d,%d], %s rank (%d runs), ms/event:" % (s["setup"], *s["ts"], s["rank"], s["runs"]))
+        print("  %-60s real %8.3f  cpu %8.3f  %5.1f%%" % (s[args.by], s["time_real"], s["time_thread"],
+                                                          100 * s["fraction"]))
+
+
+if __name__ == "__main__":
+    main()
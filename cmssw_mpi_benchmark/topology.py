@@ -0,0 +1,369 @@
+import argparse
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+
+
+# CPU / NUMA topology of the benchmark hosts, and allocation of the CPU sets of the ranks.
+#
+# The model of a host is read from /sys (see read_topology) and is a plain dict:
+#   cpus    one entry per online logical CPU: id, package (socket), core (smallest CPU id of
+#           its SMT siblings), siblings, node (NUMA node) and l3 (smallest CPU id sharing its L3)
+#   nodes   one entry per NUMA node: id, cpus, distances (to the nodes, in id order)
+#   gpus    NVIDIA GPUs in PCI bus order (= CUDA_DEVICE_ORDER=PCI_BUS_ID): index, pci, node
+#   nics    InfiniBand / RoCE HCAs: name, node, ports {port: {state, link_layer}}
+# Remote hosts are discovered by running this script through the launcher of the host
+# ("launcher" in [hosts.X], "ssh {hostname}" by default), so the harness directory must be
+# on a shared filesystem. Models are cached in topology/<host>.json: delete the file (and
+# the plan cache) after a hardware change. Hosts without a hostname (NGT nodes, reached
+# through the MPI hostfile) cannot be discovered: write their model to the file, or give
+# it with topology = "<file>".
+#
+# CPU sets are then allocated from a placement policy, e.g. in a [[setup]] or [hosts.X]
+#   placement_local = { near = "nic:mlx5_2" }          # physical cores on the node of mlx5_2
+#   placement_remote = { near = "socket:1", smt = true, reserve = [32] }
+# with
+#   count    number of CPUs (default: threads of the ts pair)
+#   near     "nic:<device>", "gpu:<index>", "node:<id>" or "socket:<id>" (default: anywhere)
+#   policy   how the CPUs are picked among the cores of the domain, whatever the numbering
+#            of the host:
+#              compact-physical  one CPU per physical core, consecutive cores (default)
+#              smt-pairs         both SMT siblings of consecutive cores (also: smt = true)
+#              scatter-l3        one CPU per physical core, round-robin over the L3 domains
+#                                (CCX / CCD on Milan and Genoa)
+#              one-per-l3        one CPU per L3 domain
+#   reserve  CPUs never used, e.g. [0] for housekeeping
+#   spill    if the domain of "near" is too small, continue on the closest NUMA nodes instead
+#            of failing (default false)
+# The policy of a rank can also be given alone with policy_local / policy_remote, e.g. to
+# compare them at a fixed ts:  sweep = { policy_local = ["compact-physical", "smt-pairs"] }
+#
+# UCX devices: ucx_net_devices = "auto" picks the active HCA port closest (NUMA distance) to
+# the CPUs of the rank, "auto-remote" the farthest one, e.g. to measure the cross-socket
+# penalty with  sweep = { ucx_net_devices_local = ["auto", "auto-remote"] }. A warning is
+# printed when the device of a rank is not on the NUMA node of its CPUs.
+#
+# Memory: without a policy the pages follow first touch, so TBB threads or UCX progress
+# threads running elsewhere can leave event data and receive buffers on the wrong node.
+# mem_policy (on the host, or mem_policy_local / mem_policy_remote) adds to numactl
+#   localalloc  allocate on the node of the CPU that touches the page
+#   membind     only on the nodes of the CPUs of the rank
+#   preferred   on the node of most of the CPUs of the rank, elsewhere if full
+#   interleave  round-robin over all the nodes
+# unless mem_nodes gives the nodes. See the milan_genoa_ib100G_cpuonly_mem setup of
+# campaigns/default.toml for a comparison of the policies.
+#
+# Usage:
+#   python3 topology.py [--json]    prints the model of this machine
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(HARNESS_DIR, "topology")
+
+POLICIES = ["compact-physical", "smt-pairs", "scatter-l3", "one-per-l3"]
+
+
+def read_file(path: str, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def parse_cpu_list(text: str):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = []
+    for part in text.split(","):
+        if part == "":
+            continue
+        first, _, last = part.partition("-")
+        cpus += list(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def read_topology(sys_root="/sys"):
+    cpu_dir = os.path.join(sys_root, "devices/system/cpu")
+    node_dir = os.path.join(sys_root, "devices/system/node")
+
+    nodes = []
+    node_of_cpu = {}
+    for name in sorted(os.listdir(node_dir) if os.path.isdir(node_dir) else [], key=lambda n: n[4:]):
+        if not (name.startswith("node") and name[4:].isdigit()):
+            continue
+        node = int(name[4:])
+        cpus = parse_cpu_list(read_file(os.path.join(node_dir, name, "cpulist"), ""))
+        distances = [int(d) for d in read_file(os.path.join(node_dir, name, "distance"), "").split()]
+        nodes.append({"id": node, "cpus": cpus, "distances": distances})
+        node_of_cpu.update((cpu, node) for cpu in cpus)
+    nodes.sort(key=lambda n: n["id"])
+
+    cpus = []
+    for cpu in parse_cpu_list(read_file(os.path.join(cpu_dir, "online"), "0")):
+        topology = os.path.join(cpu_dir, "cpu%d" % cpu, "topology")
+        siblings = parse_cpu_list(read_file(os.path.join(topology, "thread_siblings_list"), str(cpu)))
+        l3 = read_file(os.path.join(cpu_dir, "cpu%d" % cpu, "cache/index3/shared_cpu_list"))
+        cpus.append({"id": cpu,
+                     "package": int(read_file(os.path.join(topology, "physical_package_id"), "0")),
+                     "core": min(siblings),
+                     "siblings": siblings,
+                     "node": node_of_cpu.get(cpu, 0),
+                     "l3": min(parse_cpu_list(l3)) if l3 else None})
+    if len(nodes) == 0:
+        nodes = [{"id": 0, "cpus": [c["id"] for c in cpus], "distances": [10]}]
+
+    return {"hostname": socket.gethostname(), "cpus": cpus, "nodes": nodes,
+            "gpus": read_gpus(sys_root), "nics": read_nics(sys_root)}
+
+
+def read_gpus(sys_root: str):
+    pci_dir = os.path.join(sys_root, "bus/pci/devices")
+    gpus = []
+    for pci in sorted(os.listdir(pci_dir) if os.path.isdir(pci_dir) else []):
+        device = os.path.join(pci_dir, pci)
+        # NVIDIA, display controller class (VGA or 3D)
+        if read_file(os.path.join(device, "vendor")) == "0x10de" and \
+                (read_file(os.path.join(device, "class"), "") or "").startswith("0x03"):
+            gpus.append({"index": len(gpus), "pci": pci, "node": int(read_file(os.path.join(device, "numa_node"), "-1"))})
+    return gpus
+
+
+def read_nics(sys_root: str):
+    ib_dir = os.path.join(sys_root, "class/infiniband")
+    nics = []
+    for name in sorted(os.listdir(ib_dir) if os.path.isdir(ib_dir) else []):
+        ports = {}
+        ports_dir = os.path.join(ib_dir, name, "ports")
+        for port in sorted(os.listdir(ports_dir) if os.path.isdir(ports_dir) else []):
+            # e.g. "4: ACTIVE"
+            state = read_file(os.path.join(ports_dir, port, "state"), "")
+            ports[port] = {"state": state.split(":")[-1].strip(),
+                           "link_layer": read_file(os.path.join(ports_dir, port, "link_layer"), "")}
+        nics.append({"name": name, "node": int(read_file(os.path.join(ib_dir, name, "device/numa_node"), "-1")),
+                     "ports": ports})
+    return nics
+
+
+# An empty hostname (NGT hosts, reached through the MPI hostfile) is not known to be this machine
+def is_this_machine(hostname: str):
+    return hostname in ["localhost", socket.gethostname(), socket.getfqdn()]
+
+
+# File the model of a host is cached in (or given with "topology")
+def get_topology_file(name: str, host: dict):
+    if "topology" in host:
+        return host["topology"] if os.path.isabs(host["topology"]) else os.path.join(HARNESS_DIR, host["topology"])
+    return os.path.join(CACHE_DIR, name + ".json")
+
+
+# Model of a host of a campaign spec, from the cache, this machine or through its launcher
+def get_host_topology(name: str, host: dict):
+    cache_file = get_topology_file(name, host)
+    if os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)
+
+    hostname = host.get("hostname", "")
+    if hostname == "":
+        print("Host %s has no hostname, its topology cannot be discovered. Write it to %s, e.g. with "
+              "'python3 topology.py --json' on the host" % (name, cache_file))
+        sys.exit(1)
+    if is_this_machine(hostname):
+        topology = read_topology()
+    else:
+        launcher = host.get("launcher", "ssh {hostname}").format(**host)
+        cmd = shlex.split(launcher) + ["python3", os.path.abspath(__file__), "--json"]
+        print("Discovering the topology of %s: %s" % (name, " ".join(cmd)))
+        try:
+            topology = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=120).stdout)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            print("Could not discover the topology of host %s (%s). Write it to %s, e.g. with "
+                  "'python3 topology.py --json' on the host" % (name, e, cache_file))
+            sys.exit(1)
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    with open(cache_file, "w") as f:
+        json.dump(topology, f, indent=1)
+    return topology
+
+
+def get_domain(topology: dict, near: str):
+    # NUMA node closest to the device (or the socket) given by "near", as (kind, id)
+    kind, _, value = near.partition(":")
+    if kind == "node":
+        return "node", int(value)
+    if kind == "socket":
+        return "socket", int(value)
+    if kind == "nic":
+        device = value.split(":")[0]  # "mlx5_2:1" -> mlx5_2
+        nic = next((n for n in topology["nics"] if n["name"] == device), None)
+        if nic is None:
+            raise ValueError("no NIC %s on %s" % (device, topology["hostname"]))
+        return "node", max(nic["node"], 0)
+    if kind == "gpu":
+        gpu = next((g for g in topology["gpus"] if g["index"] == int(value)), None)
+        if gpu is None:
+            raise ValueError("no GPU %s on %s" % (value, topology["hostname"]))
+        return "node", max(gpu["node"], 0)
+    raise ValueError("unknown placement near = %s" % near)
+
+
+# Orders the physical cores: those of the domain first, then (for spilling) those of the
+# other NUMA nodes by distance. Returns lists of cores (lists of CPU ids) and the number
+# of cores in the domain
+def order_cores(topology: dict, near: str):
+    cores = {}
+    for cpu in topology["cpus"]:
+        cores.setdefault(cpu["core"], []).append(cpu)
+    node_distance = {}
+    if near:
+        kind, value = get_domain(topology, near)
+        if kind == "node":
+            home = next((n for n in topology["nodes"] if n["id"] == value), None)
+            if home is None:
+                raise ValueError("no NUMA node %d on %s" % (value, topology["hostname"]))
+            ids = [n["id"] for n in topology["nodes"]]
+            node_distance = dict(zip(ids, home["distances"] or [0] * len(ids)))
+            in_domain = lambda cpus: cpus[0]["node"] == value
+        else:
+            in_domain = lambda cpus: cpus[0]["package"] == value
+    else:
+        in_domain = lambda cpus: True
+
+    ordered = sorted(cores.values(), key=lambda cpus: (not in_domain(cpus), node_distance.get(cpus[0]["node"], 0),
+                                                       cpus[0]["core"]))
+    return [[c["id"] for c in sorted(cpus, key=lambda c: c["id"])] for cpus in ordered], \
+        sum(1 for cpus in cores.values() if in_domain(cpus))
+
+
+def interleave(groups: list):
+    # round-robin over the groups: a1, b1, c1, a2, b2, ...
+    items = []
+    for i in range(max((len(g) for g in groups), default=0)):
+        items += [g[i] for g in groups if i < len(g)]
+    return items
+
+
+def group_by_l3(topology: dict, cores: list):
+    # cores grouped by L3 domain, in order of first appearance (the socket if the L3 is unknown)
+    cpus = {cpu["id"]: cpu for cpu in topology["cpus"]}
+    groups = {}
+    for core in cores:
+        cpu = cpus[core[0]]
+        groups.setdefault(cpu["l3"] if cpu["l3"] is not None else -1 - cpu["package"], []).append(core)
+    return list(groups.values())
+
+
+def allocate_cpus(topology: dict, count: int, placement: dict, exclude=()):
+    placement = dict(placement)
+    policy = placement.get("policy", "smt-pairs" if placement.get("smt", False) else "compact-physical")
+    if policy not in POLICIES:
+        raise ValueError("unknown placement policy %s. Supported are %s" % (policy, ", ".join(POLICIES)))
+    reserved = set(placement.get("reserve", [])) | set(exclude)
+    cores, n_domain = order_cores(topology, placement.get("near", ""))
+
+    # a core partly used by another rank (or reserved) is not shared
+    usable = [[core for core in part if not any(cpu in reserved for cpu in core)]
+              for part in [cores[:n_domain], cores[n_domain:] if placement.get("spill", False) else []]]
+    if policy == "scatter-l3":
+        usable = [interleave(group_by_l3(topology, part)) for part in usable]
+    elif policy == "one-per-l3":
+        usable = [[group[0] for group in group_by_l3(topology, part)] for part in usable]
+
+    cpus = []
+    for core in usable[0] + usable[1]:
+        cpus += core if policy == "smt-pairs" else core[:1]
+    cpus = cpus[:count]
+    if len(cpus) < count:
+        raise ValueError("only %d of the %d CPUs requested are available on %s with placement %s" %
+                         (len(cpus), count, topology["hostname"], placement))
+    return cpus
+
+
+def get_distance(topology: dict, a: int, b: int):
+    # unknown nodes (-1) are treated as remote
+    node = next((n for n in topology["nodes"] if n["id"] == a), None)
+    ids = [n["id"] for n in topology["nodes"]]
+    if node is None or b not in ids or len(node["distances"]) != len(ids):
+        return 10 if a == b else 255
+    return node["distances"][ids.index(b)]
+
+
+def get_home_node(topology: dict, cpus: list):
+    # NUMA node of most of the CPUs
+    nodes = [c["node"] for c in topology["cpus"] if c["id"] in cpus]
+    return max(set(nodes), key=nodes.count) if nodes else 0
+
+
+def select_nic(topology: dict, cpus: list, farthest=False):
+    # "device:port" of the active HCA port closest to (or farthest from) the CPUs
+    home = get_home_node(topology, cpus)
+    ports = [(get_distance(topology, home, nic["node"]), nic["name"], port)
+             for nic in topology["nics"] for port, p in nic["ports"].items() if p["state"] == "ACTIVE"]
+    if len(ports) == 0:
+        raise ValueError("no active InfiniBand port on %s" % topology["hostname"])
+    distance, name, port = min(ports, key=lambda p: (-p[0] if farthest else p[0], p[1], p[2]))
+    return "%s:%s" % (name, port)
+
+
+def check_nic_locality(topology: dict, cpus: list, devices: str):
+    # warnings for the UCX devices ("mlx5_2:1,mlx5_0:1") that are not local to the CPUs. The
+    # node of a NIC reads -1 on single-node hosts and when the kernel does not know it: it is
+    # not checked then
+    warnings = []
+    home = get_home_node(topology, cpus)
+    for device in devices.split(","):
+        name, _, port = device.partition(":")
+        nic = next((n for n in topology["nics"] if n["name"] == name), None)
+        if nic is None:
+            warnings.append("%s not found on %s" % (name, topology["hostname"]))
+        elif nic["node"] >= 0 and nic["node"] != home:
+            warnings.append("%s is on NUMA node %d, the CPUs on node %d: MPI messages cross the sockets" %
+                            (name, nic["node"], home))
+        elif port and nic["ports"].get(port, {}).get("state") != "ACTIVE":
+            warnings.append("port %s of %s is not active" % (port, name))
+    return warnings
+
+
+def get_memory_nodes(topology: dict, cpus: list, policy: str):
+    # numactl nodes of a memory policy, for the CPUs of a rank
+    if policy == "interleave":
+        return "all"
+    if policy == "preferred":
+        return str(get_home_node(topology, cpus))
+    return ",".join(map(str, sorted({c["node"] for c in topology["cpus"] if c["id"] in cpus})))
+
+
+def print_topology(topology: dict):
+    print("Host %s: %d CPUs, %d cores, %d sockets, %d NUMA nodes" %
+          (topology["hostname"], len(topology["cpus"]), len({c["core"] for c in topology["cpus"]}),
+           len({c["package"] for c in topology["cpus"]}), len(topology["nodes"])))
+    for node in topology["nodes"]:
+        cpus = [c for c in topology["cpus"] if c["node"] == node["id"]]
+        print("  node %d: sockets %s, %d cores, %d L3 domains, CPUs %s, distances %s" %
+              (node["id"], sorted({c["package"] for c in cpus}), len({c["core"] for c in cpus}),
+               len({c["l3"] for c in cpus}), ",".join(map(str, node["cpus"])), node["distances"]))
+    for gpu in topology["gpus"]:
+        print("  GPU %d (%s) on node %d" % (gpu["index"], gpu["pci"], gpu["node"]))
+    for nic in topology["nics"]:
+        print("  NIC %s on node %d, ports %s" % (nic["name"], nic["node"],
+                                                ", ".join("%s %s %s" % (p, v["state"], v["link_layer"])
+                                                          for p, v in nic["ports"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU / NUMA / GPU / NIC topology of this machine")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--sys", default="/sys", help="root of sysfs (for tests on copies)")
+    args = parser.parse_args()
+    topology = read_topology(args.sys)
+    if args.json:
+        print(json.dumps(topology))
+    else:
+        print_topology(topology)
+
+
+if __name__ == "__main__":
+    main()